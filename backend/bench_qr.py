@@ -0,0 +1,179 @@
+"""
+Benchmark de los QR de entradas (qr_codecs).
+
+Tabla de codecs, por formato:
+  - payload:    caracteres del payload
+  - version QR: versión del símbolo con las opciones de render del codec
+  - codificar:  µs por payload (cifrado / firma + codificación)
+  - validar:    µs por decodificar + verificar (lo que cuesta un escaneo antes de la base)
+
+Tabla de etapas, por payload x corrección de errores x box_size, con las mismas
+funciones que usa renderizar_qr:
+  - cifrado:    codificar el payload (µs)
+  - matriz:     construir_matriz, elección de versión + módulos (µs)
+  - raster:     rasterizar con PIL (µs)
+  - png:        codificar_png (µs) y tamaño del PNG resultante
+  - total:      suma de las etapas (ms por entrada)
+
+No necesita Mongo ni el servidor: usa llaves de prueba. Con --csv las filas de etapas
+se escriben también en un CSV para compararlas entre versiones.
+
+Uso:
+    python bench_qr.py [--iteraciones 2000] [--iteraciones-render 30]
+                       [--ec L,M,Q,H] [--box 6,10,12] [--csv etapas.csv]
+"""
+import argparse
+import csv
+import time
+import uuid
+
+import qrcode
+
+from qr_codecs import (
+    cargar_llavero, crear_registro, generar_hash,
+    construir_matriz, rasterizar, codificar_png,
+)
+
+NIVELES_EC = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+
+COLUMNAS_ETAPAS = (
+    "payload", "caracteres", "ec", "box_size", "version_qr",
+    "cifrado_us", "matriz_us", "raster_us", "png_us", "png_bytes", "total_ms",
+)
+
+
+def datos_v1(asiento: str = "Mesa 12-Silla4", nombre: str = "María Fernanda Contreras") -> dict:
+    """Mismos campos que arma comprar-entrada para el QR v1"""
+    datos = {
+        "entrada_id": str(uuid.uuid4()),
+        "codigo_alfanumerico": "CF-2026-A1B2C3-XY9Z",
+        "evento_id": str(uuid.uuid4()),
+        "nombre_evento": "Concierto de la Feria de San Sebastián",
+        "nombre_comprador": nombre,
+        "email_comprador": "maria.contreras@example.com",
+        "telefono_comprador": "+58 414 1234567",
+        "numero_entrada": 1,
+        "asiento": asiento,
+    }
+    datos["hash"] = generar_hash(datos)
+    return datos
+
+
+def argumentos(version: int) -> dict:
+    entrada_id, evento_id = str(uuid.uuid4()), str(uuid.uuid4())
+    if version == 1:
+        return {"datos": datos_v1()}
+    if version == 2:
+        return {"entrada_id": entrada_id, "evento_id": evento_id, "codigo_alfanumerico": "CF-2026-A1B2C3-XY9Z"}
+    return {"entrada_id": entrada_id, "evento_id": evento_id, "emision": 0}
+
+
+def casos_payload(codecs) -> list:
+    """(nombre, codec, argumentos): los tres formatos y un v1 con datos largos"""
+    casos = [(f"v{version}", codec, argumentos(version)) for version, codec in sorted(codecs.por_version.items())]
+    largo = datos_v1(asiento=None, nombre="María Fernanda de los Ángeles Contreras Villamizar de Pérez")
+    casos.insert(1, ("v1-largo", codecs[1], {"datos": largo}))
+    return casos
+
+
+def medir_us(funcion, iteraciones: int) -> float:
+    funcion()  # calentamiento
+    inicio = time.perf_counter()
+    for _ in range(iteraciones):
+        funcion()
+    return (time.perf_counter() - inicio) / iteraciones * 1e6
+
+
+def tabla_codecs(codecs, iteraciones: int):
+    print(f"{'codec':<6} {'payload':>8} {'version QR':>11} {'codificar':>12} {'validar':>12}")
+    for version, codec in sorted(codecs.por_version.items()):
+        datos = argumentos(version)
+        payload = codec.codificar(**datos)
+
+        # La validación despacha por prefijo: el payload debe volver a su codec y verificar
+        if codecs.para_payload(payload) is not codec or not codec.verificar(codec.decodificar(payload)):
+            raise SystemExit(f"v{version}: el payload no verifica")
+
+        codificar = medir_us(lambda: codec.codificar(**datos), iteraciones)
+        validar = medir_us(lambda: codec.verificar(codec.decodificar(payload)), iteraciones)
+        version_qr = construir_matriz(payload, **codec.opciones_render).version
+        print(f"v{version:<5} {len(payload):>8} {version_qr:>11} {codificar:>10.1f}µs {validar:>10.1f}µs")
+
+
+def medir_etapas(nombre: str, codec, datos: dict, ec: str, box_size: int, iteraciones: int) -> dict:
+    payload = codec.codificar(**datos)
+    opciones = {"error_correction": NIVELES_EC[ec], "box_size": box_size}
+    qr = construir_matriz(payload, **opciones)
+    img = rasterizar(qr)
+
+    fila = {
+        "payload": nombre,
+        "caracteres": len(payload),
+        "ec": ec,
+        "box_size": box_size,
+        "version_qr": qr.version,
+        "cifrado_us": medir_us(lambda: codec.codificar(**datos), iteraciones),
+        "matriz_us": medir_us(lambda: construir_matriz(payload, **opciones), iteraciones),
+        "raster_us": medir_us(lambda: rasterizar(qr), iteraciones),
+        "png_us": medir_us(lambda: codificar_png(img), iteraciones),
+        "png_bytes": len(codificar_png(img)),
+    }
+    fila["total_ms"] = (fila["cifrado_us"] + fila["matriz_us"] + fila["raster_us"] + fila["png_us"]) / 1000
+    return fila
+
+
+def tabla_etapas(codecs, niveles: list, cajas: list, iteraciones: int) -> list:
+    print(
+        f"{'payload':<9} {'car':>4} {'ec':>2} {'box':>4} {'ver':>4} {'cifrado':>10} {'matriz':>10} "
+        f"{'raster':>10} {'png':>10} {'png KiB':>8} {'total':>9}"
+    )
+    filas = []
+    for nombre, codec, datos in casos_payload(codecs):
+        for ec in niveles:
+            for box_size in cajas:
+                fila = medir_etapas(nombre, codec, datos, ec, box_size, iteraciones)
+                filas.append(fila)
+                print(
+                    f"{fila['payload']:<9} {fila['caracteres']:>4} {ec:>2} {box_size:>4} {fila['version_qr']:>4} "
+                    f"{fila['cifrado_us']:>8.1f}µs {fila['matriz_us']:>8.1f}µs {fila['raster_us']:>8.1f}µs "
+                    f"{fila['png_us']:>8.1f}µs {fila['png_bytes'] / 1024:>8.1f} {fila['total_ms']:>7.2f}ms"
+                )
+    return filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iteraciones", type=int, default=2000, help="iteraciones de la tabla de codecs")
+    parser.add_argument("--iteraciones-render", type=int, default=30, help="iteraciones por etapa de render")
+    parser.add_argument("--ec", default="L,M,Q,H", help="niveles de corrección de errores")
+    parser.add_argument("--box", default="6,10,12", help="valores de box_size")
+    parser.add_argument("--csv", help="escribe la tabla de etapas en este archivo")
+    args = parser.parse_args()
+
+    niveles = [nivel.strip().upper() for nivel in args.ec.split(",")]
+    if any(nivel not in NIVELES_EC for nivel in niveles):
+        raise SystemExit(f"--ec admite {', '.join(NIVELES_EC)}")
+    cajas = [int(caja) for caja in args.box.split(",")]
+
+    codecs = crear_registro(cargar_llavero(b"bench_cifrado_" * 3, b"bench_hmac"))
+
+    tabla_codecs(codecs, args.iteraciones)
+    print()
+    filas = tabla_etapas(codecs, niveles, cajas, args.iteraciones_render)
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as archivo:
+            escritor = csv.DictWriter(archivo, fieldnames=COLUMNAS_ETAPAS)
+            escritor.writeheader()
+            for fila in filas:
+                escritor.writerow({k: round(v, 2) if isinstance(v, float) else v for k, v in fila.items()})
+        print(f"\n{len(filas)} filas en {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark de serialización de /eventos con 1000 eventos.
+
+Compara peticiones/segundo de:
+  - antes:    handler que devuelve dicts con response_model=List[Evento] (FastAPI valida y re-serializa)
+  - despues:  TypeAdapter precompilado (serializar_lista) devolviendo Response con bytes
+  - cacheado: bytes ya serializados en cache_catalogo (lo que sirve /eventos entre invalidaciones)
+
+Las peticiones se despachan directamente contra la app ASGI, sin red ni Mongo.
+
+Uso:
+    python bench_serializacion.py [--eventos 1000] [--peticiones 200]
+"""
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import List
+
+# server.py abre el cliente de Mongo al importarse (la conexión es perezosa)
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'bench_serializacion')
+
+from fastapi import FastAPI
+from fastapi.responses import Response
+
+from server import Evento, ADAPTADOR_EVENTOS, serializar_lista
+
+
+def generar_eventos(cantidad: int) -> List[dict]:
+    """Documentos con la forma en que vienen de Mongo (fecha_creacion como string ISO)"""
+    return [
+        {
+            "id": f"evento-{i}",
+            "nombre": f"Evento de prueba {i}",
+            "descripcion": "Descripción del evento de la Feria de San Sebastián " * 4,
+            "fecha": "2026-01-20",
+            "hora": "20:00",
+            "ubicacion": "Plaza de Toros de San Cristóbal",
+            "categoria": "conciertos",
+            "precio": 50.0 + i % 7,
+            "imagen": f"/api/uploads/{i:08d}-0000-4000-8000-000000000000.jpg",
+            "asientos_disponibles": 5000,
+            "tipo_asientos": "mixto",
+            "configuracion_asientos": {
+                "mesas": [{"id": m, "nombre": f"Mesa {m}", "sillas": 10, "precio": 80, "categoria": "VIP"} for m in range(1, 6)],
+                "entradas_generales": 500,
+                "categorias_generales": [{"nombre": "General", "capacidad": 500, "precio": 50}],
+            },
+            "fecha_creacion": datetime(2025, 12, 20, tzinfo=timezone.utc).isoformat(),
+        }
+        for i in range(cantidad)
+    ]
+
+
+def crear_app(eventos: List[dict]) -> FastAPI:
+    app = FastAPI()
+    cuerpo_cacheado = serializar_lista(ADAPTADOR_EVENTOS, eventos)
+
+    @app.get("/antes", response_model=List[Evento])
+    async def antes():
+        # Igual que el handler original: convertir fechas y dejar que FastAPI valide
+        items = [dict(e) for e in eventos]
+        for item in items:
+            item['fecha_creacion'] = datetime.fromisoformat(item['fecha_creacion'])
+        return items
+
+    @app.get("/despues")
+    async def despues():
+        return Response(content=serializar_lista(ADAPTADOR_EVENTOS, eventos), media_type="application/json")
+
+    @app.get("/cacheado")
+    async def cacheado():
+        return Response(content=cuerpo_cacheado, media_type="application/json")
+
+    return app
+
+
+async def llamar(app: FastAPI, path: str) -> bytes:
+    """Una petición GET mínima por ASGI; devuelve el cuerpo"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": b"", "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    partes = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(mensaje):
+        if mensaje["type"] == "http.response.body":
+            partes.append(mensaje.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(partes)
+
+
+async def medir(app: FastAPI, path: str, peticiones: int) -> float:
+    await llamar(app, path)  # calentamiento
+    inicio = time.perf_counter()
+    for _ in range(peticiones):
+        await llamar(app, path)
+    return peticiones / (time.perf_counter() - inicio)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--eventos", type=int, default=1000)
+    parser.add_argument("--peticiones", type=int, default=200)
+    args = parser.parse_args()
+
+    eventos = generar_eventos(args.eventos)
+    app = crear_app(eventos)
+
+    # Las tres variantes deben producir el mismo JSON
+    cuerpos = {ruta: await llamar(app, f"/{ruta}") for ruta in ("antes", "despues", "cacheado")}
+    if len(set(cuerpos.values())) != 1:
+        raise SystemExit("Las respuestas no coinciden: " + ", ".join(f"{r}={len(c)}B" for r, c in cuerpos.items()))
+
+    print(f"{args.eventos} eventos, {len(cuerpos['antes']) / 1024:.0f} KiB por respuesta, {args.peticiones} peticiones\n")
+    base = None
+    for ruta in ("antes", "despues", "cacheado"):
+        rps = await medir(app, f"/{ruta}", args.peticiones)
+        base = base or rps
+        print(f"{ruta:<10} {rps:>10.1f} req/s   x{rps / base:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+"""
+Campos derivados de un evento: capacidad total, capacidad por categoría y rango de precios.
+
+Se calculan al escribir el evento (crear, actualizar, configurar asientos) y se guardan
+en el propio documento, así las lecturas no recorren mesas ni categorías y todos los
+caminos usan la misma fórmula:
+
+    capacidad = sillas de las mesas (mesas/mixto)
+              + categorías generales (general/mixto); si no hay, entradas_generales (mixto)
+                o capacidad (general)
+    si la configuración no aporta nada, se usa la capacidad base (asientos_disponibles).
+
+La misma fórmula da los cupos (cupos_evento): un contador por tipo y categoría que la
+compra descuenta atómicamente en el documento del evento.
+
+Los eventos anteriores a estos campos solo tienen asientos_disponibles, que en los
+generales ya viene descontado: capacidad_legado reconstruye la capacidad base.
+"""
+from typing import List, Optional
+
+SILLAS_POR_MESA_DEFECTO = 10
+
+# Si un update toca alguno de estos campos hay que volver a derivar
+CAMPOS_ORIGEN = ("tipo_asientos", "configuracion_asientos", "asientos_disponibles", "precio")
+
+
+def _entero(valor, defecto: int = 0) -> int:
+    try:
+        return max(int(valor), 0)
+    except (TypeError, ValueError):
+        return defecto
+
+
+def _precio(valor, defecto: float) -> float:
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return defecto
+
+
+def categoria_mesa(tipo_asientos: str, mesa: dict) -> str:
+    # Mismo valor por defecto que el inventario de `asientos`
+    return mesa.get('categoria') or ('VIP' if tipo_asientos == 'mixto' else 'General')
+
+
+def clave_cupo(tipo: str, categoria: str) -> str:
+    """Identificador de un cupo: "mesa:VIP", "general:General"; sillas y entradas generales no comparten cupo"""
+    return f"{tipo}:{categoria}"
+
+
+def _cupos_y_precios(evento: dict, capacidad_base: Optional[int]) -> tuple:
+    """(clave -> {tipo, categoria, capacidad}, precios) según la fórmula del módulo"""
+    tipo_asientos = evento.get('tipo_asientos') or 'general'
+    config = evento.get('configuracion_asientos') or {}
+    precio_base = _precio(evento.get('precio'), 0.0)
+
+    cupos = {}
+    precios = []
+
+    def sumar(tipo: str, categoria: str, cantidad: int, precio):
+        if cantidad <= 0:
+            return
+        cupo = cupos.setdefault(clave_cupo(tipo, categoria), {"tipo": tipo, "categoria": categoria, "capacidad": 0})
+        cupo["capacidad"] += cantidad
+        precios.append(_precio(precio, precio_base))
+
+    if tipo_asientos in ('mesas', 'mixto'):
+        for mesa in config.get('mesas') or []:
+            sillas = _entero(mesa.get('sillas', SILLAS_POR_MESA_DEFECTO), SILLAS_POR_MESA_DEFECTO)
+            sumar('mesa', categoria_mesa(tipo_asientos, mesa), sillas, mesa.get('precio', precio_base))
+
+    if tipo_asientos in ('general', 'mixto'):
+        categorias_generales = [c for c in config.get('categorias_generales') or [] if _entero(c.get('capacidad')) > 0]
+        if categorias_generales:
+            for cat in categorias_generales:
+                sumar('general', cat.get('nombre') or 'General', _entero(cat.get('capacidad')), cat.get('precio', precio_base))
+        elif tipo_asientos == 'mixto':
+            sumar('general', 'General', _entero(config.get('entradas_generales')), precio_base)
+        else:
+            sumar('general', 'General', _entero(config.get('capacidad')), precio_base)
+
+    if not cupos:
+        capacidad = _entero(capacidad_base if capacidad_base is not None else evento.get('asientos_disponibles'))
+        if capacidad:
+            cupos[clave_cupo('general', 'General')] = {"tipo": "general", "categoria": "General", "capacidad": capacidad}
+        precios = [precio_base]
+
+    return cupos, precios
+
+
+def capacidad_legado(evento: dict, vendidas: int) -> int:
+    """
+    Capacidad base de un evento guardado sin capacidad_total. En los eventos generales
+    asientos_disponibles es lo que queda por vender (cada compra aprobada o pendiente lo
+    descontó), así que la capacidad es ese resto más `vendidas`; en los demás tipos el
+    campo nunca se descontó.
+    """
+    disponibles = _entero(evento.get('asientos_disponibles'))
+    if (evento.get('tipo_asientos') or 'general') == 'general':
+        return disponibles + max(vendidas, 0)
+    return disponibles
+
+
+def derivar_campos_evento(evento: dict, capacidad_base: Optional[int] = None) -> dict:
+    """
+    Devuelve los campos derivados para $set. `capacidad_base` reemplaza a asientos_disponibles
+    como respaldo: en eventos generales sin configuración ese campo se descuenta con cada compra,
+    así que al actualizar otros campos se conserva la capacidad derivada anteriormente.
+    """
+    cupos, precios = _cupos_y_precios(evento, capacidad_base)
+
+    por_categoria = {}
+    for cupo in cupos.values():
+        por_categoria[cupo["categoria"]] = por_categoria.get(cupo["categoria"], 0) + cupo["capacidad"]
+
+    return {
+        "capacidad_total": sum(por_categoria.values()),
+        "capacidad_por_categoria": por_categoria,
+        "precio_minimo": min(precios),
+        "precio_maximo": max(precios),
+    }
+
+
+def cupos_evento(evento: dict, capacidad_base: Optional[int] = None) -> List[dict]:
+    """
+    Cupos por categoría para el control de sobreventa: [{clave, tipo, categoria, capacidad}].
+    `disponibles` lo completa quien los guarda (capacidad menos lo ya vendido o pendiente).
+    """
+    cupos, _ = _cupos_y_precios(evento, capacidad_base)
+    return [{"clave": clave, **cupo} for clave, cupo in cupos.items()]
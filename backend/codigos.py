@@ -0,0 +1,158 @@
+"""
+Códigos alfanuméricos de entradas: CF-2026-XXXXX-XXXXC
+
+Diez caracteres del alfabeto Crockford base32 (sin I, L, O, U): nueve aleatorios de un
+CSPRNG (45 bits) y un dígito de control Luhn mod 32. El control detecta cualquier
+carácter cambiado y casi todas las transposiciones de vecinos, así que en la puerta un
+error de tipeo se rechaza sin consultar la base. La unicidad la garantiza el índice
+único de entradas.codigo_alfanumerico; quien inserta regenera el código si choca.
+
+Los códigos de formatos anteriores (CF-2026-XXXXXX-XXXX, CF-GEN-XXXXXXXX) no tienen
+control: se aceptan tal cual y solo la base puede decidir.
+
+IndiceCodigos mantiene en memoria los códigos de un evento para la carga manual en
+puerta: búsqueda por prefijo y candidatos a un error de tipeo.
+"""
+import bisect
+import re
+import secrets
+from typing import Dict, List, Optional
+
+ALFABETO_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+VALORES_CROCKFORD = {c: i for i, c in enumerate(ALFABETO_CROCKFORD)}
+# Lecturas ambiguas que Crockford resuelve al decodificar
+EQUIVALENCIAS_CROCKFORD = str.maketrans({"I": "1", "L": "1", "O": "0"})
+
+PREFIJO_CODIGO = "CF-2026"
+CARACTERES_ALEATORIOS = 9
+
+PATRON_CODIGO = re.compile(
+    rf"^(?P<prefijo>[A-Z0-9-]+)-(?P<a>[{ALFABETO_CROCKFORD}]{{5}})-(?P<b>[{ALFABETO_CROCKFORD}]{{5}})$"
+)
+PATRON_FORMA_CODIGO = re.compile(r"^(?P<prefijo>[A-Z0-9-]+)-(?P<a>[A-Z0-9]{5})-(?P<b>[A-Z0-9]{5})$")
+
+
+def digito_control(cuerpo: str) -> str:
+    """Luhn mod 32 sobre los caracteres Crockford de `cuerpo`"""
+    factor = 2
+    suma = 0
+    for caracter in reversed(cuerpo):
+        sumando = factor * VALORES_CROCKFORD[caracter]
+        sumando = sumando // 32 + sumando % 32
+        suma += sumando
+        factor = 1 if factor == 2 else 2
+    return ALFABETO_CROCKFORD[(32 - suma % 32) % 32]
+
+
+def generar_codigo(prefijo: str = PREFIJO_CODIGO) -> str:
+    cuerpo = "".join(secrets.choice(ALFABETO_CROCKFORD) for _ in range(CARACTERES_ALEATORIOS))
+    cuerpo += digito_control(cuerpo)
+    return f"{prefijo}-{cuerpo[:5]}-{cuerpo[5:]}"
+
+
+def normalizar_codigo(codigo: str) -> str:
+    """Mayúsculas sin espacios; en códigos con control, I/L -> 1 y O -> 0 como en Crockford"""
+    codigo = re.sub(r"\s+", "", codigo or "").upper()
+    forma = PATRON_FORMA_CODIGO.match(codigo)
+    if forma:
+        cuerpo = (forma.group("a") + forma.group("b")).translate(EQUIVALENCIAS_CROCKFORD)
+        if all(c in VALORES_CROCKFORD for c in cuerpo):
+            return f"{forma.group('prefijo')}-{cuerpo[:5]}-{cuerpo[5:]}"
+    return codigo
+
+
+def tiene_control(codigo: str) -> bool:
+    return PATRON_CODIGO.match(codigo) is not None
+
+
+def control_valido(codigo: str) -> bool:
+    """False solo si el código tiene el formato con control y el dígito no cuadra (código normalizado)"""
+    partes = PATRON_CODIGO.match(codigo)
+    if not partes:
+        return True
+    cuerpo = partes.group("a") + partes.group("b")
+    return digito_control(cuerpo[:-1]) == cuerpo[-1]
+
+
+# ==================== ÍNDICE EN MEMORIA ====================
+
+ALFABETO_LEGADO = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def variantes_un_error(codigo: str):
+    """Códigos a un error de tipeo: un carácter cambiado o dos vecinos transpuestos (guiones fijos)"""
+    alfabeto = ALFABETO_CROCKFORD if tiene_control(codigo) else ALFABETO_LEGADO
+    for i, actual in enumerate(codigo):
+        if actual == "-":
+            continue
+        for caracter in alfabeto:
+            if caracter != actual:
+                yield codigo[:i] + caracter + codigo[i + 1:]
+    for i in range(len(codigo) - 1):
+        a, b = codigo[i], codigo[i + 1]
+        if a != b and "-" not in (a, b):
+            yield codigo[:i] + b + a + codigo[i + 2:]
+
+
+class IndiceCodigos:
+    """
+    Códigos de un evento en una lista ordenada (bisect): prefijo en O(log n + k) y
+    candidatos a un error de distancia con búsquedas exactas en el dict. Se refresca
+    de forma incremental con `marca` (la mayor fecha_compra cargada).
+    """
+
+    def __init__(self):
+        self.codigos: List[str] = []
+        self.info: Dict[str, dict] = {}
+        self.marca: Optional[str] = None
+        self.cargado_en = 0.0
+        self.refrescado_en = 0.0
+
+    def agregar(self, codigo: str, info: dict):
+        if codigo not in self.info:
+            bisect.insort(self.codigos, codigo)
+        self.info[codigo] = info
+
+    def cargar(self, entradas: List[dict]):
+        """Carga completa desde documentos de entradas (más rápido que agregar uno a uno)"""
+        for entrada in entradas:
+            self.info[entrada['codigo_alfanumerico']] = self._info(entrada)
+        self.codigos = sorted(self.info)
+        self.marca = max((e['fecha_compra'] for e in entradas if isinstance(e.get('fecha_compra'), str)), default=self.marca)
+
+    def actualizar(self, entradas: List[dict]):
+        for entrada in entradas:
+            self.agregar(entrada['codigo_alfanumerico'], self._info(entrada))
+            fecha = entrada.get('fecha_compra')
+            if isinstance(fecha, str) and (self.marca is None or fecha > self.marca):
+                self.marca = fecha
+
+    @staticmethod
+    def _info(entrada: dict) -> dict:
+        return {
+            "entrada_id": entrada.get('id'),
+            "evento_id": entrada.get('evento_id'),
+            "nombre_comprador": entrada.get('nombre_comprador'),
+            "asiento": entrada.get('asiento'),
+        }
+
+    def con_prefijo(self, prefijo: str, limite: int) -> List[str]:
+        inicio = bisect.bisect_left(self.codigos, prefijo)
+        resultado = []
+        for codigo in self.codigos[inicio:inicio + limite]:
+            if not codigo.startswith(prefijo):
+                break
+            resultado.append(codigo)
+        return resultado
+
+    def candidatos(self, codigo: str, limite: int) -> List[str]:
+        """El código si existe; si no, los existentes a un error de tipeo"""
+        if codigo in self.info:
+            return [codigo]
+        resultado = []
+        for variante in variantes_un_error(codigo):
+            if variante in self.info and variante not in resultado:
+                resultado.append(variante)
+                if len(resultado) >= limite:
+                    break
+        return resultado
@@ -0,0 +1,98 @@
+"""
+Límites de frecuencia en memoria e identidad del cliente detrás del proxy.
+
+LimitadorEscaneos es una ventana deslizante por clave (puerta, IP): quien acumula
+`maximo` eventos en `ventana` segundos espera hasta que el más viejo expira. El
+estado es de cada proceso, como el resto de las cachés del servidor.
+
+Detrás del ingress, request.client es la IP del proxy y todas las peticiones
+caerían en la misma clave. ip_cliente toma X-Forwarded-For solo si la conexión
+llega de un proxy confiable y lo recorre desde la derecha saltando los proxies
+confiables: la primera dirección ajena es el cliente. Lo que el cliente agregue a
+la izquierda del header no cambia su clave.
+"""
+import ipaddress
+import time
+from collections import deque
+from typing import List, Optional
+
+# Loopback y rangos privados: donde suelen estar el ingress y los balanceadores
+PROXIES_CONFIABLES_DEFECTO = "127.0.0.0/8,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,::1/128,fc00::/7"
+
+
+def redes_confiables(texto: str) -> List:
+    """Redes de proxies confiables a partir de una lista separada por comas; las entradas inválidas se ignoran"""
+    redes = []
+    for parte in (texto or "").split(","):
+        try:
+            redes.append(ipaddress.ip_network(parte.strip(), strict=False))
+        except ValueError:
+            continue
+    return redes
+
+
+def _confiable(direccion: str, confiables: List) -> bool:
+    try:
+        ip = ipaddress.ip_address(direccion)
+    except ValueError:
+        return False
+    return any(ip in red for red in confiables)
+
+
+def ip_cliente(remoto: Optional[str], reenviado: Optional[str], confiables: List) -> str:
+    """IP del cliente: la de la conexión, o la de X-Forwarded-For si la conexión viene de un proxy confiable"""
+    if not remoto:
+        return "desconocida"
+    if not reenviado or not _confiable(remoto, confiables):
+        return remoto
+    saltos = [salto.strip() for salto in reenviado.split(",") if salto.strip()]
+    for salto in reversed(saltos):
+        if not _confiable(salto, confiables):
+            return salto
+    # Toda la cadena es interna (un cliente de la red propia)
+    return saltos[0] if saltos else remoto
+
+
+class LimitadorEscaneos:
+    """
+    Ventana deslizante de escaneos inválidos por puerta. Una puerta que acumula
+    `maximo` fallos en `ventana` segundos recibe 429 hasta que el más viejo expira,
+    sin llegar a la base: frena el spam de QR falsos sin afectar a las demás puertas.
+    """
+    
+    MAX_PUERTAS = 10000
+    
+    def __init__(self, maximo: int, ventana: float):
+        self.maximo = maximo
+        self.ventana = ventana
+        self._fallos = {}  # puerta -> deque de instantes (monotonic), a lo sumo `maximo`
+    
+    def _vigentes(self, puerta: str, ahora: float) -> Optional[deque]:
+        fallos = self._fallos.get(puerta)
+        if fallos is None:
+            return None
+        while fallos and fallos[0] <= ahora - self.ventana:
+            fallos.popleft()
+        if not fallos:
+            del self._fallos[puerta]
+            return None
+        return fallos
+    
+    def reintentar_en(self, puerta: str) -> int:
+        """Segundos hasta que la puerta pueda volver a validar; 0 si no está bloqueada"""
+        ahora = time.monotonic()
+        fallos = self._vigentes(puerta, ahora)
+        if fallos is None or len(fallos) < self.maximo:
+            return 0
+        return max(int(fallos[0] + self.ventana - ahora) + 1, 1)
+    
+    def registrar(self, puerta: str):
+        """Cuenta un evento de la puerta en la ventana (un fallo o, en el tope por puerta, cualquier escaneo)"""
+        ahora = time.monotonic()
+        if len(self._fallos) >= self.MAX_PUERTAS:
+            for clave in list(self._fallos):
+                self._vigentes(clave, ahora)
+        self._fallos.setdefault(puerta, deque(maxlen=self.maximo)).append(ahora)
+    
+    def registrar_fallo(self, puerta: str):
+        self.registrar(puerta)
@@ -0,0 +1,431 @@
+"""
+Índice de asientos por evento con la ocupación guardada en bitsets.
+
+Las sillas de las mesas se numeran de forma densa (0..n-1) en el orden de
+`configuracion_asientos.mesas`; cada mesa ocupa el rango [inicio, inicio + sillas).
+Cada estado (ocupados, pendientes, retenidos) es un bytearray de un bit por silla:
+la silla i está en el byte i >> 3 con la máscara 1 << (i & 7). Un mapa de 10.000
+sillas son 1.250 bytes por estado, unos 5 KB en base64 para los tres.
+
+Cada cambio de una silla sube la versión del mapa y queda en un registro acotado,
+de modo que un cliente con la versión N pide solo las sillas que cambiaron desde N;
+si N ya salió del registro (o el mapa se reconstruyó) recibe el mapa completo.
+Versiones y registro son de cada proceso: la versión pública lleva el id del proceso
+("<instancia>-<N>") y una versión de otro worker siempre fuerza el mapa completo.
+
+Ids aceptados por silla: el del selector ("{nombre de mesa}-Silla{n}") y el que
+genera configurar-asientos ("M{mesa_id}-S{n}").
+"""
+import base64
+import bisect
+import hashlib
+import json
+import re
+import secrets
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from capacidad import SILLAS_POR_MESA_DEFECTO, categoria_mesa
+
+OCUPADO = "ocupado"
+PENDIENTE = "pendiente"
+
+# Códigos de estado en los deltas: [indice, codigo]
+LIBRE_COD, OCUPADO_COD, PENDIENTE_COD, RETENIDO_COD = 0, 1, 2, 3
+
+LIMITE_REGISTRO_CAMBIOS = 4096
+
+# Id de este proceso en las versiones públicas (etiqueta_version)
+INSTANCIA = secrets.token_hex(4)
+
+
+def _version_inicial() -> int:
+    # Igual que la caché de catálogo: reloj en milisegundos, crece entre reinicios
+    return time.time_ns() // 1_000_000
+
+
+def mesas_configuradas(tipo_asientos: str, configuracion: Optional[dict]) -> List[dict]:
+    """
+    Mesas normalizadas (id, nombre, sillas) en el orden de la configuración. Sin id propio,
+    la mesa usa su posición: así el id es estable al reconfigurar y el diff de asientos
+    no ve cada silla como nueva.
+    """
+    if tipo_asientos not in ('mesas', 'mixto'):
+        return []
+    mesas = []
+    for posicion, mesa in enumerate((configuracion or {}).get('mesas') or []):
+        try:
+            sillas = max(int(mesa.get('sillas', SILLAS_POR_MESA_DEFECTO)), 0)
+        except (TypeError, ValueError):
+            sillas = SILLAS_POR_MESA_DEFECTO
+        mesas.append({
+            **mesa,
+            "id": mesa['id'] if mesa.get('id') is not None else posicion + 1,
+            "nombre": mesa.get('nombre') or f"Mesa {posicion + 1}",
+            "sillas": sillas,
+        })
+    return mesas
+
+
+# Ids de silla conocidos; la silla es siempre el último segmento, así un mesa_id con guiones (uuid) no se corta
+_PATRON_SELECTOR = re.compile(r'^(?P<mesa>.+)-Silla(?P<silla>\d+)$')
+_PATRON_INVENTARIO = re.compile(r'^M(?P<mesa>.+)-S(?P<silla>\d+)$')
+
+
+def parsear_asiento(asiento_id: str) -> Optional[dict]:
+    """Mesa y silla a partir del texto del id, para sillas que el mapa actual no conoce"""
+    coincidencia = _PATRON_SELECTOR.match(asiento_id)
+    if coincidencia:
+        return {"mesa_id": None, "mesa_nombre": coincidencia['mesa'], "silla_numero": int(coincidencia['silla'])}
+    coincidencia = _PATRON_INVENTARIO.match(asiento_id)
+    if coincidencia:
+        return {"mesa_id": coincidencia['mesa'], "mesa_nombre": None, "silla_numero": int(coincidencia['silla'])}
+    return None
+
+
+def ubicar_asiento(mapa: Optional["MapaAsientos"], asiento_id: Optional[str]) -> dict:
+    """Identidad estructurada de la silla para guardar en la entrada (asiento_tipo, mesa_id, mesa_nombre, silla_numero)"""
+    if not asiento_id:
+        return {"asiento_tipo": "general", "mesa_id": None, "mesa_nombre": None, "silla_numero": None}
+    ubicacion = (mapa.ubicar(asiento_id) if mapa else None) or parsear_asiento(asiento_id)
+    if not ubicacion:
+        return {"asiento_tipo": "otro", "mesa_id": None, "mesa_nombre": None, "silla_numero": None}
+    return {"asiento_tipo": "mesa", **ubicacion}
+
+
+def firma_configuracion(tipo_asientos: str, configuracion: Optional[dict]) -> str:
+    datos = json.dumps([tipo_asientos, configuracion or {}], sort_keys=True, default=str)
+    return hashlib.sha1(datos.encode()).hexdigest()
+
+
+def _poner(bits: bytearray, indice: int, valor: bool) -> bool:
+    """Activa o apaga un bit; devuelve si cambió"""
+    byte, mascara = indice >> 3, 1 << (indice & 7)
+    actual = bool(bits[byte] & mascara)
+    if actual == valor:
+        return False
+    bits[byte] ^= mascara
+    return True
+
+
+def _activo(bits: bytearray, indice: int) -> bool:
+    return bool(bits[indice >> 3] & (1 << (indice & 7)))
+
+
+def _contar(bits: bytearray) -> int:
+    return int.from_bytes(bits, "little").bit_count()
+
+
+class MapaAsientos:
+    """Numeración densa de las sillas de un evento y su ocupación en bitsets"""
+
+    def __init__(self, tipo_asientos: str, configuracion: Optional[dict], capacidad_total: int = 0, precio_base: float = 0):
+        configuracion = configuracion or {}
+        self.tipo_asientos = tipo_asientos
+        self.configuracion = configuracion
+        self.capacidad_total = capacidad_total
+        self.firma = firma_configuracion(tipo_asientos, configuracion)
+        self.ids: List[str] = []
+        self.indices: Dict[str, int] = {}
+        self.mesas: List[dict] = []
+
+        for mesa in mesas_configuradas(tipo_asientos, configuracion):
+            inicio = len(self.ids)
+            try:
+                precio = float(mesa.get('precio', precio_base))
+            except (TypeError, ValueError):
+                precio = float(precio_base or 0)
+            self.mesas.append({
+                "mesa_id": mesa['id'],
+                "nombre": mesa['nombre'],
+                "inicio": inicio,
+                "sillas": mesa['sillas'],
+                "categoria": categoria_mesa(tipo_asientos, mesa),
+                "precio": precio,
+                "venta_completa": bool(mesa.get('ventaCompleta')),
+            })
+            for silla in range(1, mesa['sillas'] + 1):
+                canonico = f"{mesa['nombre']}-Silla{silla}"
+                self.indices.setdefault(canonico, len(self.ids))
+                self.indices.setdefault(f"M{mesa['id']}-S{silla}", len(self.ids))
+                self.ids.append(canonico)
+
+        tamano = (len(self.ids) + 7) // 8
+        self.ocupados = bytearray(tamano)
+        self.pendientes = bytearray(tamano)
+        self.retenidos = bytearray(tamano)
+        self.retenciones: Dict[int, tuple] = {}  # indice -> (session_id, expira monotonic)
+        self.clientes: Dict[str, str] = {}       # session_id -> cliente que retuvo (IP)
+        self.version = _version_inicial()
+        self.cargado = time.monotonic()
+        self.obsoleto = False  # el evento se reconfiguró: releer antes de usar
+        self.registro = deque(maxlen=LIMITE_REGISTRO_CAMBIOS)  # (version, indice)
+        self._inicios = [mesa['inicio'] for mesa in self.mesas]
+        self._grupos = None               # [(precio, categoria, mascara)] por precio
+        self._inicios_validos = {}        # cantidad -> mascara de sillas donde cabe un bloque
+        self._serializado = None
+
+    @property
+    def total(self) -> int:
+        return len(self.ids)
+
+    def indice(self, asiento_id: str) -> Optional[int]:
+        return self.indices.get(asiento_id)
+
+    def _cambio(self, indice: int):
+        self.version += 1
+        self.registro.append((self.version, indice))
+        self._serializado = None
+
+    def marcar(self, asiento_id: str, estado: Optional[str]) -> bool:
+        """Pasa la silla a ocupado, pendiente o libre (None); ids desconocidos se ignoran"""
+        indice = self.indice(asiento_id)
+        if indice is None:
+            return False
+        cambio = _poner(self.ocupados, indice, estado == OCUPADO)
+        cambio = _poner(self.pendientes, indice, estado == PENDIENTE) or cambio
+        if estado is not None:
+            # Una silla vendida o pendiente deja de estar retenida
+            cambio = self._soltar(indice) or cambio
+        if cambio:
+            self._cambio(indice)
+        return cambio
+
+    def codigo(self, indice: int) -> int:
+        if _activo(self.ocupados, indice):
+            return OCUPADO_COD
+        if _activo(self.pendientes, indice):
+            return PENDIENTE_COD
+        if _activo(self.retenidos, indice):
+            return RETENIDO_COD
+        return LIBRE_COD
+
+    def etiqueta_version(self) -> str:
+        """Versión que ven los clientes: solo tiene sentido en el proceso que la emitió"""
+        return f"{INSTANCIA}-{self.version}"
+
+    def cambios_desde(self, etiqueta: str) -> Optional[List[List[int]]]:
+        """Estado actual de las sillas que cambiaron después de la versión `etiqueta`; None si hace falta el mapa completo"""
+        instancia, _, numero = str(etiqueta).rpartition("-")
+        if instancia != INSTANCIA or not numero.isdigit():
+            return None
+        version = int(numero)
+        if version == self.version:
+            return []
+        if version > self.version or not self.registro or version < self.registro[0][0] - 1:
+            return None
+        cambiados = {}
+        # El registro está ordenado por versión: se recorre desde el final hasta alcanzar la del cliente
+        for version_cambio, indice in reversed(self.registro):
+            if version_cambio <= version:
+                break
+            cambiados[indice] = None
+        return [[indice, self.codigo(indice)] for indice in sorted(cambiados)]
+
+    def estado(self, indice: int) -> Optional[str]:
+        if _activo(self.ocupados, indice):
+            return OCUPADO
+        if _activo(self.pendientes, indice):
+            return PENDIENTE
+        return None
+
+    # ---------- Retenciones temporales (reservar-asientos) ----------
+
+    def _soltar(self, indice: int) -> bool:
+        self.retenciones.pop(indice, None)
+        return _poner(self.retenidos, indice, False)
+
+    def expirar_retenciones(self):
+        ahora = time.monotonic()
+        for indice in [i for i, (_, expira) in self.retenciones.items() if expira <= ahora]:
+            if self._soltar(indice):
+                self._cambio(indice)
+        sesiones = {sesion for sesion, _ in self.retenciones.values()}
+        for sesion in [s for s in self.clientes if s not in sesiones]:
+            del self.clientes[sesion]
+
+    def retenido_por_otro(self, indice: int, session_id: Optional[str]) -> bool:
+        retencion = self.retenciones.get(indice)
+        return bool(retencion) and retencion[1] > time.monotonic() and retencion[0] != session_id
+
+    def retenidos_de_cliente(self, cliente: str, excepto_sesion: Optional[str] = None) -> int:
+        """Sillas retenidas (vigentes) por las sesiones de un cliente, sin contar `excepto_sesion`"""
+        ahora = time.monotonic()
+        return sum(
+            1 for sesion, expira in self.retenciones.values()
+            if expira > ahora and sesion != excepto_sesion and self.clientes.get(sesion) == cliente
+        )
+
+    def retener(self, indices: Iterable[int], session_id: str, segundos: float, cliente: Optional[str] = None):
+        if cliente is not None:
+            self.clientes[session_id] = cliente
+        expira = time.monotonic() + segundos
+        for indice in indices:
+            self.retenciones[indice] = (session_id, expira)
+            if _poner(self.retenidos, indice, True):
+                self._cambio(indice)
+
+    def liberar_sesion(self, session_id: str):
+        for indice in [i for i, (sesion, _) in self.retenciones.items() if sesion == session_id]:
+            if self._soltar(indice):
+                self._cambio(indice)
+        self.clientes.pop(session_id, None)
+
+    def mesa_de(self, indice: int) -> dict:
+        return self.mesas[bisect.bisect_right(self._inicios, indice) - 1]
+
+    def ubicar(self, asiento_id: str) -> Optional[dict]:
+        indice = self.indice(asiento_id)
+        if indice is None:
+            return None
+        mesa = self.mesa_de(indice)
+        return {"mesa_id": str(mesa['mesa_id']), "mesa_nombre": mesa['nombre'], "silla_numero": indice - mesa['inicio'] + 1}
+
+    # ---------- Mejor ubicación disponible ----------
+    #
+    # Las sillas libres se tratan como un entero de `total` bits. "k sillas contiguas desde i"
+    # es libres & (libres >> 1) & ... & (libres >> k-1), recortado a los inicios donde el
+    # bloque no cruza el borde de una mesa; todo son operaciones de enteros en C.
+
+    def _mascara(self, indices: Iterable[int]) -> int:
+        bits = bytearray((self.total + 7) // 8)
+        for indice in indices:
+            bits[indice >> 3] |= 1 << (indice & 7)
+        return int.from_bytes(bits, "little")
+
+    def _grupos_precio(self) -> List[tuple]:
+        if self._grupos is None:
+            por_grupo = {}
+            for mesa in self.mesas:
+                sillas = range(mesa['inicio'], mesa['inicio'] + mesa['sillas'])
+                por_grupo.setdefault((mesa['precio'], mesa['categoria']), []).append(sillas)
+            self._grupos = [
+                (precio, categoria, self._mascara(i for rango in rangos for i in rango))
+                for (precio, categoria), rangos in sorted(por_grupo.items())
+            ]
+        return self._grupos
+
+    def _validos(self, cantidad: int) -> int:
+        if cantidad not in self._inicios_validos:
+            self._inicios_validos[cantidad] = self._mascara(
+                i
+                for mesa in self.mesas
+                if mesa['sillas'] >= cantidad and (not mesa['venta_completa'] or mesa['sillas'] == cantidad)
+                for i in range(mesa['inicio'], mesa['inicio'] + mesa['sillas'] - cantidad + 1)
+            )
+        return self._inicios_validos[cantidad]
+
+    def _libres(self, session_id: Optional[str]) -> int:
+        ocupacion = (
+            int.from_bytes(self.ocupados, "little")
+            | int.from_bytes(self.pendientes, "little")
+            | int.from_bytes(self.retenidos, "little")
+        )
+        libres = ~ocupacion & ((1 << self.total) - 1)
+        if session_id:
+            # Lo que ya retiene la propia sesión vuelve a estar disponible para ella
+            for indice, (sesion, _) in self.retenciones.items():
+                if sesion == session_id and not (_activo(self.ocupados, indice) or _activo(self.pendientes, indice)):
+                    libres |= 1 << indice
+        return libres
+
+    def mejores_asientos(
+        self,
+        cantidad: int,
+        categoria: Optional[str] = None,
+        session_id: Optional[str] = None,
+        permitir_separados: bool = False
+    ) -> Optional[List[int]]:
+        """
+        Índices de las mejores sillas libres, o None si no hay. Orden de preferencia:
+        1) bloque contiguo en una mesa, la más barata primero (y la primera del mapa a igual precio);
+        2) misma mesa aunque no contiguas; 3) si se permite, repartidas entre mesas.
+        Las mesas de venta completa solo se asignan enteras.
+        """
+        if cantidad < 1 or cantidad > self.total:
+            return None
+        self.expirar_retenciones()
+        libres = self._libres(session_id)
+        grupos = [g for g in self._grupos_precio() if categoria is None or g[1] == categoria]
+
+        bloque = libres
+        for desplazamiento in range(1, cantidad):
+            bloque &= libres >> desplazamiento
+        bloque &= self._validos(cantidad)
+        if bloque:
+            for _, _, mascara in grupos:
+                candidatos = bloque & mascara
+                if candidatos:
+                    inicio = (candidatos & -candidatos).bit_length() - 1
+                    return list(range(inicio, inicio + cantidad))
+
+        mesas = sorted(
+            (m for m in self.mesas if not m['venta_completa'] and (categoria is None or m['categoria'] == categoria)),
+            key=lambda m: (m['precio'], m['inicio'])
+        )
+        libres_bytes = libres.to_bytes((self.total + 8) // 8, "little")
+
+        def libres_en(mesa) -> List[int]:
+            inicio = mesa['inicio']
+            bits = int.from_bytes(libres_bytes[inicio >> 3:((inicio + mesa['sillas']) >> 3) + 1], "little") >> (inicio & 7)
+            return [inicio + n for n in range(mesa['sillas']) if bits >> n & 1]
+
+        separados = []
+        for mesa in mesas:
+            sillas = libres_en(mesa)
+            if len(sillas) >= cantidad:
+                return sillas[:cantidad]
+            if permitir_separados and len(separados) < cantidad:
+                separados.extend(sillas[:cantidad - len(separados)])
+        if permitir_separados and len(separados) == cantidad:
+            return separados
+        return None
+
+    # ---------- Recarga desde la base de datos ----------
+
+    def sincronizar(self, recargado: "MapaAsientos"):
+        """Adopta la ocupación de un mapa recién leído de Mongo (misma configuración), conservando versión y retenciones"""
+        self.capacidad_total = recargado.capacidad_total
+        self.cargado = time.monotonic()
+        self.obsoleto = False
+        if self.ocupados == recargado.ocupados and self.pendientes == recargado.pendientes:
+            return
+        for indice in range(self.total):
+            for bits, nuevos in ((self.ocupados, recargado.ocupados), (self.pendientes, recargado.pendientes)):
+                if _poner(bits, indice, _activo(nuevos, indice)):
+                    self._cambio(indice)
+
+    def suceder(self, anterior: Optional["MapaAsientos"]):
+        """
+        Nuevo mapa tras reconfigurar: la versión nunca retrocede. El registro de la carga
+        se descarta, así cualquier versión anterior (del mapa viejo) recibe el mapa completo.
+        """
+        if anterior is not None:
+            self.version = max(self.version, anterior.version + 1)
+            self.registro.clear()
+
+    # ---------- Respuesta ----------
+
+    def contar(self) -> dict:
+        return {"ocupados": _contar(self.ocupados), "pendientes": _contar(self.pendientes), "retenidos": _contar(self.retenidos)}
+
+    def lista(self, estado: str) -> List[str]:
+        bits = {"ocupados": self.ocupados, "pendientes": self.pendientes, "retenidos": self.retenidos}[estado]
+        return [self.ids[i] for i in range(self.total) if _activo(bits, i)]
+
+    def serializar(self) -> dict:
+        """Bitmaps en base64 con su versión; se reutiliza mientras la versión no cambie"""
+        if self._serializado is None or self._serializado["version"] != self.etiqueta_version():
+            self._serializado = {
+                "version": self.etiqueta_version(),
+                "total_asientos": self.total,
+                "mesas": self.mesas,
+                "bitmaps": {
+                    "ocupados": base64.b64encode(self.ocupados).decode(),
+                    "pendientes": base64.b64encode(self.pendientes).decode(),
+                    "retenidos": base64.b64encode(self.retenidos).decode(),
+                },
+                **self.contar(),
+            }
+        return self._serializado
@@ -0,0 +1,380 @@
+"""
+Formatos de payload de los QR (entradas y acreditaciones) detrás de un registro de codecs.
+
+Cada codec sabe codificar su payload, decodificarlo y verificarlo sin tocar la base:
+
+    v1  base64(iv | AES-CFB(JSON))            sin prefijo ("K<kid>." si la llave no es la 0)
+    v2  CF2:<kid>.base64(iv | AES-CFB(JSON corto))  JSON con firma HMAC truncada
+    v3  CF3:base45(binario firmado)           entrada + evento + emisión, sin datos personales
+
+`comparar` hace la parte que sí necesita la entrada guardada (que el QR sea el vigente).
+Todos comparten el llavero y el render PNG; la validación elige el codec por el prefijo.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Dict, Optional
+
+import qrcode
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+
+# ==================== LLAVERO ====================
+
+class LlaveQR:
+    """
+    Par de secretos de un kid. El algoritmo AES (con su clave) y el HMAC con la clave ya
+    cargada se crean una vez; cada operación solo crea el modo con su IV o copia el HMAC.
+    """
+
+    def __init__(self, kid: int, cifrado: bytes, secreto_hmac: bytes):
+        if not 0 <= kid <= 0xFF:
+            raise ValueError(f"kid fuera de rango: {kid}")
+        self.kid = kid
+        self._aes = algorithms.AES(cifrado[:32])
+        self._hmac = hmac.new(secreto_hmac, digestmod=hashlib.sha256)
+
+    def cifrar(self, datos: bytes) -> bytes:
+        iv = os.urandom(16)
+        encryptor = Cipher(self._aes, modes.CFB(iv), backend=default_backend()).encryptor()
+        return iv + encryptor.update(datos) + encryptor.finalize()
+
+    def descifrar(self, datos: bytes) -> bytes:
+        decryptor = Cipher(self._aes, modes.CFB(datos[:16]), backend=default_backend()).decryptor()
+        return decryptor.update(datos[16:]) + decryptor.finalize()
+
+    def firmar(self, datos: bytes) -> bytes:
+        firma = self._hmac.copy()
+        firma.update(datos)
+        return firma.digest()
+
+
+class LlaveroQR:
+    """Llaves por kid; `activa` es con la que se emite, todas validan"""
+
+    def __init__(self, llaves: Dict[int, LlaveQR], kid_activo: int):
+        if kid_activo not in llaves:
+            raise RuntimeError(f"QR_KID_ACTIVO={kid_activo} no está en QR_KEYRING")
+        self.llaves = llaves
+        self.activa = llaves[kid_activo]
+
+    def get(self, kid: int) -> Optional[LlaveQR]:
+        return self.llaves.get(kid)
+
+
+def cargar_llavero(cifrado: bytes, secreto_hmac: bytes, keyring: str = "", kid_activo: int = 0) -> LlaveroQR:
+    """La llave 0 es (cifrado, secreto_hmac); `keyring` agrega JSON {"<kid>": {"cifrado": "...", "hmac": "..."}}"""
+    llaves = {0: LlaveQR(0, cifrado, secreto_hmac)}
+    if keyring:
+        for kid, llave in json.loads(keyring).items():
+            llaves[int(kid)] = LlaveQR(int(kid), llave['cifrado'].encode(), llave['hmac'].encode())
+    return LlaveroQR(llaves, kid_activo)
+
+
+# ==================== RENDER ====================
+
+# Tres etapas separadas para que bench_qr mida exactamente el camino de producción
+
+def construir_matriz(payload: str, error_correction: int = qrcode.constants.ERROR_CORRECT_M,
+                     box_size: int = 12, border: int = 6, version: Optional[int] = None) -> qrcode.QRCode:
+    """Matriz de módulos; con version=None la versión del QR se ajusta al contenido"""
+    qr = qrcode.QRCode(
+        version=version,
+        error_correction=error_correction,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr
+
+
+def rasterizar(qr: qrcode.QRCode):
+    """Imagen PIL de la matriz"""
+    return qr.make_image(fill_color="black", back_color="white")
+
+
+def codificar_png(img) -> bytes:
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def renderizar_qr(payload: str, **opciones) -> str:
+    """PNG en data URL del payload (opciones de construir_matriz)"""
+    png = codificar_png(rasterizar(construir_matriz(payload, **opciones)))
+    return f"data:image/png;base64,{base64.b64encode(png).decode()}"
+
+
+# ==================== BASE45 ====================
+
+# Base45 (RFC 9285): su alfabeto es exactamente el del modo alfanumérico del QR
+ALFABETO_BASE45 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+VALORES_BASE45 = {c: i for i, c in enumerate(ALFABETO_BASE45)}
+
+
+def base45_codificar(datos: bytes) -> str:
+    caracteres = []
+    for i in range(0, len(datos) - 1, 2):
+        valor = datos[i] * 256 + datos[i + 1]
+        valor, c = divmod(valor, 45)
+        e, d = divmod(valor, 45)
+        caracteres += [ALFABETO_BASE45[c], ALFABETO_BASE45[d], ALFABETO_BASE45[e]]
+    if len(datos) % 2:
+        d, c = divmod(datos[-1], 45)
+        caracteres += [ALFABETO_BASE45[c], ALFABETO_BASE45[d]]
+    return "".join(caracteres)
+
+
+def base45_decodificar(texto: str) -> bytes:
+    """Lanza ValueError si el texto no es base45 válido"""
+    try:
+        valores = [VALORES_BASE45[c] for c in texto]
+    except KeyError:
+        raise ValueError("Carácter fuera del alfabeto base45")
+    if len(valores) % 3 == 1:
+        raise ValueError("Longitud base45 inválida")
+
+    datos = bytearray()
+    for i in range(0, len(valores), 3):
+        grupo = valores[i:i + 3]
+        if len(grupo) == 3:
+            valor = grupo[0] + grupo[1] * 45 + grupo[2] * 2025
+            if valor > 0xFFFF:
+                raise ValueError("Bloque base45 fuera de rango")
+            datos += bytes(divmod(valor, 256))
+        else:
+            valor = grupo[0] + grupo[1] * 45
+            if valor > 0xFF:
+                raise ValueError("Bloque base45 fuera de rango")
+            datos.append(valor)
+    return bytes(datos)
+
+
+# ==================== CODECS ====================
+
+def generar_hash(datos: dict) -> str:
+    """Hash de validación de las entradas (hash_validacion y campo `hash` de los QR v1)"""
+    return hashlib.sha256(json.dumps(datos, sort_keys=True).encode()).hexdigest()
+
+
+def id_corto_evento(evento_id: str) -> bytes:
+    """4 bytes que atan el QR a su evento (los ids de evento no siempre son UUID)"""
+    return hashlib.sha256(evento_id.encode()).digest()[:4]
+
+
+class CodecQR(ABC):
+    """
+    Interfaz de un formato de payload; un codec incompleto falla al instanciarse.
+    `decodificar` solo parsea (None si está mal formado), `verificar` autentica con CPU
+    y `comparar` contrasta con la entrada guardada: devuelve None si corresponde o el
+    tipo de alerta ("fraude", "qr_reemplazado").
+    """
+
+    version = 0
+    prefijo = ""
+    # Parámetros del render (ver renderizar_qr)
+    opciones_render = {}
+
+    def __init__(self, llavero: LlaveroQR):
+        self.llavero = llavero
+
+    @abstractmethod
+    def codificar(self, **datos) -> str:
+        ...
+
+    @abstractmethod
+    def decodificar(self, payload: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def verificar(self, datos: dict) -> bool:
+        ...
+
+    @abstractmethod
+    def comparar(self, datos: dict, entrada: dict) -> Optional[str]:
+        ...
+
+    def generar(self, **datos) -> tuple:
+        """(imagen PNG en data URL, payload)"""
+        payload = self.codificar(**datos)
+        return renderizar_qr(payload, **self.opciones_render), payload
+
+
+class CodecV1(CodecQR):
+    """
+    JSON completo cifrado con AES-CFB. Las entradas llevan dentro su `hash`, que viaja
+    cifrado: si no cuadra con el resto de los datos el payload no lo emitimos nosotros.
+    Las acreditaciones no llevan hash y se validan por su id.
+    """
+
+    version = 1
+    # Los payloads de llaves distintas de la 0 llevan el kid delante ("K<kid>."); el punto
+    # no existe en base64, así que los payloads sin prefijo son los de siempre (llave 0)
+    PATRON_KID = re.compile(r'^K(\d{1,3})\.')
+
+    def codificar(self, datos: dict) -> str:
+        llave = self.llavero.activa
+        payload = base64.b64encode(llave.cifrar(json.dumps(datos).encode())).decode()
+        return f"K{llave.kid}.{payload}" if llave.kid else payload
+
+    def decodificar(self, payload: str) -> Optional[dict]:
+        kid = 0
+        prefijo = self.PATRON_KID.match(payload)
+        if prefijo:
+            kid = int(prefijo.group(1))
+            payload = payload[prefijo.end():]
+        llave = self.llavero.get(kid)
+        if llave is None:
+            return None
+        try:
+            datos = json.loads(llave.descifrar(base64.b64decode(payload)).decode())
+        except (ValueError, UnicodeDecodeError):
+            return None
+        return datos if isinstance(datos, dict) else None
+
+    def verificar(self, datos: dict) -> bool:
+        sin_hash = {k: v for k, v in datos.items() if k != 'hash'}
+        return 'entrada_id' in datos and hmac.compare_digest(str(datos.get('hash', '')), generar_hash(sin_hash))
+
+    def comparar(self, datos: dict, entrada: dict) -> Optional[str]:
+        return None if datos['hash'] == entrada.get('hash_validacion') else "fraude"
+
+
+class CodecV2(CodecQR):
+    """JSON abreviado (e, v, c, t, n) con firma HMAC de 16 hex, cifrado; QR con corrección H"""
+
+    version = 2
+    prefijo = "CF2:"
+    LONGITUD_FIRMA = 16
+    PATRON_KID = re.compile(r'^(\d{1,3})\.')
+    opciones_render = {
+        "version": 2,
+        "error_correction": qrcode.constants.ERROR_CORRECT_H,  # Máxima corrección
+        "box_size": 10,
+        "border": 4,
+    }
+
+    def _firma(self, llave: LlaveQR, datos: dict) -> str:
+        datos_string = f"{datos['e']}|{datos['v']}|{datos['c']}|{datos['n']}"
+        return llave.firmar(datos_string.encode()).hex()[:self.LONGITUD_FIRMA]
+
+    def codificar(self, entrada_id: str, evento_id: str, codigo_alfanumerico: str) -> str:
+        llave = self.llavero.activa
+        datos = {
+            "e": entrada_id,
+            "v": evento_id,
+            "c": codigo_alfanumerico,
+            "t": datetime.now(timezone.utc).isoformat()[:19],
+            "n": str(uuid.uuid4())[:8],  # nonce único
+        }
+        datos["s"] = self._firma(llave, datos)
+        datos_json = json.dumps(datos, separators=(',', ':'))
+        return f"{self.prefijo}{llave.kid}.{base64.b64encode(llave.cifrar(datos_json.encode())).decode()}"
+
+    def decodificar(self, payload: str) -> Optional[dict]:
+        cuerpo = payload[len(self.prefijo):]
+        prefijo = self.PATRON_KID.match(cuerpo)
+        llave = self.llavero.get(int(prefijo.group(1))) if prefijo else None
+        if llave is None:
+            return None
+        try:
+            datos = json.loads(llave.descifrar(base64.b64decode(cuerpo[prefijo.end():])).decode())
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if not isinstance(datos, dict) or 'e' not in datos:
+            return None
+        datos['entrada_id'] = datos['e']
+        datos['kid'] = llave.kid
+        return datos
+
+    def verificar(self, datos: dict) -> bool:
+        llave = self.llavero.get(datos['kid'])
+        if llave is None or not all(campo in datos for campo in ('v', 'c', 'n', 's')):
+            return False
+        return hmac.compare_digest(str(datos['s']), self._firma(llave, datos))
+
+    def comparar(self, datos: dict, entrada: dict) -> Optional[str]:
+        if datos['v'] != entrada.get('evento_id') or datos['c'] != entrada.get('codigo_alfanumerico'):
+            return "fraude"
+        return None
+
+
+class CodecV3(CodecQR):
+    """
+    Binario firmado, sin datos del comprador:
+    CF3:<base45(version | kid | emision | entrada_id (16 bytes) | evento (4 bytes) | HMAC-SHA256[:10])>
+    33 bytes -> 50 caracteres del alfabeto alfanumérico del QR (versión 3 con corrección M,
+    frente a versiones 10+ del v1). `emision` es el contador qr_emision de la entrada:
+    regenerar el QR lo incrementa y deja sin efecto los impresos anteriores.
+    """
+
+    version = 3
+    prefijo = "CF3:"
+    LONGITUD_MAC = 10
+    LONGITUD = 3 + 16 + 4 + LONGITUD_MAC
+
+    def codificar(self, entrada_id: str, evento_id: str, emision: int = 0) -> str:
+        llave = self.llavero.activa
+        cuerpo = bytes([self.version, llave.kid, emision & 0xFF]) + uuid.UUID(entrada_id).bytes + id_corto_evento(evento_id)
+        return self.prefijo + base45_codificar(cuerpo + llave.firmar(cuerpo)[:self.LONGITUD_MAC])
+
+    def decodificar(self, payload: str) -> Optional[dict]:
+        try:
+            datos = base45_decodificar(payload[len(self.prefijo):])
+        except ValueError:
+            return None
+        if len(datos) != self.LONGITUD or datos[0] != self.version:
+            return None
+        return {
+            "version": datos[0],
+            "kid": datos[1],
+            "emision": datos[2],
+            "entrada_id": str(uuid.UUID(bytes=datos[3:19])),
+            "evento_corto": datos[19:23],
+            "cuerpo": datos[:-self.LONGITUD_MAC],
+            "mac": datos[-self.LONGITUD_MAC:],
+        }
+
+    def verificar(self, datos: dict) -> bool:
+        # El kid elige la llave directamente; un kid desconocido se rechaza sin calcular nada
+        llave = self.llavero.get(datos['kid'])
+        if llave is None:
+            return False
+        return hmac.compare_digest(datos['mac'], llave.firmar(datos['cuerpo'])[:self.LONGITUD_MAC])
+
+    def comparar(self, datos: dict, entrada: dict) -> Optional[str]:
+        if datos['emision'] != entrada.get('qr_emision', 0) & 0xFF:
+            return "qr_reemplazado"
+        if not hmac.compare_digest(datos['evento_corto'], id_corto_evento(entrada['evento_id'])):
+            return "fraude"
+        return None
+
+
+class RegistroCodecs:
+    """Codecs por versión; los payloads sin prefijo conocido son v1"""
+
+    def __init__(self, *codecs: CodecQR):
+        self.por_version = {codec.version: codec for codec in codecs}
+        self._con_prefijo = [codec for codec in codecs if codec.prefijo]
+
+    def __getitem__(self, version: int) -> CodecQR:
+        return self.por_version[version]
+
+    def para_payload(self, payload: str) -> CodecQR:
+        for codec in self._con_prefijo:
+            if payload.startswith(codec.prefijo):
+                return codec
+        return self.por_version[1]
+
+
+def crear_registro(llavero: LlaveroQR) -> RegistroCodecs:
+    return RegistroCodecs(CodecV1(llavero), CodecV2(llavero), CodecV3(llavero))
@@ -2,22 +2,26 @@ from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends, status,
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response, StreamingResponse, FileResponse
+from fastapi.encoders import jsonable_encoder
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from pymongo import ASCENDING, DESCENDING, TEXT, InsertOne, UpdateOne, DeleteMany
+from pymongo.errors import BulkWriteError, OperationFailure
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, TypeAdapter
 from typing import List, Optional
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
 from pathlib import Path
 import os
+import re
 import uuid
-import qrcode
-from io import BytesIO
+from io import BytesIO, StringIO
 import base64
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
 import hashlib
 import json
+import csv
+import zlib
 import logging
 import jwt
 from passlib.context import CryptContext
@@ -28,8 +32,17 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
+from email.utils import formatdate, parsedate_to_datetime
 import asyncio
 import hmac
+import time
+from collections import OrderedDict, deque
+
+from capacidad import CAMPOS_ORIGEN, derivar_campos_evento, cupos_evento, clave_cupo, capacidad_legado
+from mapa_asientos import MapaAsientos, OCUPADO, PENDIENTE, mesas_configuradas, ubicar_asiento
+from qr_codecs import cargar_llavero, crear_registro, generar_hash
+from codigos import PREFIJO_CODIGO, IndiceCodigos, generar_codigo, normalizar_codigo, control_valido
+from limites import PROXIES_CONFIABLES_DEFECTO, LimitadorEscaneos, ip_cliente, redes_confiables
 
 ROOT_DIR = Path(__file__).parent
 UPLOADS_DIR = ROOT_DIR / "uploads"
@@ -46,7 +59,15 @@ api_router = APIRouter(prefix="/api")
 ENCRYPTION_KEY = b'ciudad_feria_secret_key_2026_tachira_venezuela'
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'ciudad_feria_jwt_secret_2026')
 ALGORITHM = "HS256"
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Costo de bcrypt; los hashes con otro costo se rehacen en el siguiente login exitoso
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 security = HTTPBearer()
 
 # Email Configuration
@@ -56,6 +77,12 @@ GMAIL_APP_PASSWORD = os.environ.get('GMAIL_APP_PASSWORD', '')
 # HMAC Key para QR seguro (anti-hackeo)
 HMAC_SECRET_KEY = b'ciudad_feria_hmac_2026_inhackeable_qr_secret'
 
+# Llavero de QR: ENCRYPTION_KEY/HMAC_SECRET_KEY son la llave 0 (la de todas las entradas
+# emitidas hasta ahora). QR_KEYRING agrega llaves como JSON {"<kid>": {"cifrado": "...", "hmac": "..."}}
+# y QR_KID_ACTIVO elige con cuál se emite; las demás siguen validando los QR ya impresos.
+QR_KEYRING = os.environ.get('QR_KEYRING', '')
+QR_KID_ACTIVO = int(os.environ.get('QR_KID_ACTIVO', '0'))
+
 # Models
 class AdminLogin(BaseModel):
     username: str
@@ -84,6 +111,13 @@ class Evento(BaseModel):
     # Sistema de asientos
     tipo_asientos: str = "general"  # "general", "mesas", "mixto"
     configuracion_asientos: Optional[dict] = None  # Configuración específica del mapa
+    # Derivados de la configuración al escribir (ver capacidad.py)
+    capacidad_total: Optional[int] = None
+    capacidad_por_categoria: Optional[dict] = None
+    precio_minimo: Optional[float] = None
+    precio_maximo: Optional[float] = None
+    # Cupos por categoría con su contador atómico de disponibles (ver CUPOS POR CATEGORÍA)
+    cupos: Optional[List[dict]] = None
     fecha_creacion: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class EventoCreate(BaseModel):
@@ -175,6 +209,8 @@ class CompraEntrada(BaseModel):
     comprobante_pago: Optional[str] = None
     asientos: Optional[List[str]] = []
     categoria_asiento: Optional[str] = None
+    session_id: Optional[str] = None  # sesión que retiene los asientos (reservar / mejores-asientos)
+    detalles_compra: Optional[List[dict]] = None  # [{tipo, cantidad, precioUnitario}] del selector
 
 class AprobarCompra(BaseModel):
     entrada_ids: List[str]
@@ -198,17 +234,47 @@ class Entrada(BaseModel):
     fecha_compra: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     codigo_qr: str
     qr_payload: str = ""
+    qr_emision: int = 0  # se incrementa al regenerar el QR (ver qr_codecs.CodecV3)
     asiento: Optional[str] = None
-    mesa: Optional[str] = None
+    mesa: Optional[str] = None  # = mesa_id, se mantiene por compatibilidad
+    # Identidad estructurada de la silla (ver mapa_asientos.ubicar_asiento)
+    asiento_tipo: Optional[str] = None  # "mesa", "general" u "otro"
+    mesa_id: Optional[str] = None
+    mesa_nombre: Optional[str] = None
+    silla_numero: Optional[int] = None
     estado_pago: str = "pendiente"
     metodo_pago: Optional[str] = None
-    comprobante_pago: Optional[str] = None
+    comprobante_pago: Optional[str] = None  # URL del comprobante en /api/uploads
+    comprobante_miniatura: Optional[str] = None
+    orden_id: Optional[str] = None
     usado: bool = False
     fecha_uso: Optional[datetime] = None
     estado_entrada: str = "fuera"
     historial_acceso: List[dict] = []
     hash_validacion: str
 
+class Orden(BaseModel):
+    """Agrupa las entradas de una compra: datos del comprador y del pago se guardan una sola vez"""
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    evento_id: str
+    nombre_evento: str
+    nombre_comprador: str
+    email_comprador: str
+    telefono_comprador: Optional[str] = None
+    metodo_pago: Optional[str] = None
+    comprobante_pago: Optional[str] = None
+    comprobante_miniatura: Optional[str] = None
+    categoria_asiento: Optional[str] = None
+    cantidad: int
+    precio_total: float
+    entrada_ids: List[str] = []
+    estado_pago: str = "pendiente"
+    fecha_compra: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+# Campos que viven en la orden y ya no se duplican en cada entrada
+CAMPOS_ORDEN_EN_ENTRADA = ("telefono_comprador", "metodo_pago", "comprobante_pago", "comprobante_miniatura")
+
 class MetodoPago(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -256,178 +322,595 @@ class Acreditacion(BaseModel):
     historial_acceso: List[dict] = []
 
 # Auth Functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt tarda decenas de ms a propósito: se corre en el pool de hilos para no frenar el
+# event loop, y los logins repetidos (supervisores que entran y salen del mismo dispositivo
+# en un turno) se resuelven con una caché corta de verificaciones exitosas
+LOGIN_CACHE_TTL = float(os.environ.get('LOGIN_CACHE_TTL', '300'))
+LOGIN_CACHE_MAXIMO = 1024
+
+class CacheLogins:
+    """
+    Verificaciones exitosas recientes. La clave es un HMAC con un secreto aleatorio del proceso
+    sobre (usuario, contraseña, hash guardado): no guarda la contraseña, y cambiarla o
+    rehacer el hash invalida la entrada sola.
+    """
+    
+    def __init__(self, ttl: float, maximo: int):
+        self.ttl = ttl
+        self.maximo = maximo
+        self._secreto = os.urandom(32)
+        self._vence = OrderedDict()  # clave -> instante de vencimiento (monotonic), en orden LRU
+    
+    def _clave(self, username: str, password: str, hashed_password: str) -> bytes:
+        mensaje = "\0".join((username, password, hashed_password)).encode()
+        return hmac.new(self._secreto, mensaje, hashlib.sha256).digest()
+    
+    def contiene(self, username: str, password: str, hashed_password: str) -> bool:
+        clave = self._clave(username, password, hashed_password)
+        vence = self._vence.get(clave)
+        if vence is None:
+            return False
+        if vence < time.monotonic():
+            del self._vence[clave]
+            return False
+        self._vence.move_to_end(clave)
+        return True
+    
+    def agregar(self, username: str, password: str, hashed_password: str):
+        if self.ttl <= 0:
+            return
+        self._vence[self._clave(username, password, hashed_password)] = time.monotonic() + self.ttl
+        while len(self._vence) > self.maximo:
+            self._vence.popitem(last=False)
+
+cache_logins = CacheLogins(LOGIN_CACHE_TTL, LOGIN_CACHE_MAXIMO)
+
+async def hash_password(password: str) -> str:
+    return await asyncio.to_thread(pwd_context.hash, password)
+
+async def verificar_login(admin: dict, password: str) -> bool:
+    """Verifica la contraseña y, si el hash usa parámetros viejos, lo rehace y lo guarda"""
+    hashed = admin["hashed_password"]
+    if cache_logins.contiene(admin["username"], password, hashed):
+        return True
+    
+    valido, nuevo_hash = await asyncio.to_thread(pwd_context.verify_and_update, password, hashed)
+    if not valido:
+        return False
+    if nuevo_hash:
+        await db.admin_users.update_one(
+            {"username": admin["username"], "hashed_password": hashed},
+            {"$set": {"hashed_password": nuevo_hash}}
+        )
+        hashed = nuevo_hash
+    cache_logins.agregar(admin["username"], password, hashed)
+    return True
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+DURACION_TOKEN_PANEL = timedelta(hours=24)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
-    else:
-        expire = datetime.now(timezone.utc) + timedelta(hours=24)
-    to_encode.update({"exp": expire})
+    emitido = datetime.now(timezone.utc)
+    expire = emitido + (expires_delta or DURACION_TOKEN_PANEL)
+    # jti: identificador para revocar este token en particular (logout);
+    # iat: para revocar todos los de un usuario emitidos hasta un instante (baja del usuario)
+    to_encode.update({"exp": expire, "iat": emitido, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# Tokens ya verificados: sha256(token) -> claims, hasta su exp. Evita repetir la firma y el
+# parseo en cada request del panel; la revocación se consulta igual en cada uso.
+TOKENS_VERIFICADOS_MAXIMO = 4096
+tokens_verificados = OrderedDict()
+
+# jti revocados (colección tokens_revocados con TTL en `expira`). Cada proceso guarda el
+# conjunto en memoria y lo relee cada TOKENS_REVOCADOS_REFRESCO segundos; el logout lo
+# agrega al instante en el proceso que lo atiende. Los documentos con `revocado_desde`
+# revocan todos los tokens de un usuario emitidos hasta ese instante (usuarios_revocados).
+TOKENS_REVOCADOS_REFRESCO = float(os.environ.get('TOKENS_REVOCADOS_REFRESCO', '10'))
+jtis_revocados = set()
+usuarios_revocados = {}  # username -> revocado_desde (epoch en segundos)
+_revocados_refrescados_en = 0.0
+_lock_revocados = asyncio.Lock()
+
+def id_token(token: str, claims: dict) -> str:
+    """jti del token; los emitidos antes de llevar jti se identifican por su hash"""
+    return claims.get("jti") or hashlib.sha256(token.encode()).hexdigest()
+
+async def refrescar_revocados():
+    global jtis_revocados, usuarios_revocados, _revocados_refrescados_en
+    if time.monotonic() - _revocados_refrescados_en < TOKENS_REVOCADOS_REFRESCO:
+        return
+    async with _lock_revocados:
+        if time.monotonic() - _revocados_refrescados_en < TOKENS_REVOCADOS_REFRESCO:
+            return
+        revocados = await db.tokens_revocados.find(
+            {"expira": {"$gt": datetime.now(timezone.utc)}},
+            {"_id": 0, "jti": 1, "username": 1, "revocado_desde": 1}
+        ).to_list(None)
+        jtis_revocados = {revocado["jti"] for revocado in revocados}
+        usuarios_revocados = {
+            revocado["username"]: revocado["revocado_desde"]
+            for revocado in revocados if revocado.get("revocado_desde") is not None
+        }
+        _revocados_refrescados_en = time.monotonic()
+
+def claims_de_token(token: str) -> dict:
+    """Claims de un token válido (firma y exp), con la caché de tokens verificados"""
+    clave = hashlib.sha256(token.encode()).digest()
+    cacheado = tokens_verificados.get(clave)
+    if cacheado is not None:
+        claims, expira = cacheado
+        if expira > time.time():
+            tokens_verificados.move_to_end(clave)
+            return claims
+        del tokens_verificados[clave]
+        raise HTTPException(status_code=401, detail="Token expired")
+    
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return username
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if claims.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    tokens_verificados[clave] = (claims, claims.get("exp", 0))
+    while len(tokens_verificados) > TOKENS_VERIFICADOS_MAXIMO:
+        tokens_verificados.popitem(last=False)
+    return claims
+
+async def claims_de_sesion(token: str) -> dict:
+    """Claims de un token del panel vigente y no revocado"""
+    claims = claims_de_token(token)
+    # Los tokens de puerta solo sirven para validar (ver token_puerta_de)
+    if claims.get("typ") == "puerta":
         raise HTTPException(status_code=401, detail="Invalid token")
+    await refrescar_revocados()
+    if id_token(token, claims) in jtis_revocados:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    # Tokens sin iat (emitidos antes de llevarlo) cuentan como emitidos al principio
+    revocado_desde = usuarios_revocados.get(claims["sub"])
+    if revocado_desde is not None and claims.get("iat", 0) <= revocado_desde:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return claims
+
+async def get_current_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    return await claims_de_sesion(credentials.credentials)
+
+async def sesion_opcional(request: Request) -> Optional[dict]:
+    """Claims de la sesión del panel si la petición trae una válida; None en vez de 401 en endpoints públicos"""
+    esquema, _, token = request.headers.get('Authorization', '').partition(' ')
+    if esquema.lower() != 'bearer' or not token:
+        return None
+    try:
+        return await claims_de_sesion(token)
+    except HTTPException:
+        return None
+
+async def get_current_user(claims: dict = Depends(get_current_claims)) -> str:
+    return claims["sub"]
+
+async def requiere_admin(claims: dict = Depends(get_current_claims)) -> str:
+    """Como get_current_user, pero solo rol admin; el rol sale del token, sin leer la base"""
+    if claims.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Solo un administrador puede realizar esta acción")
+    return claims["sub"]
 
 # QR Functions
-def generar_codigo_alfanumerico(evento_id: str, entrada_id: str) -> str:
-    """Genera un código alfanumérico único tipo CF-2026-ABC123"""
-    import random
-    import string
-    
-    # Tomar las últimas 6 letras/números del entrada_id
-    codigo_unico = entrada_id.replace('-', '')[-6:].upper()
-    
-    # Generar parte aleatoria adicional
-    parte_aleatoria = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-    
-    return f"CF-2026-{codigo_unico}-{parte_aleatoria}"
-
-def generar_qr_seguro(datos: dict) -> str:
-    datos_json = json.dumps(datos)
-    iv = os.urandom(16)
-    cipher = Cipher(
-        algorithms.AES(ENCRYPTION_KEY[:32]),
-        modes.CFB(iv),
-        backend=default_backend()
-    )
-    encryptor = cipher.encryptor()
-    datos_encriptados = encryptor.update(datos_json.encode()) + encryptor.finalize()
-    payload = base64.b64encode(iv + datos_encriptados).decode()
-    
-    qr = qrcode.QRCode(
-        version=None,  # Auto-detect version based on data
-        error_correction=qrcode.constants.ERROR_CORRECT_M,  # Medium error correction for better readability
-        box_size=12,  # Larger boxes for better scanning
-        border=6,  # Larger border for better detection
-    )
-    qr.add_data(payload)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    buffer.seek(0)
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode()
-    
-    return f"data:image/png;base64,{qr_base64}", payload
+def generar_codigo_alfanumerico(prefijo: str = PREFIJO_CODIGO) -> str:
+    """Genera un código tipo CF-2026-7KQ2M-X9H4C (aleatorio + dígito de control, ver codigos.py)"""
+    return generar_codigo(prefijo)
+
+INTENTOS_CODIGO_UNICO = 5
+
+def es_codigo_duplicado(error: dict) -> bool:
+    return error.get('code') == 11000 and 'codigo_alfanumerico' in str(error.get('keyPattern') or error.get('errmsg', ''))
+
+def es_asiento_duplicado(error: dict) -> bool:
+    return error.get('code') == 11000 and 'asiento_clave' in str(error.get('keyPattern') or error.get('errmsg', ''))
+
+async def insertar_entradas(docs: List[dict], regenerar_codigo) -> None:
+    """
+    Inserta las entradas; las que choquen con el índice único de codigo_alfanumerico
+    reciben código nuevo (regenerar_codigo(doc) actualiza el doc) y se reintentan.
+    Se insertan copias para no dejar el _id de Mongo en los dicts del llamador.
+    """
+    pendientes = docs
+    for _ in range(INTENTOS_CODIGO_UNICO):
+        try:
+            await db.entradas.insert_many([dict(doc) for doc in pendientes], ordered=False)
+            return
+        except BulkWriteError as e:
+            errores = e.details.get('writeErrors', [])
+            if not errores or not all(es_codigo_duplicado(error) for error in errores):
+                raise
+            pendientes = [pendientes[error['index']] for error in errores]
+            for doc in pendientes:
+                regenerar_codigo(doc)
+    raise HTTPException(status_code=503, detail="No se pudo asignar un código único a la entrada, intente de nuevo")
+
+LLAVERO_QR = cargar_llavero(ENCRYPTION_KEY, HMAC_SECRET_KEY, QR_KEYRING, QR_KID_ACTIVO)
+CODECS_QR = crear_registro(LLAVERO_QR)
+
+def generar_qr_seguro(datos: dict) -> tuple:
+    return CODECS_QR[1].generar(datos=datos)
 
 def validar_qr(payload: str) -> Optional[dict]:
-    try:
-        datos_completos = base64.b64decode(payload)
-        iv = datos_completos[:16]
-        datos_encriptados = datos_completos[16:]
+    return CODECS_QR[1].decodificar(payload)
+
+def generar_qr_v3(entrada_id: str, evento_id: str, emision: int = 0) -> tuple:
+    return CODECS_QR[3].generar(entrada_id=entrada_id, evento_id=evento_id, emision=emision)
+
+# ==================== CACHÉ DE CATÁLOGO ====================
+
+CATALOGO_CACHE_TTL = float(os.environ.get('CATALOGO_CACHE_TTL', '60'))
+
+class CacheCatalogo:
+    """
+    Caché en memoria (TTL + versión) para las lecturas públicas del catálogo.
+    Cada espacio (eventos, categorias, ...) tiene una versión que los handlers de
+    administración invalidan; la versión arranca en el reloj en milisegundos, así
+    que sigue creciendo entre reinicios del proceso.
+    """
+    
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._valores = {}    # (espacio, clave) -> (version, expira, valor)
+        self._versiones = {}
+        self._locks = {}
+        self._metricas = {}
+    
+    def _metrica(self, espacio: str) -> dict:
+        return self._metricas.setdefault(espacio, {"hits": 0, "misses": 0, "invalidaciones": 0})
+    
+    def version(self, espacio: str) -> int:
+        if espacio not in self._versiones:
+            self._versiones[espacio] = time.time_ns() // 1_000_000
+        return self._versiones[espacio]
+    
+    def invalidar(self, espacio: str):
+        self._versiones[espacio] = max(self.version(espacio) + 1, time.time_ns() // 1_000_000)
+        self._metrica(espacio)["invalidaciones"] += 1
+    
+    async def obtener(self, espacio: str, clave: str, cargar):
+        """Devuelve el valor cacheado o lo carga una sola vez aunque lleguen peticiones concurrentes"""
+        valor = self._vigente(espacio, clave)
+        if valor is not None:
+            self._metrica(espacio)["hits"] += 1
+            return valor
         
-        cipher = Cipher(
-            algorithms.AES(ENCRYPTION_KEY[:32]),
-            modes.CFB(iv),
-            backend=default_backend()
-        )
-        decryptor = cipher.decryptor()
-        datos_json = decryptor.update(datos_encriptados) + decryptor.finalize()
-        return json.loads(datos_json.decode())
-    except Exception as e:
-        logging.error(f"Error validando QR: {e}")
+        lock = self._locks.setdefault((espacio, clave), asyncio.Lock())
+        async with lock:
+            valor = self._vigente(espacio, clave)
+            if valor is not None:
+                self._metrica(espacio)["hits"] += 1
+                return valor
+            
+            self._metrica(espacio)["misses"] += 1
+            # La versión se toma antes de cargar: si se invalida durante la carga, el valor nace viejo
+            version = self.version(espacio)
+            valor = await cargar()
+            self._valores[(espacio, clave)] = (version, time.monotonic() + self.ttl, valor)
+            return valor
+    
+    def _vigente(self, espacio: str, clave: str):
+        guardado = self._valores.get((espacio, clave))
+        if guardado and guardado[0] == self.version(espacio) and guardado[1] > time.monotonic():
+            return guardado[2]
         return None
+    
+    def metricas(self) -> dict:
+        return {
+            espacio: {**valores, "version": self.version(espacio)}
+            for espacio, valores in self._metricas.items()
+        }
+
+cache_catalogo = CacheCatalogo(CATALOGO_CACHE_TTL)
+
+@api_router.get("/admin/cache/metricas")
+async def obtener_metricas_cache(current_user: str = Depends(get_current_user)):
+    """Hits, misses, invalidaciones y versión por espacio de la caché de catálogo"""
+    return {"ttl_segundos": cache_catalogo.ttl, "espacios": cache_catalogo.metricas()}
+
+# ==================== CACHÉ HTTP ====================
+
+# Validadores (ETag / Last-Modified) y Cache-Control para las lecturas públicas, de modo
+# que navegadores y CDN revaliden con 304 en vez de descargar el catálogo completo.
+CATALOGO_MAX_AGE = int(os.environ.get('CATALOGO_MAX_AGE', '30'))
+EVENTO_DETALLE_MAX_AGE = int(os.environ.get('EVENTO_DETALLE_MAX_AGE', '5'))
+CACHE_CONTROL_INMUTABLE = "public, max-age=31536000, immutable"
+# Los comprobantes de pago son privados: inmutables para el navegador, nunca en cachés compartidas
+CACHE_CONTROL_INMUTABLE_PRIVADO = "private, max-age=31536000, immutable"
+
+# Nombres que nunca cambian de contenido: uuid4 (uploads) y sha256 (comprobantes)
+PATRON_UPLOAD_INMUTABLE = re.compile(
+    r'^(?:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|cp_[0-9a-f]{64}(?:_min)?)\.\w+$'
+)
+
+class RespuestaCacheable:
+    """Cuerpo JSON ya serializado junto con sus validadores HTTP"""
+    __slots__ = ("cuerpo", "etag", "ultima_modificacion")
 
-def generar_hash(datos: dict) -> str:
-    datos_string = json.dumps(datos, sort_keys=True)
-    return hashlib.sha256(datos_string.encode()).hexdigest()
+    def __init__(self, cuerpo: bytes, etag: str, ultima_modificacion: Optional[float] = None):
+        self.cuerpo = cuerpo
+        self.etag = etag
+        self.ultima_modificacion = ultima_modificacion
+
+# (espacio, clave) -> (digest, instante en que cambió el contenido)
+_cambios_catalogo = {}
+
+def serializar_json(valor) -> bytes:
+    """Mismo formato que JSONResponse (utf-8 compacto)"""
+    return json.dumps(jsonable_encoder(valor), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+# Adaptadores construidos una sola vez: validan y serializan la lista completa dentro de
+# pydantic-core, sin el paso intermedio de FastAPI (validar, model_dump, jsonable_encoder, json.dumps)
+ADAPTADOR_EVENTOS = TypeAdapter(List[Evento])
+ADAPTADOR_CATEGORIAS = TypeAdapter(List[Categoria])
+
+def serializar_lista(adaptador: TypeAdapter, items: List[dict]) -> bytes:
+    """Equivalente en bytes a response_model=List[...] para documentos ya leídos de Mongo"""
+    return adaptador.dump_json(adaptador.validate_python(items))
+
+def etag_contenido(cuerpo: bytes, prefijo: str = "") -> str:
+    return f'W/"{prefijo}{hashlib.sha1(cuerpo).hexdigest()[:16]}"'
+
+def no_modificado(request: Request, etag: str, ultima_modificacion: Optional[float]) -> bool:
+    """If-None-Match manda sobre If-Modified-Since (RFC 9110 §13.2.2); la comparación de ETags es débil"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        propio = etag.removeprefix("W/")
+        return any(candidato.strip().removeprefix("W/") == propio for candidato in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and ultima_modificacion is not None:
+        try:
+            fecha = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if fecha.tzinfo is None:
+            fecha = fecha.replace(tzinfo=timezone.utc)
+        # Last-Modified viaja con resolución de segundos
+        return int(ultima_modificacion) <= fecha.timestamp()
+    return False
+
+def respuesta_condicional(
+    request: Request,
+    cuerpo: bytes,
+    etag: str,
+    cache_control: str,
+    ultima_modificacion: Optional[float] = None
+) -> Response:
+    """200 con el cuerpo o 304 vacío, siempre con los mismos validadores"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if ultima_modificacion is not None:
+        headers["Last-Modified"] = formatdate(ultima_modificacion, usegmt=True)
+    if no_modificado(request, etag, ultima_modificacion):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
+
+async def respuesta_catalogo(request: Request, espacio: str, clave: str, cargar, serializar=serializar_json) -> Response:
+    """
+    Lectura pública cacheada: el cuerpo serializado y sus validadores se guardan en
+    cache_catalogo. El ETag combina la versión del espacio con un hash del contenido,
+    porque al recargar por TTL pueden colarse cambios que no pasaron por invalidar().
+    """
+    async def cargar_respuesta() -> RespuestaCacheable:
+        version = cache_catalogo.version(espacio)
+        cuerpo = serializar(await cargar())
+        digest = hashlib.sha1(cuerpo).hexdigest()[:16]
+
+        anterior = _cambios_catalogo.get((espacio, clave))
+        if anterior and anterior[0] == digest:
+            modificado = anterior[1]
+        else:
+            modificado = time.time()
+            _cambios_catalogo[(espacio, clave)] = (digest, modificado)
+        return RespuestaCacheable(cuerpo, f'W/"{version:x}-{digest}"', modificado)
+
+    respuesta = await cache_catalogo.obtener(espacio, clave, cargar_respuesta)
+    return respuesta_condicional(
+        request, respuesta.cuerpo, respuesta.etag,
+        f"public, max-age={CATALOGO_MAX_AGE}", respuesta.ultima_modificacion
+    )
 
 # Public Routes
 @api_router.get("/")
 async def root():
     return {"message": "API Ciudad Feria - Feria de San Sebastián 2026"}
 
+async def cargar_eventos() -> List[dict]:
+    # fecha_creacion puede venir como string ISO: el adaptador la convierte al validar
+    return await db.eventos.find({}, {"_id": 0}).to_list(100)
+
+# response_model se mantiene para la documentación OpenAPI; el cuerpo sale ya serializado
 @api_router.get("/eventos", response_model=List[Evento])
-async def listar_eventos():
-    eventos = await db.eventos.find({}, {"_id": 0}).to_list(100)
-    for evento in eventos:
-        if isinstance(evento.get('fecha_creacion'), str):
-            evento['fecha_creacion'] = datetime.fromisoformat(evento['fecha_creacion'])
-    return eventos
+async def listar_eventos(request: Request):
+    return await respuesta_catalogo(
+        request, "eventos", "lista", cargar_eventos,
+        lambda eventos: serializar_lista(ADAPTADOR_EVENTOS, eventos)
+    )
 
 @api_router.get("/eventos/{evento_id}")
-async def obtener_evento(evento_id: str):
+async def obtener_evento(evento_id: str, request: Request):
     evento = await db.eventos.find_one({"id": evento_id}, {"_id": 0})
     if not evento:
         raise HTTPException(status_code=404, detail="Evento no encontrado")
     if isinstance(evento.get('fecha_creacion'), str):
         evento['fecha_creacion'] = datetime.fromisoformat(evento['fecha_creacion'])
     
-    # Calcular capacidad real basada en configuración de asientos
-    config_asientos = evento.get('configuracion_asientos', {})
-    tipo_asientos = evento.get('tipo_asientos', 'general')
-    
-    capacidad_total = 0
-    if tipo_asientos == 'mesas' or tipo_asientos == 'mixto':
-        # Sumar sillas de todas las mesas
-        mesas = config_asientos.get('mesas', [])
-        for mesa in mesas:
-            capacidad_total += mesa.get('sillas', 10)
-    
-    if tipo_asientos == 'general' or tipo_asientos == 'mixto':
-        # Sumar capacidad de categorías generales
-        categorias_generales = config_asientos.get('categorias_generales', [])
-        for cat in categorias_generales:
-            capacidad_total += cat.get('capacidad', 0)
-    
-    # Si no hay configuración, usar el valor guardado
-    if capacidad_total == 0:
-        capacidad_total = evento.get('asientos_disponibles', 100)
-    
-    # Calcular entradas vendidas/pendientes
-    entradas = await db.entradas.find({
-        "evento_id": evento_id,
-        "estado_pago": {"$in": ["aprobado", "pendiente"]}
-    }, {"_id": 0}).to_list(1000)
+    # Conteo de vendidas/pendientes en el servidor (índice evento_id + estado_pago)
+    conteos = {
+        grupo['_id']: grupo['total']
+        async for grupo in db.entradas.aggregate([
+            {"$match": {"evento_id": evento_id, "estado_pago": {"$in": ["aprobado", "pendiente"]}}},
+            {"$group": {"_id": "$estado_pago", "total": {"$sum": 1}}}
+        ])
+    }
+    entradas_vendidas = conteos.get('aprobado', 0)
+    entradas_pendientes = conteos.get('pendiente', 0)
     
-    entradas_vendidas = len([e for e in entradas if e.get('estado_pago') == 'aprobado'])
-    entradas_pendientes = len([e for e in entradas if e.get('estado_pago') == 'pendiente'])
+    # Capacidad y precios vienen precalculados; solo eventos sin migrar se derivan al vuelo
+    if evento.get('capacidad_total') is None:
+        evento.update(derivar_campos_evento(evento, capacidad_legado(evento, entradas_vendidas + entradas_pendientes)))
+    capacidad_total = evento['capacidad_total']
     
-    evento['capacidad_total'] = capacidad_total
     evento['entradas_disponibles'] = capacidad_total - entradas_vendidas - entradas_pendientes
     evento['entradas_vendidas'] = entradas_vendidas
     evento['entradas_pendientes'] = entradas_pendientes
     
-    return evento
+    # Los contadores cambian con cada compra: ETag por contenido y max-age corto
+    cuerpo = serializar_json(evento)
+    return respuesta_condicional(request, cuerpo, etag_contenido(cuerpo), f"public, max-age={EVENTO_DETALLE_MAX_AGE}")
+
+async def cargar_categorias() -> List[dict]:
+    return await db.categorias.find({}, {"_id": 0}).sort("orden", 1).to_list(100)
 
 @api_router.get("/categorias", response_model=List[Categoria])
-async def listar_categorias():
-    categorias = await db.categorias.find({}, {"_id": 0}).sort("orden", 1).to_list(100)
-    for categoria in categorias:
-        if isinstance(categoria.get('fecha_creacion'), str):
-            categoria['fecha_creacion'] = datetime.fromisoformat(categoria['fecha_creacion'])
-    return categorias
+async def listar_categorias(request: Request):
+    return await respuesta_catalogo(
+        request, "categorias", "lista", cargar_categorias,
+        lambda categorias: serializar_lista(ADAPTADOR_CATEGORIAS, categorias)
+    )
 
-@api_router.get("/configuracion")
-async def obtener_configuracion():
+async def cargar_configuracion() -> dict:
     config = await db.configuracion.find_one({}, {"_id": 0})
     if not config:
         config_default = ConfiguracionSitio().model_dump()
         config_default['ultima_actualizacion'] = config_default['ultima_actualizacion'].isoformat()
         await db.configuracion.insert_one(config_default)
+        config_default.pop('_id', None)
         return config_default
     if isinstance(config.get('ultima_actualizacion'), str):
         config['ultima_actualizacion'] = datetime.fromisoformat(config['ultima_actualizacion'])
     return config
 
+@api_router.get("/configuracion")
+async def obtener_configuracion(request: Request):
+    return await respuesta_catalogo(request, "configuracion", "actual", cargar_configuracion)
+
+# ==================== CUPOS POR CATEGORÍA ====================
+
+async def contar_entradas_activas(evento_id: str) -> int:
+    """Entradas que ocupan capacidad: aprobadas o pendientes"""
+    return await db.entradas.count_documents({"evento_id": evento_id, "estado_pago": {"$in": ["aprobado", "pendiente"]}})
+
+# Cada evento guarda `cupos`: [{clave, tipo, categoria, capacidad, disponibles}] (ver capacidad.py).
+# La compra descuenta `disponibles` con un único update condicionado a que alcance en todos
+# sus cupos, así que dos compras concurrentes nunca sobrevenden una categoría.
+
+def clave_cupo_entrada(mapa: Optional[MapaAsientos], cupos: List[dict], asiento: Optional[str], categoria: Optional[str]) -> Optional[str]:
+    """Cupo al que pertenece una entrada: la categoría de su mesa si tiene silla, si no su categoría general"""
+    if asiento:
+        indice = mapa.indice(asiento) if mapa else None
+        return clave_cupo('mesa', mapa.mesa_de(indice)['categoria']) if indice is not None else None
+    generales = [c['clave'] for c in cupos if c['tipo'] == 'general']
+    clave = clave_cupo('general', categoria or 'General')
+    return clave if clave in generales else next(iter(generales), None)
+
+async def recalcular_cupos(evento: dict) -> List[dict]:
+    """Rehace los cupos desde la configuración: disponibles = capacidad - entradas aprobadas o pendientes"""
+    activas = await db.entradas.find(
+        {"evento_id": evento['id'], "estado_pago": {"$in": ["aprobado", "pendiente"]}},
+        {"_id": 0, "cupo": 1, "asiento": 1, "categoria_asiento": 1}
+    ).to_list(None)
+    
+    # Sin capacidad_total, asientos_disponibles es un resto ya descontado (capacidad_legado)
+    capacidad_base = evento.get('capacidad_total')
+    if capacidad_base is None:
+        capacidad_base = capacidad_legado(evento, len(activas))
+    cupos = cupos_evento(evento, capacidad_base)
+    mapa = MapaAsientos(evento.get('tipo_asientos', 'general'), evento.get('configuracion_asientos'))
+    
+    usados = {}
+    for entrada in activas:
+        clave = entrada.get('cupo') or clave_cupo_entrada(mapa, cupos, entrada.get('asiento'), entrada.get('categoria_asiento'))
+        usados[clave] = usados.get(clave, 0) + 1
+    for cupo in cupos:
+        cupo['disponibles'] = max(cupo['capacidad'] - usados.get(cupo['clave'], 0), 0)
+    
+    cambios = {"cupos": cupos}
+    if evento.get('tipo_asientos', 'general') == 'general':
+        # Contador histórico de los eventos generales, alineado con los cupos
+        cambios["asientos_disponibles"] = sum(c['disponibles'] for c in cupos)
+    await db.eventos.update_one({"id": evento['id']}, {"$set": cambios})
+    return cupos
+
+def cupo_de_respaldo(cupos: List[dict], categoria: Optional[str]) -> Optional[str]:
+    """
+    Cupo para entradas sin silla reconocible en eventos sin cupo general (mesas sin
+    asientos configurados, compras sin elegir silla): como antes de los cupos la compra
+    no se rechaza, pero descuenta del cupo de su categoría o, si no, del primero
+    """
+    for cupo in cupos:
+        if cupo['categoria'] == categoria:
+            return cupo['clave']
+    return cupos[0]['clave'] if cupos else None
+
+def asignar_cupos_compra(compra: CompraEntrada, tipo_asientos: str, mapa: Optional[MapaAsientos], cupos: List[dict]) -> List[Optional[str]]:
+    """Clave de cupo para cada una de las `cantidad` entradas, en el mismo orden en que se crean"""
+    asientos = (compra.asientos or [])[:compra.cantidad] if tipo_asientos != 'general' else []
+    claves = []
+    for asiento_id in asientos:
+        clave = clave_cupo_entrada(mapa, cupos, asiento_id, None)
+        if clave is None:
+            if mapa is not None and mapa.total:
+                raise HTTPException(status_code=400, detail=f"El asiento {asiento_id} no existe")
+            clave = cupo_de_respaldo(cupos, compra.categoria_asiento)
+        claves.append(clave)
+    
+    restantes = compra.cantidad - len(claves)
+    generales = {c['categoria']: c['clave'] for c in cupos if c['tipo'] == 'general'}
+    for detalle in compra.detalles_compra or []:
+        clave = generales.get(detalle.get('tipo'))
+        try:
+            cantidad = min(int(detalle.get('cantidad') or 0), restantes)
+        except (TypeError, ValueError):
+            continue
+        if clave and cantidad > 0:
+            claves.extend([clave] * cantidad)
+            restantes -= cantidad
+    if restantes > 0:
+        clave = generales.get(compra.categoria_asiento) or next(iter(generales.values()), None)
+        if clave is None:
+            clave = cupo_de_respaldo(cupos, compra.categoria_asiento)
+        claves.extend([clave] * restantes)
+    return claves
+
+async def reservar_cupos(evento_id: str, demanda: dict, descuento_general: int = 0) -> bool:
+    """Descuenta todos los cupos de la compra o ninguno (un update con $elemMatch por cupo y arrayFilters)"""
+    filtro = {"id": evento_id}
+    incrementos = {}
+    filtros_array = []
+    for i, (clave, cantidad) in enumerate(demanda.items()):
+        incrementos[f"cupos.$[c{i}].disponibles"] = -cantidad
+        filtros_array.append({f"c{i}.clave": clave})
+    if demanda:
+        filtro["cupos"] = {"$all": [
+            {"$elemMatch": {"clave": clave, "disponibles": {"$gte": cantidad}}}
+            for clave, cantidad in demanda.items()
+        ]}
+    if descuento_general:
+        filtro["asientos_disponibles"] = {"$gte": descuento_general}
+        incrementos["asientos_disponibles"] = -descuento_general
+    if not incrementos:
+        return True
+    
+    result = await db.eventos.update_one(filtro, {"$inc": incrementos}, array_filters=filtros_array or None)
+    return result.modified_count == 1
+
+async def devolver_cupos(evento_id: str, demanda: dict, devolucion_general: int = 0):
+    incrementos = {f"cupos.$[c{i}].disponibles": cantidad for i, cantidad in enumerate(demanda.values())}
+    filtros_array = [{f"c{i}.clave": clave} for i, clave in enumerate(demanda)]
+    if devolucion_general:
+        incrementos["asientos_disponibles"] = devolucion_general
+    if incrementos:
+        await db.eventos.update_one({"id": evento_id}, {"$inc": incrementos}, array_filters=filtros_array or None)
+
 @api_router.post("/comprar-entrada")
 async def comprar_entrada(compra: CompraEntrada):
     evento = await db.eventos.find_one({"id": compra.evento_id}, {"_id": 0})
@@ -435,43 +918,69 @@ async def comprar_entrada(compra: CompraEntrada):
         raise HTTPException(status_code=404, detail="Evento no encontrado")
     
     tipo_asientos = evento.get('tipo_asientos', 'general')
+    if compra.cantidad < 1:
+        raise HTTPException(status_code=400, detail="La cantidad debe ser al menos 1")
     
     # Validar según tipo de asientos
-    if tipo_asientos == 'general':
-        if evento['asientos_disponibles'] < compra.cantidad:
-            raise HTTPException(status_code=400, detail="No hay suficientes entradas disponibles")
-    else:
+    mapa = None
+    if tipo_asientos != 'general':
         # Para mesas o mixto, verificar asientos específicos
         if compra.asientos:
-            for asiento_id in compra.asientos:
-                entrada_existente = await db.entradas.find_one({
-                    "evento_id": compra.evento_id,
-                    "asiento": asiento_id,
-                    "estado_pago": {"$ne": "rechazado"}
-                })
-                if entrada_existente:
-                    raise HTTPException(
-                        status_code=400, 
-                        detail=f"El asiento {asiento_id} ya no está disponible"
-                    )
+            mapa = await obtener_mapa_asientos(compra.evento_id)
+            # Aviso temprano con una sola consulta; la garantía es el índice único de asiento_clave
+            claves_asientos = [clave_asiento(mapa, asiento_id) for asiento_id in compra.asientos]
+            entrada_existente = await db.entradas.find_one({
+                "evento_id": compra.evento_id,
+                "$or": [
+                    {"asiento_clave": {"$in": claves_asientos}},
+                    {"asiento": {"$in": list(set(compra.asientos) | set(claves_asientos))}}
+                ],
+                "estado_pago": {"$ne": "rechazado"}
+            }, {"_id": 0, "asiento": 1})
+            if entrada_existente:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"El asiento {entrada_existente['asiento']} ya no está disponible"
+                )
+    
+    # Cupo que consume cada entrada (sillas por la categoría de su mesa, el resto por categoría general)
+    cupos = evento.get('cupos')
+    if cupos is None:
+        cupos = await recalcular_cupos(evento)
+    cupos_entradas = asignar_cupos_compra(compra, tipo_asientos, mapa, cupos)
+    
+    # El comprobante se guarda una vez por orden y las entradas solo lo referencian
+    comprobante = await resolver_comprobante(compra.comprobante_pago)
+    
+    orden = Orden(
+        evento_id=compra.evento_id,
+        nombre_evento=evento['nombre'],
+        nombre_comprador=compra.nombre_comprador,
+        email_comprador=compra.email_comprador,
+        telefono_comprador=compra.telefono_comprador,
+        metodo_pago=compra.metodo_pago,
+        comprobante_pago=comprobante.get('comprobante_pago'),
+        comprobante_miniatura=comprobante.get('comprobante_miniatura'),
+        categoria_asiento=compra.categoria_asiento,
+        cantidad=compra.cantidad,
+        precio_total=compra.precio_total
+    )
+    fecha_compra = orden.fecha_compra.isoformat()
     
     entradas = []
+    docs_entradas = []
+    datos_por_id = {}
     for i in range(compra.cantidad):
         entrada_id = str(uuid.uuid4())
         
         # Generar código alfanumérico
-        codigo_alfanumerico = generar_codigo_alfanumerico(compra.evento_id, entrada_id)
+        codigo_alfanumerico = generar_codigo_alfanumerico()
         
         # Asignar asiento si está especificado
         asiento = compra.asientos[i] if compra.asientos and i < len(compra.asientos) else None
         
-        # Extraer información de mesa si aplica
-        mesa_info = None
-        if asiento and asiento.startswith('M'):
-            # Formato: M{mesa_id}-S{silla}
-            parts = asiento.split('-')
-            if len(parts) == 2:
-                mesa_info = parts[0].replace('M', '')
+        # Mesa y silla resueltas con el mapa del evento (acepta "Mesa 1-Silla3" y "M1-S3")
+        ubicacion = ubicar_asiento(mapa, asiento)
         
         datos_entrada = {
             "entrada_id": entrada_id,
@@ -486,9 +995,10 @@ async def comprar_entrada(compra: CompraEntrada):
         }
         
         hash_validacion = generar_hash(datos_entrada)
+        datos_por_id[entrada_id] = dict(datos_entrada)
         datos_entrada['hash'] = hash_validacion
         
-        qr_image, qr_payload = generar_qr_seguro(datos_entrada)
+        qr_image, qr_payload = generar_qr_v3(entrada_id, compra.evento_id)
         
         entrada = Entrada(
             id=entrada_id,
@@ -496,43 +1006,301 @@ async def comprar_entrada(compra: CompraEntrada):
             nombre_evento=evento['nombre'],
             nombre_comprador=compra.nombre_comprador,
             email_comprador=compra.email_comprador,
-            telefono_comprador=compra.telefono_comprador,
             codigo_qr=qr_image,
             qr_payload=qr_payload,
             asiento=asiento,
-            mesa=mesa_info,
+            mesa=ubicacion['mesa_id'],
+            **ubicacion,
             estado_pago="pendiente",
-            metodo_pago=compra.metodo_pago,
-            comprobante_pago=compra.comprobante_pago,
+            orden_id=orden.id,
             hash_validacion=hash_validacion,
             estado_entrada="fuera",
             historial_acceso=[]
         )
         
-        doc_entrada = entrada.model_dump()
-        doc_entrada['fecha_compra'] = doc_entrada['fecha_compra'].isoformat()
+        doc_entrada = entrada.model_dump(exclude=set(CAMPOS_ORDEN_EN_ENTRADA))
+        doc_entrada['fecha_compra'] = fecha_compra
         doc_entrada['codigo_alfanumerico'] = codigo_alfanumerico
         doc_entrada['categoria_asiento'] = compra.categoria_asiento
-        await db.entradas.insert_one(doc_entrada)
+        doc_entrada['numero_entrada'] = i + 1
+        doc_entrada['email_normalizado'] = normalizar_email(compra.email_comprador)
+        doc_entrada['cupo'] = cupos_entradas[i]
+        if asiento:
+            doc_entrada['asiento_clave'] = clave_asiento(mapa, asiento)
+        docs_entradas.append(doc_entrada)
         
         entrada_dict = entrada.model_dump()
         entrada_dict['codigo_alfanumerico'] = codigo_alfanumerico
         entradas.append(entrada_dict)
     
-    # Solo decrementar para entradas generales
-    if tipo_asientos == 'general':
-        await db.eventos.update_one(
-            {"id": compra.evento_id},
-            {"$inc": {"asientos_disponibles": -compra.cantidad}}
-        )
+    orden.entrada_ids = [doc['id'] for doc in docs_entradas]
+    doc_orden = orden.model_dump()
+    doc_orden['fecha_compra'] = fecha_compra
+    doc_orden['email_normalizado'] = normalizar_email(compra.email_comprador)
+    
+    # Descuento atómico de todos los cupos de la compra en un solo update condicionado
+    demanda = {}
+    for clave in cupos_entradas:
+        if clave is not None:
+            demanda[clave] = demanda.get(clave, 0) + 1
+    descuento_general = compra.cantidad if tipo_asientos == 'general' else 0
+    if not await reservar_cupos(compra.evento_id, demanda, descuento_general):
+        raise HTTPException(status_code=400, detail="No hay suficientes entradas disponibles")
+    
+    # Verificación final y marcado en el mapa sin await de por medio: dentro de este
+    # proceso dos compras de la misma silla (o una silla retenida por otra sesión) no pasan
+    # ambas. Entre procesos lo decide el índice único de asiento_clave al insertar.
+    mapa = mapas_asientos.get(compra.evento_id) if tipo_asientos != 'general' else None
+    if mapa and compra.asientos:
+        for asiento_id in compra.asientos:
+            indice = mapa.indice(asiento_id)
+            if indice is not None and (mapa.estado(indice) or mapa.retenido_por_otro(indice, compra.session_id)):
+                await devolver_cupos(compra.evento_id, demanda, descuento_general)
+                raise HTTPException(status_code=400, detail=f"El asiento {asiento_id} ya no está disponible")
+    actualizar_mapas(docs_entradas, PENDIENTE)
+    
+    entradas_por_id = {entrada['id']: entrada for entrada in entradas}
+    
+    def regenerar_codigo(doc: dict):
+        # El código entra en el hash de validación (el QR v3 no lo lleva y no cambia)
+        datos = datos_por_id[doc['id']]
+        datos['codigo_alfanumerico'] = generar_codigo_alfanumerico()
+        doc['codigo_alfanumerico'] = datos['codigo_alfanumerico']
+        doc['hash_validacion'] = generar_hash(datos)
+        entradas_por_id[doc['id']].update(codigo_alfanumerico=doc['codigo_alfanumerico'], hash_validacion=doc['hash_validacion'])
+    
+    try:
+        await db.ordenes.insert_one(doc_orden)
+        if docs_entradas:
+            await insertar_entradas(docs_entradas, regenerar_codigo)
+    except Exception as e:
+        actualizar_mapas(docs_entradas, None)
+        await devolver_cupos(compra.evento_id, demanda, descuento_general)
+        await db.entradas.delete_many({"id": {"$in": orden.entrada_ids}})
+        await db.ordenes.delete_one({"id": orden.id})
+        if isinstance(e, BulkWriteError) and any(es_asiento_duplicado(error) for error in e.details.get('writeErrors', [])):
+            # Otra compra (de otro proceso) ganó la silla: el mapa local quedó viejo
+            invalidar_mapa(compra.evento_id)
+            raise HTTPException(status_code=400, detail="Alguno de los asientos elegidos ya no está disponible")
+        raise
+    if mapa and compra.session_id:
+        mapa.liberar_sesion(compra.session_id)
     
     return {
         "success": True,
         "message": f"{compra.cantidad} entrada(s) en espera de aprobación",
+        "orden_id": orden.id,
         "entradas": entradas,
         "requiere_aprobacion": True
     }
 
+# ==================== VALIDACIÓN EN PUERTA ====================
+
+ESCANEOS_INVALIDOS_MAX = int(os.environ.get('ESCANEOS_INVALIDOS_MAX', '20'))
+ESCANEOS_INVALIDOS_VENTANA = float(os.environ.get('ESCANEOS_INVALIDOS_VENTANA', '60'))
+
+limitador_escaneos = LimitadorEscaneos(ESCANEOS_INVALIDOS_MAX, ESCANEOS_INVALIDOS_VENTANA)
+
+# Tope de escaneos (válidos o no) por puerta autenticada con token: un dispositivo real no
+# pasa de unos pocos por segundo, así que una puerta comprometida no satura la base
+ESCANEOS_PUERTA_MAX = int(os.environ.get('ESCANEOS_PUERTA_MAX', '600'))
+ESCANEOS_PUERTA_VENTANA = float(os.environ.get('ESCANEOS_PUERTA_VENTANA', '60'))
+limitador_puertas = LimitadorEscaneos(ESCANEOS_PUERTA_MAX, ESCANEOS_PUERTA_VENTANA)
+
+# Tokens de puerta: JWT firmados con SECRET_KEY, typ "puerta", limitados a un evento y una
+# puerta, emitidos por un administrador para cada dispositivo. Se verifican con la misma
+# caché y la misma lista de revocados que los tokens del panel, sin tocar la base.
+# Con PUERTA_TOKEN_REQUERIDO=false (por defecto) las puertas sin token siguen validando
+# identificadas por X-Puerta o por IP.
+PUERTA_TOKEN_HORAS = float(os.environ.get('PUERTA_TOKEN_HORAS', '12'))
+PUERTA_TOKEN_HORAS_MAX = 72
+PUERTA_TOKEN_REQUERIDO = os.environ.get('PUERTA_TOKEN_REQUERIDO', 'false').lower() in ('1', 'true', 'si', 'sí')
+
+async def token_puerta_de(request: Request) -> Optional[dict]:
+    """Claims del token de puerta (header X-Token-Puerta), o None si el dispositivo no envía uno"""
+    token = request.headers.get('X-Token-Puerta')
+    if not token:
+        if PUERTA_TOKEN_REQUERIDO:
+            raise HTTPException(status_code=401, detail="Token de puerta requerido")
+        return None
+    
+    claims = claims_de_token(token)
+    if claims.get("typ") != "puerta":
+        raise HTTPException(status_code=401, detail="Token de puerta inválido")
+    await refrescar_revocados()
+    if id_token(token, claims) in jtis_revocados:
+        raise HTTPException(status_code=401, detail="Token de puerta revocado")
+    return claims
+
+# Proxies cuyo X-Forwarded-For se cree (ver limites.py); fuera de ellos cuenta la IP de la conexión
+PROXIES_CONFIABLES = redes_confiables(os.environ.get('PROXIES_CONFIABLES', PROXIES_CONFIABLES_DEFECTO))
+
+def ip_de(request: Request) -> str:
+    """IP real del cliente, también detrás del ingress"""
+    return ip_cliente(
+        request.client.host if request.client else None,
+        request.headers.get('X-Forwarded-For'),
+        PROXIES_CONFIABLES
+    )
+
+def puerta_de(request: Request, body: dict, token_puerta: Optional[dict] = None) -> str:
+    """
+    Identidad de la puerta para el limitador y las métricas: la del token si lo hay; si
+    no, la IP del cliente. La puerta que declare el cliente (body o X-Puerta) no sirve de
+    clave: con cambiarla en cada petición se tendría un cupo de fallos nuevo. Solo queda en el historial.
+    """
+    if token_puerta:
+        return f"puerta:{token_puerta['evento_id']}:{token_puerta['puerta']}"
+    return f"ip:{ip_de(request)}"
+
+def fuera_de_evento(token_puerta: Optional[dict], evento_id: Optional[str]) -> bool:
+    """True si la puerta está limitada a otro evento"""
+    return bool(token_puerta) and token_puerta['evento_id'] != evento_id
+
+def registro_acceso(tipo: str, token_puerta: Optional[dict], body: dict) -> dict:
+    """Elemento de historial_acceso con la puerta que lo registró"""
+    registro = {"tipo": tipo, "fecha": datetime.now(timezone.utc).isoformat()}
+    if token_puerta:
+        registro["puerta"] = token_puerta['puerta']
+        registro["dispositivo"] = token_puerta.get('dispositivo')
+    elif body.get('puerta'):
+        registro["puerta"] = str(body['puerta'])
+    return registro
+
+def verificar_limite_puerta(puerta: str, token_puerta: Optional[dict] = None):
+    espera = limitador_escaneos.reintentar_en(puerta)
+    if espera:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiados escaneos inválidos en esta puerta. Espere unos segundos",
+            headers={"Retry-After": str(espera)}
+        )
+    if token_puerta:
+        espera = limitador_puertas.reintentar_en(puerta)
+        if espera:
+            raise HTTPException(
+                status_code=429,
+                detail="Demasiados escaneos en esta puerta. Espere unos segundos",
+                headers={"Retry-After": str(espera)}
+            )
+        limitador_puertas.registrar(puerta)
+    metricas_puertas.registrar(puerta, "escaneos")
+
+def escaneo_invalido(puerta: str, detalle: str, status_code: int = 400) -> HTTPException:
+    limitador_escaneos.registrar_fallo(puerta)
+    metricas_puertas.registrar(puerta, "invalidos")
+    return HTTPException(status_code=status_code, detail=detalle)
+
+class MetricasPuertas:
+    """
+    Contadores por puerta (escaneos, inválidos, entradas, salidas) e instantes de los
+    escaneos del último minuto para el ritmo. Son de este proceso: con varios workers
+    cada uno informa los suyos; el historial de accesos guarda la puerta para lo demás.
+    """
+    
+    VENTANA_RITMO = 60.0
+    MAX_PUERTAS = 10000
+    
+    def __init__(self):
+        self._contadores = {}
+        self._recientes = {}
+        self.desde = datetime.now(timezone.utc).isoformat()
+    
+    def registrar(self, puerta: str, contador: str):
+        if puerta not in self._contadores and len(self._contadores) >= self.MAX_PUERTAS:
+            return
+        contadores = self._contadores.setdefault(puerta, {"escaneos": 0, "invalidos": 0, "entradas": 0, "salidas": 0})
+        contadores[contador] += 1
+        if contador == "escaneos":
+            recientes = self._recientes.setdefault(puerta, deque())
+            ahora = time.monotonic()
+            recientes.append(ahora)
+            while recientes[0] <= ahora - self.VENTANA_RITMO:
+                recientes.popleft()
+    
+    def resumen(self, prefijo: str = "") -> List[dict]:
+        ahora = time.monotonic()
+        puertas = []
+        for puerta, contadores in self._contadores.items():
+            if not puerta.startswith(prefijo):
+                continue
+            recientes = self._recientes.get(puerta, ())
+            por_minuto = sum(1 for instante in recientes if instante > ahora - self.VENTANA_RITMO)
+            puertas.append({"puerta": puerta, **contadores, "escaneos_ultimo_minuto": por_minuto})
+        return sorted(puertas, key=lambda p: p["puerta"])
+
+metricas_puertas = MetricasPuertas()
+
+class TokenPuertaCreate(BaseModel):
+    evento_id: str
+    puerta: str
+    dispositivo: Optional[str] = None
+    horas: Optional[float] = None
+
+@api_router.post("/admin/puertas/token")
+async def emitir_token_puerta(datos: TokenPuertaCreate, current_user: str = Depends(requiere_admin)):
+    """Token para un dispositivo de puerta, válido solo para un evento y una puerta"""
+    puerta = datos.puerta.strip()
+    if not puerta or ":" in puerta:
+        raise HTTPException(status_code=400, detail="Nombre de puerta inválido")
+    if not await db.eventos.find_one({"id": datos.evento_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Evento no encontrado")
+    
+    horas = min(max(datos.horas or PUERTA_TOKEN_HORAS, 0.1), PUERTA_TOKEN_HORAS_MAX)
+    expira = datetime.now(timezone.utc) + timedelta(hours=horas)
+    token = create_access_token(
+        data={
+            "sub": f"puerta:{datos.evento_id}:{puerta}",
+            "typ": "puerta",
+            "evento_id": datos.evento_id,
+            "puerta": puerta,
+            "dispositivo": datos.dispositivo
+        },
+        expires_delta=timedelta(hours=horas)
+    )
+    claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    
+    await db.tokens_puerta.insert_one({
+        "jti": claims["jti"],
+        "evento_id": datos.evento_id,
+        "puerta": puerta,
+        "dispositivo": datos.dispositivo,
+        "emitido_por": current_user,
+        "fecha": datetime.now(timezone.utc),
+        "expira": expira
+    })
+    return {"token": token, "jti": claims["jti"], "puerta": puerta, "expira": expira.isoformat()}
+
+@api_router.get("/admin/puertas/tokens")
+async def listar_tokens_puerta(evento_id: Optional[str] = None, current_user: str = Depends(requiere_admin)):
+    filtro = {"expira": {"$gt": datetime.now(timezone.utc)}}
+    if evento_id:
+        filtro["evento_id"] = evento_id
+    tokens = await db.tokens_puerta.find(filtro, {"_id": 0}).sort("fecha", DESCENDING).to_list(1000)
+    await refrescar_revocados()
+    for token in tokens:
+        token["revocado"] = token["jti"] in jtis_revocados
+    return tokens
+
+@api_router.delete("/admin/puertas/token/{jti}")
+async def revocar_token_puerta(jti: str, current_user: str = Depends(requiere_admin)):
+    token = await db.tokens_puerta.find_one({"jti": jti}, {"_id": 0})
+    if not token:
+        raise HTTPException(status_code=404, detail="Token de puerta no encontrado")
+    await db.tokens_revocados.update_one(
+        {"jti": jti},
+        {"$setOnInsert": {"jti": jti, "username": token["puerta"], "expira": token["expira"], "fecha": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    jtis_revocados.add(jti)
+    return {"success": True}
+
+@api_router.get("/admin/puertas/metricas")
+async def metricas_de_puertas(evento_id: Optional[str] = None, current_user: str = Depends(get_current_user)):
+    """Escaneos por puerta desde que arrancó este proceso (las puertas con token llevan el evento en su id)"""
+    prefijo = f"puerta:{evento_id}:" if evento_id else ""
+    return {"desde": metricas_puertas.desde, "puertas": metricas_puertas.resumen(prefijo)}
+
 @api_router.post("/validar-entrada")
 async def validar_entrada(request: Request):
     body = await request.json()
@@ -542,15 +1310,25 @@ async def validar_entrada(request: Request):
     if not qr_payload:
         raise HTTPException(status_code=400, detail="Payload QR no proporcionado")
     
-    datos_entrada = validar_qr(qr_payload)
-    if not datos_entrada:
-        raise HTTPException(status_code=400, detail="Código QR inválido o corrupto")
+    token_puerta = await token_puerta_de(request)
+    puerta = puerta_de(request, body, token_puerta)
+    verificar_limite_puerta(puerta, token_puerta)
+    
+    # El prefijo elige el formato (v1, v2 o v3, conviven mientras circulen entradas viejas);
+    # cada codec autentica el payload con CPU antes de consultar la base
+    codec = CODECS_QR.para_payload(qr_payload)
+    datos_qr = codec.decodificar(qr_payload)
+    if not datos_qr or not codec.verificar(datos_qr):
+        raise escaneo_invalido(puerta, "Código QR inválido o corrupto")
+    entrada_id = datos_qr['entrada_id']
     
-    entrada_id = datos_entrada.get('entrada_id')
     entrada = await db.entradas.find_one({"id": entrada_id}, {"_id": 0})
     
     if not entrada:
-        raise HTTPException(status_code=404, detail="Entrada no encontrada")
+        raise escaneo_invalido(puerta, "Entrada no encontrada", status_code=404)
+    
+    if fuera_de_evento(token_puerta, entrada.get('evento_id')):
+        raise escaneo_invalido(puerta, "La entrada es de otro evento", status_code=403)
     
     # Verificar estado de pago
     if entrada.get('estado_pago') != 'aprobado':
@@ -560,20 +1338,18 @@ async def validar_entrada(request: Request):
             "requiere_aprobacion": True
         }
     
-    # Verificar hash
-    hash_verificacion = generar_hash({
-        "entrada_id": datos_entrada['entrada_id'],
-        "codigo_alfanumerico": datos_entrada.get('codigo_alfanumerico', ''),
-        "evento_id": datos_entrada['evento_id'],
-        "nombre_evento": datos_entrada['nombre_evento'],
-        "nombre_comprador": datos_entrada['nombre_comprador'],
-        "email_comprador": datos_entrada['email_comprador'],
-        "telefono_comprador": datos_entrada.get('telefono_comprador'),
-        "numero_entrada": datos_entrada['numero_entrada'],
-        "asiento": datos_entrada.get('asiento')
-    })
+    # Auténtico pero ¿vigente? (evento de la entrada, último hash o última emisión del QR)
+    alerta = codec.comparar(datos_qr, entrada)
+    if alerta == "qr_reemplazado":
+        return {
+            "valido": False,
+            "mensaje": "Este QR fue reemplazado por uno más reciente",
+            "tipo_alerta": "qr_reemplazado"
+        }
     
-    if hash_verificacion != entrada['hash_validacion']:
+    if alerta:
+        limitador_escaneos.registrar_fallo(puerta)
+        metricas_puertas.registrar(puerta, "invalidos")
         return {
             "valido": False,
             "mensaje": "⚠️ ALERTA: Entrada fraudulenta detectada",
@@ -608,10 +1384,8 @@ async def validar_entrada(request: Request):
         
         # Registrar entrada
         historial = entrada.get('historial_acceso', [])
-        historial.append({
-            "tipo": "entrada",
-            "fecha": datetime.now(timezone.utc).isoformat()
-        })
+        historial.append(registro_acceso("entrada", token_puerta, body))
+        metricas_puertas.registrar(puerta, "entradas")
         
         await db.entradas.update_one(
             {"id": entrada_id},
@@ -646,10 +1420,8 @@ async def validar_entrada(request: Request):
         
         # Registrar salida
         historial = entrada.get('historial_acceso', [])
-        historial.append({
-            "tipo": "salida",
-            "fecha": datetime.now(timezone.utc).isoformat()
-        })
+        historial.append(registro_acceso("salida", token_puerta, body))
+        metricas_puertas.registrar(puerta, "salidas")
         
         await db.entradas.update_one(
             {"id": entrada_id},
@@ -671,16 +1443,133 @@ async def validar_entrada(request: Request):
             }
         }
 
+# ==================== ÍNDICE DE CÓDIGOS ====================
+
+# Cada proceso guarda los códigos de cada evento (codigos.IndiceCodigos). Cada
+# INDICE_CODIGOS_REFRESCO segundos trae solo las entradas nuevas (fecha_compra >= marca,
+# con margen por relojes y compras en vuelo) y cada INDICE_CODIGOS_TTL lo rehace entero
+# para soltar las eliminadas. El índice solo sugiere: la validación siempre va a Mongo.
+INDICE_CODIGOS_REFRESCO = float(os.environ.get('INDICE_CODIGOS_REFRESCO', '2'))
+INDICE_CODIGOS_TTL = float(os.environ.get('INDICE_CODIGOS_TTL', '300'))
+INDICE_CODIGOS_SOLAPE = timedelta(seconds=60)
+LARGO_MINIMO_BUSQUEDA_CODIGO = 4
+CANDIDATOS_CODIGO_MAXIMO = 50
+
+PROYECCION_INDICE_CODIGOS = {"_id": 0, "id": 1, "evento_id": 1, "codigo_alfanumerico": 1, "nombre_comprador": 1, "asiento": 1, "fecha_compra": 1}
+
+indices_codigos = {}
+_locks_indices_codigos = {}
+
+async def obtener_indice_codigos(evento_id: str) -> IndiceCodigos:
+    indice = indices_codigos.get(evento_id)
+    if indice and time.monotonic() - indice.refrescado_en < INDICE_CODIGOS_REFRESCO:
+        return indice
+    
+    async with _locks_indices_codigos.setdefault(evento_id, asyncio.Lock()):
+        ahora = time.monotonic()
+        indice = indices_codigos.get(evento_id)
+        if indice and ahora - indice.refrescado_en < INDICE_CODIGOS_REFRESCO:
+            return indice
+        
+        # Los índices que nadie consulta hace más de un TTL se sueltan
+        for id_evento in [e for e, i in indices_codigos.items() if ahora - i.refrescado_en > INDICE_CODIGOS_TTL]:
+            del indices_codigos[id_evento]
+            _locks_indices_codigos.pop(id_evento, None)
+        indice = indices_codigos.get(evento_id)
+        
+        filtro = {"evento_id": evento_id, "codigo_alfanumerico": {"$type": "string"}}
+        if indice is None or ahora - indice.cargado_en > INDICE_CODIGOS_TTL or indice.marca is None:
+            nuevo = IndiceCodigos()
+            nuevo.cargar(await db.entradas.find(filtro, PROYECCION_INDICE_CODIGOS).to_list(None))
+            nuevo.cargado_en = ahora
+            indice = indices_codigos[evento_id] = nuevo
+        else:
+            try:
+                desde = (datetime.fromisoformat(indice.marca) - INDICE_CODIGOS_SOLAPE).isoformat()
+            except ValueError:
+                desde = indice.marca
+            filtro["fecha_compra"] = {"$gte": desde}
+            indice.actualizar(await db.entradas.find(filtro, PROYECCION_INDICE_CODIGOS).to_list(None))
+        indice.refrescado_en = ahora
+        return indice
+
+async def buscar_codigos(texto: str, evento_id: Optional[str], limite: int) -> dict:
+    """Códigos que empiezan con `texto` y existentes a un error de tipeo, en un evento o en todos"""
+    if evento_id:
+        eventos_ids = [evento_id]
+    else:
+        eventos_ids = [e['id'] async for e in db.eventos.find({}, {"_id": 0, "id": 1})]
+    
+    # Sin prefijo se asume el de las entradas (el personal suele teclear solo la parte aleatoria)
+    prefijos = [texto] if texto.startswith("CF-") else [texto, f"{PREFIJO_CODIGO}-{texto}"]
+    con_prefijo = []
+    candidatos = []
+    for id_evento in eventos_ids:
+        indice = await obtener_indice_codigos(id_evento)
+        for prefijo in prefijos:
+            con_prefijo += [{"codigo": c, **indice.info[c]} for c in indice.con_prefijo(prefijo, limite - len(con_prefijo))]
+            candidatos += [{"codigo": c, **indice.info[c]} for c in indice.candidatos(prefijo, limite - len(candidatos))]
+        if len(con_prefijo) >= limite and len(candidatos) >= limite:
+            break
+    return {"prefijo": con_prefijo[:limite], "candidatos": candidatos[:limite]}
+
+async def candidatos_codigo(codigo: str, evento_id: Optional[str], limite: int = 5) -> List[str]:
+    """
+    Solo los códigos a un error de tipeo, sin datos del comprador, y solo para puertas con
+    token o sesión del panel (ver validar_entrada_por_codigo). Solo dentro de un evento:
+    sin él se cargarían los índices de todos.
+    """
+    if not evento_id:
+        return []
+    encontrados = await buscar_codigos(codigo, evento_id, limite)
+    return [c['codigo'] for c in encontrados['candidatos'] if c['codigo'] != codigo]
+
+@api_router.get("/buscar-codigos")
+async def buscar_codigos_entrada(
+    q: str,
+    evento_id: Optional[str] = None,
+    limite: int = 10,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Autocompletado para la carga manual en puerta: `prefijo` son los códigos que empiezan
+    con lo tecleado y `candidatos` los que están a un carácter cambiado o transpuesto.
+    """
+    texto = normalizar_codigo(q)
+    if len(texto) < LARGO_MINIMO_BUSQUEDA_CODIGO:
+        raise HTTPException(status_code=400, detail=f"Escriba al menos {LARGO_MINIMO_BUSQUEDA_CODIGO} caracteres")
+    return await buscar_codigos(texto, evento_id, max(1, min(limite, CANDIDATOS_CODIGO_MAXIMO)))
+
 @api_router.post("/validar-entrada-codigo")
 async def validar_entrada_por_codigo(request: Request):
     """Valida una entrada por su código alfanumérico"""
     body = await request.json()
-    codigo = body.get('codigo', '').strip().upper()
+    codigo = normalizar_codigo(body.get('codigo', ''))
     accion = body.get('accion', 'verificar')
     
     if not codigo:
         raise HTTPException(status_code=400, detail="Código requerido")
     
+    token_puerta = await token_puerta_de(request)
+    puerta = puerta_de(request, body, token_puerta)
+    verificar_limite_puerta(puerta, token_puerta)
+    evento_id = token_puerta['evento_id'] if token_puerta else body.get('evento_id')
+    
+    # Error de tipeo: el dígito de control no cuadra, se rechaza sin consultar la base
+    # (los candidatos salen del índice en memoria). Cuenta como escaneo inválido.
+    if not control_valido(codigo):
+        limitador_escaneos.registrar_fallo(puerta)
+        metricas_puertas.registrar(puerta, "invalidos")
+        respuesta = {
+            "valido": False,
+            "mensaje": "❌ Código mal escrito, revise los caracteres",
+            "tipo_alerta": "codigo_mal_escrito"
+        }
+        # Los candidatos son códigos reales: una petición anónima con evento_id no los recibe
+        if token_puerta or await sesion_opcional(request):
+            respuesta["candidatos"] = await candidatos_codigo(codigo, evento_id)
+        return respuesta
+    
     # Buscar entrada por código alfanumérico
     entrada = await db.entradas.find_one({
         "codigo_alfanumerico": codigo,
@@ -688,10 +1577,18 @@ async def validar_entrada_por_codigo(request: Request):
     }, {"_id": 0})
     
     if not entrada:
-        return {
+        limitador_escaneos.registrar_fallo(puerta)
+        metricas_puertas.registrar(puerta, "invalidos")
+        respuesta = {
             "valido": False,
             "mensaje": "❌ Código no encontrado o entrada no aprobada"
         }
+        if token_puerta or await sesion_opcional(request):
+            respuesta["candidatos"] = await candidatos_codigo(codigo, evento_id)
+        return respuesta
+    
+    if fuera_de_evento(token_puerta, entrada.get('evento_id')):
+        raise escaneo_invalido(puerta, "La entrada es de otro evento", status_code=403)
     
     entrada_id = entrada['id']
     
@@ -721,10 +1618,8 @@ async def validar_entrada_por_codigo(request: Request):
             }
         
         historial = entrada.get('historial_acceso', [])
-        historial.append({
-            "tipo": "entrada",
-            "fecha": datetime.now(timezone.utc).isoformat()
-        })
+        historial.append(registro_acceso("entrada", token_puerta, body))
+        metricas_puertas.registrar(puerta, "entradas")
         
         await db.entradas.update_one(
             {"id": entrada_id},
@@ -748,10 +1643,8 @@ async def validar_entrada_por_codigo(request: Request):
             }
         
         historial = entrada.get('historial_acceso', [])
-        historial.append({
-            "tipo": "salida",
-            "fecha": datetime.now(timezone.utc).isoformat()
-        })
+        historial.append(registro_acceso("salida", token_puerta, body))
+        metricas_puertas.registrar(puerta, "salidas")
         
         await db.entradas.update_one(
             {"id": entrada_id},
@@ -776,6 +1669,7 @@ async def regenerar_qr_entrada(entrada_id: str, current_user: str = Depends(get_
     
     if entrada.get('estado_pago') != 'aprobado':
         raise HTTPException(status_code=400, detail="Solo se pueden regenerar QRs de entradas aprobadas")
+    await adjuntar_ordenes([entrada])
     
     # Obtener evento
     evento = await db.eventos.find_one({"id": entrada['evento_id']}, {"_id": 0})
@@ -798,8 +1692,9 @@ async def regenerar_qr_entrada(entrada_id: str, current_user: str = Depends(get_
     hash_validacion = generar_hash(datos_entrada)
     datos_entrada['hash'] = hash_validacion
     
-    # Generar QR
-    qr_image, qr_payload = generar_qr_seguro(datos_entrada)
+    # Generar QR (formato compacto v3); la nueva emisión invalida los QR anteriores
+    qr_emision = entrada.get('qr_emision', 0) + 1
+    qr_image, qr_payload = generar_qr_v3(entrada_id, entrada['evento_id'], qr_emision)
     
     # Actualizar entrada
     await db.entradas.update_one(
@@ -808,6 +1703,7 @@ async def regenerar_qr_entrada(entrada_id: str, current_user: str = Depends(get_
             "$set": {
                 "codigo_qr": qr_image,
                 "qr_payload": qr_payload,
+                "qr_emision": qr_emision,
                 "hash_validacion": hash_validacion,
                 "nombre_evento": nombre_evento
             }
@@ -820,16 +1716,58 @@ async def regenerar_qr_entrada(entrada_id: str, current_user: str = Depends(get_
         "entrada_id": entrada_id
     }
 
+# Campos que el portal del comprador no necesita en el listado; el QR y la imagen
+# se cargan bajo demanda desde qr_url / imagen_url
+CAMPOS_EXCLUIDOS_MIS_ENTRADAS = (
+    "codigo_qr", "qr_payload", "hash_validacion", "historial_acceso",
+    "comprobante_pago", "comprobante_miniatura"
+)
+LIMITE_MIS_ENTRADAS_DEFECTO = 50
+LIMITE_MIS_ENTRADAS_MAXIMO = 200
+
+def normalizar_email(email: Optional[str]) -> str:
+    return (email or "").strip().lower()
+
 @api_router.get("/mis-entradas/{email}")
-async def obtener_mis_entradas(email: str):
-    entradas = await db.entradas.find({"email_comprador": email}, {"_id": 0}).to_list(100)
+async def obtener_mis_entradas(
+    email: str,
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = LIMITE_MIS_ENTRADAS_DEFECTO
+):
+    """Entradas del comprador (email sin distinguir mayúsculas), paginadas por cursor en X-Next-Cursor"""
+    filtro = {"email_normalizado": normalizar_email(email)}
+    if after:
+        filtro = {"$and": [filtro, filtro_cursor(after)]}
+    
+    limit = max(1, min(limit, LIMITE_MIS_ENTRADAS_MAXIMO))
+    proyeccion = {"_id": 0, **{campo: 0 for campo in CAMPOS_EXCLUIDOS_MIS_ENTRADAS}}
+    entradas = await db.entradas.find(filtro, proyeccion).sort(
+        [("fecha_compra", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    entradas = recortar_pagina(entradas, limit, response)
     for entrada in entradas:
-        if isinstance(entrada.get('fecha_compra'), str):
-            entrada['fecha_compra'] = datetime.fromisoformat(entrada['fecha_compra'])
-        if entrada.get('fecha_uso') and isinstance(entrada.get('fecha_uso'), str):
-            entrada['fecha_uso'] = datetime.fromisoformat(entrada['fecha_uso'])
+        entrada['imagen_url'] = f"/api/entrada/{entrada['id']}/imagen"
+        if entrada.get('estado_pago') == 'aprobado':
+            entrada['qr_url'] = f"/api/entrada/{entrada['id']}/qr"
     return entradas
 
+@api_router.get("/entrada/{entrada_id}/qr")
+async def obtener_qr_entrada(entrada_id: str):
+    """Devuelve el PNG del QR de una entrada aprobada"""
+    entrada = await db.entradas.find_one(
+        {"id": entrada_id},
+        {"_id": 0, "codigo_qr": 1, "estado_pago": 1}
+    )
+    if not entrada or not entrada.get('codigo_qr'):
+        raise HTTPException(status_code=404, detail="Entrada no encontrada")
+    if entrada.get('estado_pago') != 'aprobado':
+        raise HTTPException(status_code=403, detail="Entrada no aprobada aún")
+    
+    png = base64.b64decode(entrada['codigo_qr'].split(',', 1)[-1])
+    return Response(content=png, media_type="image/png")
+
 # Admin Routes
 @api_router.post("/admin/login")
 async def admin_login(login: AdminLogin):
@@ -838,7 +1776,7 @@ async def admin_login(login: AdminLogin):
     if not admin:
         # Create default admin on first login attempt
         if login.username == "admin" and login.password == "admin123":
-            hashed = get_password_hash("admin123")
+            hashed = await hash_password("admin123")
             await db.admin_users.insert_one({
                 "username": "admin", 
                 "hashed_password": hashed,
@@ -848,7 +1786,7 @@ async def admin_login(login: AdminLogin):
         else:
             raise HTTPException(status_code=401, detail="Usuario o contraseña incorrectos")
     
-    if not verify_password(login.password, admin["hashed_password"]):
+    if not await verificar_login(admin, login.password):
         raise HTTPException(status_code=401, detail="Usuario o contraseña incorrectos")
     
     # Include role in token
@@ -856,6 +1794,26 @@ async def admin_login(login: AdminLogin):
     access_token = create_access_token(data={"sub": admin["username"], "role": role})
     return {"access_token": access_token, "token_type": "bearer", "role": role}
 
+@api_router.post("/admin/logout")
+async def admin_logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    claims: dict = Depends(get_current_claims)
+):
+    """Revoca el token actual hasta su vencimiento"""
+    jti = id_token(credentials.credentials, claims)
+    await db.tokens_revocados.update_one(
+        {"jti": jti},
+        {"$setOnInsert": {
+            "jti": jti,
+            "username": claims["sub"],
+            "expira": datetime.fromtimestamp(claims.get("exp", time.time()), timezone.utc),
+            "fecha": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+    jtis_revocados.add(jti)
+    return {"message": "Sesión cerrada"}
+
 # User Management
 class UserCreate(BaseModel):
     username: str
@@ -863,20 +1821,20 @@ class UserCreate(BaseModel):
     role: str = "validador"  # admin, validador
 
 @api_router.get("/admin/usuarios")
-async def listar_usuarios(current_user: str = Depends(get_current_user)):
+async def listar_usuarios(current_user: str = Depends(requiere_admin)):
     """Lista todos los usuarios del sistema"""
     usuarios = await db.admin_users.find({}, {"_id": 0, "hashed_password": 0}).to_list(100)
     return usuarios
 
 @api_router.post("/admin/usuarios")
-async def crear_usuario(user: UserCreate, current_user: str = Depends(get_current_user)):
+async def crear_usuario(user: UserCreate, current_user: str = Depends(requiere_admin)):
     """Crea un nuevo usuario (solo admin puede crear)"""
     # Check if user exists
     existing = await db.admin_users.find_one({"username": user.username})
     if existing:
         raise HTTPException(status_code=400, detail="El usuario ya existe")
     
-    hashed = get_password_hash(user.password)
+    hashed = await hash_password(user.password)
     new_user = {
         "username": user.username,
         "hashed_password": hashed,
@@ -888,7 +1846,7 @@ async def crear_usuario(user: UserCreate, current_user: str = Depends(get_curren
     return {"message": f"Usuario {user.username} creado con rol {user.role}", "username": user.username, "role": user.role}
 
 @api_router.delete("/admin/usuarios/{username}")
-async def eliminar_usuario(username: str, current_user: str = Depends(get_current_user)):
+async def eliminar_usuario(username: str, current_user: str = Depends(requiere_admin)):
     """Elimina un usuario (no puede eliminarse el admin principal)"""
     if username == "admin":
         raise HTTPException(status_code=400, detail="No se puede eliminar el usuario admin principal")
@@ -897,15 +1855,35 @@ async def eliminar_usuario(username: str, current_user: str = Depends(get_curren
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
+    # Sus sesiones abiertas dejan de valer: se revocan por usuario (iat hasta ahora) durante
+    # lo que dura un token del panel. Si se vuelve a crear, sus tokens nuevos son posteriores.
+    ahora = datetime.now(timezone.utc)
+    revocado_desde = int(ahora.timestamp())
+    await db.tokens_revocados.update_one(
+        {"jti": f"usuario:{username}"},
+        {"$set": {
+            "jti": f"usuario:{username}",
+            "username": username,
+            "revocado_desde": revocado_desde,
+            "expira": ahora + DURACION_TOKEN_PANEL,
+            "fecha": ahora
+        }},
+        upsert=True
+    )
+    usuarios_revocados[username] = revocado_desde
+    
     return {"message": f"Usuario {username} eliminado"}
 
 @api_router.post("/admin/eventos", response_model=Evento)
 async def crear_evento_admin(evento: EventoCreate, current_user: str = Depends(get_current_user)):
     evento_dict = evento.model_dump()
+    evento_dict.update(derivar_campos_evento(evento_dict))
+    evento_dict['cupos'] = [{**cupo, "disponibles": cupo['capacidad']} for cupo in cupos_evento(evento_dict)]
     evento_obj = Evento(**evento_dict)
     doc = evento_obj.model_dump()
     doc['fecha_creacion'] = doc['fecha_creacion'].isoformat()
     await db.eventos.insert_one(doc)
+    cache_catalogo.invalidar("eventos")
     return evento_obj
 
 @api_router.put("/admin/eventos/{evento_id}")
@@ -916,8 +1894,21 @@ async def actualizar_evento_admin(evento_id: str, evento: EventoUpdate, current_
     
     update_data = {k: v for k, v in evento.model_dump().items() if v is not None}
     
+    if any(campo in update_data for campo in CAMPOS_ORIGEN):
+        # asientos_disponibles es lo que queda por vender (las compras lo descuentan): si se
+        # editó, la capacidad es ese valor más lo vendido; si no, se conserva la capacidad previa
+        capacidad_base = evento_existente.get('capacidad_total')
+        if 'asientos_disponibles' in update_data or capacidad_base is None:
+            vendidas = await contar_entradas_activas(evento_id)
+            capacidad_base = capacidad_legado({**evento_existente, **update_data}, vendidas)
+        update_data.update(derivar_campos_evento({**evento_existente, **update_data}, capacidad_base))
+    
     if update_data:
         await db.eventos.update_one({"id": evento_id}, {"$set": update_data})
+        if any(campo in update_data for campo in CAMPOS_ORIGEN):
+            await recalcular_cupos({**evento_existente, **update_data})
+        cache_catalogo.invalidar("eventos")
+        invalidar_mapa(evento_id)
     
     evento_actualizado = await db.eventos.find_one({"id": evento_id}, {"_id": 0})
     return evento_actualizado
@@ -927,15 +1918,21 @@ async def eliminar_evento_admin(evento_id: str, current_user: str = Depends(get_
     result = await db.eventos.delete_one({"id": evento_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Evento no encontrado")
+    cache_catalogo.invalidar("eventos")
+    mapas_asientos.pop(evento_id, None)
     return {"message": "Evento eliminado exitosamente"}
 
 # Endpoint para eliminar entradas (incluso verificadas)
 @api_router.delete("/admin/entradas/{entrada_id}")
 async def eliminar_entrada_admin(entrada_id: str, current_user: str = Depends(get_current_user)):
     """Eliminar una entrada (incluso si está verificada)"""
+    entrada = await db.entradas.find_one({"id": entrada_id}, {"_id": 0, "id": 1, "orden_id": 1, "evento_id": 1, "asiento": 1, "cupo": 1})
     result = await db.entradas.delete_one({"id": entrada_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Entrada no encontrada")
+    await liberar_cupos([entrada])
+    await quitar_entradas_de_ordenes([entrada])
+    actualizar_mapas([entrada], None)
     return {"message": "Entrada eliminada exitosamente"}
 
 # Estadísticas de asistencia por evento
@@ -1005,6 +2002,7 @@ async def actualizar_configuracion_admin(config: ConfiguracionSitio, current_use
     
     await db.configuracion.delete_many({})
     await db.configuracion.insert_one(config_dict)
+    cache_catalogo.invalidar("configuracion")
     
     # Eliminar _id para la respuesta
     config_dict.pop('_id', None)
@@ -1071,23 +2069,88 @@ async def obtener_estadisticas_admin(current_user: str = Depends(get_current_use
         "ventas_por_evento": ventas_por_evento
     }
 
+# Campos voluminosos (PNG del QR, imagen del comprobante, historial) que solo se
+# devuelven en el listado de compras si se piden explícitamente con `incluir`
+CAMPOS_PESADOS_COMPRA = ("codigo_qr", "comprobante_pago", "historial_acceso")
+LIMITE_COMPRAS_DEFECTO = 100
+LIMITE_COMPRAS_MAXIMO = 500
+
+def decodificar_cursor(after: str) -> tuple:
+    """Decodifica un cursor `<fecha_compra>,<id>` del listado de compras"""
+    # El '+' del offset ISO llega como espacio si el cliente no codificó la URL
+    fecha_compra, _, entrada_id = after.replace(' ', '+').rpartition(',')
+    if not fecha_compra or not entrada_id:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return fecha_compra, entrada_id
+
+def filtro_cursor(after: str) -> dict:
+    """Condición keyset para continuar después del cursor (orden descendente)"""
+    fecha_cursor, id_cursor = decodificar_cursor(after)
+    return {"$or": [
+        {"fecha_compra": {"$lt": fecha_cursor}},
+        {"fecha_compra": fecha_cursor, "id": {"$lt": id_cursor}}
+    ]}
+
+def recortar_pagina(docs: List[dict], limit: int, response: Response) -> List[dict]:
+    """Recorta la página (se piden limit + 1) y publica el cursor siguiente en X-Next-Cursor"""
+    if len(docs) > limit:
+        docs = docs[:limit]
+        ultima = docs[-1]
+        response.headers["X-Next-Cursor"] = f"{ultima['fecha_compra']},{ultima['id']}"
+    return docs
+
+def filtro_busqueda_compras(q: str) -> dict:
+    """Traduce el texto de búsqueda a un filtro que aprovecha los índices de entradas"""
+    q = q.strip()
+    if '@' in q:
+        # Prefijo de email (regex anclada, usa el índice de email_normalizado)
+        return {"email_normalizado": {"$regex": f"^{re.escape(normalizar_email(q))}"}}
+    codigo = q.upper()
+    if re.match(r"^[A-Z]{2}-", codigo):
+        # Prefijo de código alfanumérico tipo CF-2026-...
+        return {"codigo_alfanumerico": {"$regex": f"^{re.escape(codigo)}"}}
+    # Nombre del comprador: búsqueda por palabras en el índice de texto
+    return {"$text": {"$search": q}}
+
 @api_router.get("/admin/compras")
 async def listar_compras_admin(
+    response: Response,
     evento_id: Optional[str] = None,
     estado: Optional[str] = None,
+    q: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = LIMITE_COMPRAS_DEFECTO,
+    incluir: Optional[str] = None,
     current_user: str = Depends(get_current_user)
 ):
-    filtro = {}
+    """
+    Lista compras paginadas por cursor (fecha_compra, id) de la más reciente a la más antigua.
+    El cursor de la página siguiente se devuelve en la cabecera X-Next-Cursor.
+    """
+    condiciones = []
     if evento_id:
-        filtro["evento_id"] = evento_id
+        condiciones.append({"evento_id": evento_id})
     if estado:
-        filtro["estado_pago"] = estado
-    
-    entradas = await db.entradas.find(filtro, {"_id": 0}).sort("fecha_compra", -1).to_list(1000)
-    for entrada in entradas:
-        if isinstance(entrada.get('fecha_compra'), str):
-            entrada['fecha_compra'] = datetime.fromisoformat(entrada['fecha_compra'])
-    return entradas
+        condiciones.append({"estado_pago": estado})
+    if q and q.strip():
+        condiciones.append(filtro_busqueda_compras(q))
+    if after:
+        condiciones.append(filtro_cursor(after))
+    filtro = {"$and": condiciones} if condiciones else {}
+    
+    campos_incluidos = {c.strip() for c in incluir.split(',')} if incluir else set()
+    proyeccion = {"_id": 0}
+    for campo in CAMPOS_PESADOS_COMPRA:
+        if campo not in campos_incluidos:
+            proyeccion[campo] = 0
+    
+    limit = max(1, min(limit, LIMITE_COMPRAS_MAXIMO))
+    entradas = await db.entradas.find(filtro, proyeccion).sort(
+        [("fecha_compra", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    entradas = recortar_pagina(entradas, limit, response)
+    return await adjuntar_ordenes(entradas)
 
 @api_router.post("/admin/aprobar-compra")
 async def aprobar_compra_admin(datos: AprobarCompra, current_user: str = Depends(get_current_user)):
@@ -1095,6 +2158,14 @@ async def aprobar_compra_admin(datos: AprobarCompra, current_user: str = Depends
         {"id": {"$in": datos.entrada_ids}},
         {"$set": {"estado_pago": "aprobado"}}
     )
+    await db.ordenes.update_many(
+        {"entrada_ids": {"$in": datos.entrada_ids}},
+        {"$set": {"estado_pago": "aprobado"}}
+    )
+    actualizar_mapas(await db.entradas.find(
+        {"id": {"$in": datos.entrada_ids}, "asiento": {"$ne": None}},
+        {"_id": 0, "evento_id": 1, "asiento": 1}
+    ).to_list(len(datos.entrada_ids)), OCUPADO)
     
     return {
         "message": f"{result.modified_count} entrada(s) aprobada(s)",
@@ -1104,25 +2175,27 @@ async def aprobar_compra_admin(datos: AprobarCompra, current_user: str = Depends
 @api_router.post("/admin/rechazar-compra")
 async def rechazar_compra_admin(datos: AprobarCompra, current_user: str = Depends(get_current_user)):
     # Devolver asientos y eliminar entradas
-    entradas = await db.entradas.find({"id": {"$in": datos.entrada_ids}}).to_list(100)
-    
-    for entrada in entradas:
-        await db.eventos.update_one(
-            {"id": entrada['evento_id']},
-            {"$inc": {"asientos_disponibles": 1}}
-        )
+    entradas = await db.entradas.find(
+        {"id": {"$in": datos.entrada_ids}},
+        {"_id": 0, "id": 1, "evento_id": 1, "orden_id": 1, "asiento": 1, "cupo": 1}
+    ).to_list(len(datos.entrada_ids))
     
+    await liberar_cupos(entradas)
     result = await db.entradas.delete_many({"id": {"$in": datos.entrada_ids}})
+    await quitar_entradas_de_ordenes(entradas)
+    actualizar_mapas(entradas, None)
     
     return {
         "message": f"{result.deleted_count} entrada(s) rechazada(s)",
         "eliminadas": result.deleted_count
     }
 
+async def cargar_metodos_pago() -> List[dict]:
+    return await db.metodos_pago.find({"activo": True}, {"_id": 0}).sort("orden", 1).to_list(100)
+
 @api_router.get("/metodos-pago")
-async def listar_metodos_pago():
-    metodos = await db.metodos_pago.find({"activo": True}, {"_id": 0}).sort("orden", 1).to_list(100)
-    return metodos
+async def listar_metodos_pago(request: Request):
+    return await respuesta_catalogo(request, "metodos_pago", "activos", cargar_metodos_pago)
 
 @api_router.post("/admin/metodos-pago")
 async def crear_metodo_pago_admin(metodo: MetodoPagoCreate, current_user: str = Depends(get_current_user)):
@@ -1130,6 +2203,8 @@ async def crear_metodo_pago_admin(metodo: MetodoPagoCreate, current_user: str =
     metodo_dict["id"] = str(uuid.uuid4())
     metodo_dict["activo"] = True
     await db.metodos_pago.insert_one(metodo_dict)
+    metodo_dict.pop('_id', None)
+    cache_catalogo.invalidar("metodos_pago")
     return metodo_dict
 
 @api_router.put("/admin/metodos-pago/{metodo_id}")
@@ -1142,11 +2217,13 @@ async def actualizar_metodo_pago_admin(
         {"id": metodo_id},
         {"$set": metodo.model_dump()}
     )
+    cache_catalogo.invalidar("metodos_pago")
     return {"message": "Método de pago actualizado"}
 
 @api_router.delete("/admin/metodos-pago/{metodo_id}")
 async def eliminar_metodo_pago_admin(metodo_id: str, current_user: str = Depends(get_current_user)):
     await db.metodos_pago.delete_one({"id": metodo_id})
+    cache_catalogo.invalidar("metodos_pago")
     return {"message": "Método de pago eliminado"}
 
 @api_router.post("/admin/categorias", response_model=Categoria)
@@ -1159,6 +2236,7 @@ async def crear_categoria_admin(categoria: CategoriaCreate, current_user: str =
     doc = categoria_obj.model_dump()
     doc['fecha_creacion'] = doc['fecha_creacion'].isoformat()
     await db.categorias.insert_one(doc)
+    cache_catalogo.invalidar("categorias")
     return categoria_obj
 
 @api_router.put("/admin/categorias/{categoria_id}")
@@ -1175,6 +2253,7 @@ async def actualizar_categoria_admin(categoria_id: str, categoria: CategoriaUpda
     
     if update_data:
         await db.categorias.update_one({"id": categoria_id}, {"$set": update_data})
+        cache_catalogo.invalidar("categorias")
     
     categoria_actualizada = await db.categorias.find_one({"id": categoria_id}, {"_id": 0})
     return categoria_actualizada
@@ -1184,41 +2263,276 @@ async def eliminar_categoria_admin(categoria_id: str, current_user: str = Depend
     result = await db.categorias.delete_one({"id": categoria_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
+    cache_catalogo.invalidar("categorias")
     return {"message": "Categoría eliminada exitosamente"}
 
 # ==================== SISTEMA DE ASIENTOS ====================
 
+MAPA_ASIENTOS_TTL = float(os.environ.get('MAPA_ASIENTOS_TTL', '30'))
+RETENCION_ASIENTOS_SEGUNDOS = 600  # 10 minutos
+# Retenciones anónimas acotadas: por sesión (cada pedido reemplaza al anterior) y por
+# cliente (su IP real, ver ip_de) sumando todas sus sesiones, para que un script no bloquee el mapa entero
+MAXIMO_RETENIDOS_POR_SESION = int(os.environ.get('MAXIMO_RETENIDOS_POR_SESION', '20'))
+MAXIMO_RETENIDOS_POR_CLIENTE = int(os.environ.get('MAXIMO_RETENIDOS_POR_CLIENTE', '40'))
+
+# evento_id -> MapaAsientos. Cada proceso mantiene el suyo y lo relee de Mongo cada
+# MAPA_ASIENTOS_TTL segundos, así los cambios hechos por otro worker tardan a lo sumo eso.
+mapas_asientos = {}
+_locks_mapas = {}
+
+def _mapa_vigente(evento_id: str) -> Optional[MapaAsientos]:
+    mapa = mapas_asientos.get(evento_id)
+    if mapa and not mapa.obsoleto and time.monotonic() - mapa.cargado < MAPA_ASIENTOS_TTL:
+        mapa.expirar_retenciones()
+        return mapa
+    return None
+
+async def obtener_mapa_asientos(evento_id: str) -> MapaAsientos:
+    """Mapa del evento en memoria; se (re)construye desde Mongo solo al vencer o tras reconfigurar"""
+    mapa = _mapa_vigente(evento_id)
+    if mapa:
+        return mapa
+    
+    async with _locks_mapas.setdefault(evento_id, asyncio.Lock()):
+        mapa = _mapa_vigente(evento_id)
+        if mapa:
+            return mapa
+        
+        evento = await db.eventos.find_one(
+            {"id": evento_id},
+            {"_id": 0, "tipo_asientos": 1, "configuracion_asientos": 1, "capacidad_total": 1, "asientos_disponibles": 1, "precio": 1}
+        )
+        if not evento:
+            raise HTTPException(status_code=404, detail="Evento no encontrado")
+        
+        recargado = MapaAsientos(
+            evento.get('tipo_asientos', 'general'),
+            evento.get('configuracion_asientos'),
+            evento.get('capacidad_total', evento.get('asientos_disponibles', 0)),
+            evento.get('precio', 0)
+        )
+        if recargado.total:
+            async for entrada in db.entradas.find(
+                {"evento_id": evento_id, "asiento": {"$ne": None}, "estado_pago": {"$ne": "rechazado"}},
+                {"_id": 0, "asiento": 1, "estado_pago": 1}
+            ):
+                recargado.marcar(entrada['asiento'], OCUPADO if entrada.get('estado_pago') == 'aprobado' else PENDIENTE)
+        
+        anterior = mapas_asientos.get(evento_id)
+        if anterior and anterior.firma == recargado.firma:
+            anterior.sincronizar(recargado)
+            mapa = anterior
+        else:
+            recargado.suceder(anterior)
+            mapa = mapas_asientos[evento_id] = recargado
+        mapa.expirar_retenciones()
+        return mapa
+
+def clave_asiento(mapa: Optional[MapaAsientos], asiento_id: str) -> str:
+    """
+    Id canónico de la silla para asiento_clave (el del selector, aunque llegue "M1-S3"):
+    con él, el índice único (evento_id, asiento_clave) impide vender dos veces la misma
+    silla aunque las compras lleguen a procesos distintos
+    """
+    indice = mapa.indice(asiento_id) if mapa else None
+    return mapa.ids[indice] if indice is not None else asiento_id
+
+def actualizar_mapas(entradas: List[dict], estado: Optional[str]):
+    """Refleja en los mapas ya cargados el nuevo estado (OCUPADO, PENDIENTE o None) de las sillas de estas entradas"""
+    for entrada in entradas:
+        if not entrada or not entrada.get('asiento'):
+            continue
+        mapa = mapas_asientos.get(entrada.get('evento_id'))
+        if mapa:
+            mapa.marcar(entrada['asiento'], estado)
+
+def verificar_cupo_retencion(mapa: MapaAsientos, cantidad: int, session_id: str, cliente: str):
+    """400 si el pedido supera el máximo por sesión, 429 si el cliente ya retiene demasiadas sillas"""
+    if cantidad > MAXIMO_RETENIDOS_POR_SESION:
+        raise HTTPException(status_code=400, detail=f"Se pueden reservar hasta {MAXIMO_RETENIDOS_POR_SESION} asientos a la vez")
+    if mapa.retenidos_de_cliente(cliente, excepto_sesion=session_id) + cantidad > MAXIMO_RETENIDOS_POR_CLIENTE:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiados asientos reservados desde este dispositivo. Complete o libere las reservas anteriores"
+        )
+
+def invalidar_mapa(evento_id: str):
+    mapa = mapas_asientos.get(evento_id)
+    if mapa:
+        mapa.obsoleto = True
+
 @api_router.get("/eventos/{evento_id}/asientos")
-async def obtener_asientos_evento(evento_id: str):
-    """Obtener el mapa de asientos de un evento con estado de ocupación"""
-    evento = await db.eventos.find_one({"id": evento_id}, {"_id": 0})
-    if not evento:
-        raise HTTPException(status_code=404, detail="Evento no encontrado")
-    
-    # Obtener asientos ocupados (entradas no rechazadas)
-    entradas = await db.entradas.find(
-        {"evento_id": evento_id, "estado_pago": {"$ne": "rechazado"}},
-        {"asiento": 1, "mesa": 1, "estado_pago": 1, "_id": 0}
-    ).to_list(1000)
+async def obtener_asientos_evento(evento_id: str, formato: str = "bitmap", since: Optional[str] = None):
+    """
+    Mapa de asientos con la ocupación como bitmaps base64 y su versión
+    (silla i = byte i >> 3, máscara 1 << (i & 7); los rangos por mesa vienen en `mesas`).
+    formato=lista agrega además las listas de ids de siempre.
+    since=<version> devuelve solo las sillas cambiadas desde esa versión como
+    [indice, codigo] (0 libre, 1 ocupado, 2 pendiente, 3 retenido), o el mapa
+    completo con resync=true si la versión ya no está en el registro o la emitió
+    otro proceso (la versión es opaca: "<instancia>-<n>").
+    """
+    mapa = await obtener_mapa_asientos(evento_id)
     
-    asientos_ocupados = []
-    asientos_pendientes = []
+    if since is not None and formato != "lista":
+        cambios = mapa.cambios_desde(since)
+        if cambios is not None:
+            conteo = mapa.contar()
+            return {
+                "evento_id": evento_id,
+                "version": mapa.etiqueta_version(),
+                "resync": False,
+                "cambios": cambios,
+                "disponibles": mapa.capacidad_total - conteo['ocupados'] - conteo['pendientes'] - conteo['retenidos']
+            }
     
-    for entrada in entradas:
-        if entrada.get('asiento'):
-            if entrada.get('estado_pago') == 'aprobado':
-                asientos_ocupados.append(entrada['asiento'])
-            else:
-                asientos_pendientes.append(entrada['asiento'])
+    serializado = mapa.serializar()
+    evento = await db.eventos.find_one({"id": evento_id}, {"_id": 0, "cupos": 1})
+    respuesta = {
+        "evento_id": evento_id,
+        "cupos": (evento or {}).get('cupos', []),
+        "tipo_asientos": mapa.tipo_asientos,
+        "configuracion": mapa.configuracion,
+        "capacidad_total": mapa.capacidad_total,
+        "disponibles": mapa.capacidad_total - serializado['ocupados'] - serializado['pendientes'] - serializado['retenidos'],
+        "resync": since is not None,
+        **serializado
+    }
+    if formato == "lista":
+        respuesta["asientos_ocupados"] = mapa.lista("ocupados")
+        respuesta["asientos_pendientes"] = mapa.lista("pendientes")
+        respuesta["asientos_retenidos"] = mapa.lista("retenidos")
+    return respuesta
+
+# Campos de cada documento de `asientos` que dependen de la configuración (estado no)
+CAMPOS_ASIENTO = ("tipo", "mesa_id", "mesa_nombre", "silla_numero", "categoria", "precio")
+
+def generar_asientos(evento_id: str, tipo_asientos: str, configuracion: dict, precio_base: float) -> dict:
+    """Inventario deseado de sillas, por id (M{mesa_id}-S{n}); las entradas generales no tienen documento"""
+    categoria_defecto = 'VIP' if tipo_asientos == 'mixto' else 'General'
+    asientos = {}
+    for mesa in mesas_configuradas(tipo_asientos, configuracion):
+        categoria = mesa.get('categoria', categoria_defecto)
+        precio = mesa.get('precio', precio_base)
+        for silla in range(1, mesa['sillas'] + 1):
+            asiento_id = f"M{mesa['id']}-S{silla}"
+            asientos[asiento_id] = {
+                "id": asiento_id,
+                "evento_id": evento_id,
+                "tipo": "mesa",
+                "mesa_id": mesa['id'],
+                "mesa_nombre": mesa['nombre'],
+                "silla_numero": silla,
+                "categoria": categoria,
+                "precio": precio
+            }
+    return asientos
+
+def alias_asiento(doc: dict) -> str:
+    """Id con el que el selector guarda la silla en las entradas ("Mesa 1-Silla3")"""
+    return f"{doc.get('mesa_nombre')}-Silla{doc.get('silla_numero')}"
+
+async def contar_ocupacion_mesas(evento_id: str, mesa_id: Optional[str] = None) -> dict:
+    """mesa_id -> {"aprobado": n, "pendiente": n}; un $group sobre el índice evento_id + mesa_id + estado_pago"""
+    filtro = {"evento_id": evento_id, "estado_pago": {"$in": ["aprobado", "pendiente"]}}
+    filtro["mesa_id"] = mesa_id if mesa_id is not None else {"$ne": None}
+    conteos = {}
+    async for grupo in db.entradas.aggregate([
+        {"$match": filtro},
+        {"$group": {"_id": {"mesa_id": "$mesa_id", "estado": "$estado_pago"}, "total": {"$sum": 1}}}
+    ]):
+        conteos.setdefault(grupo['_id']['mesa_id'], {})[grupo['_id']['estado']] = grupo['total']
+    return conteos
+
+def fila_ocupacion_mesa(mesa: dict, conteo: dict) -> dict:
+    vendidas = conteo.get('aprobado', 0)
+    pendientes = conteo.get('pendiente', 0)
+    return {
+        "mesa_id": str(mesa['mesa_id']),
+        "nombre": mesa['nombre'],
+        "categoria": mesa['categoria'],
+        "sillas": mesa['sillas'],
+        "vendidas": vendidas,
+        "pendientes": pendientes,
+        "libres": max(mesa['sillas'] - vendidas - pendientes, 0),
+        "completa": vendidas + pendientes >= mesa['sillas']
+    }
+
+@api_router.get("/eventos/{evento_id}/mesas/ocupacion")
+async def obtener_ocupacion_mesas(evento_id: str):
+    """Sillas vendidas, pendientes y libres de cada mesa del evento"""
+    mapa = await obtener_mapa_asientos(evento_id)
+    conteos = await contar_ocupacion_mesas(evento_id)
+    return [fila_ocupacion_mesa(mesa, conteos.get(str(mesa['mesa_id']), {})) for mesa in mapa.mesas]
+
+@api_router.get("/eventos/{evento_id}/mesas/{mesa_id}/ocupacion")
+async def obtener_ocupacion_mesa(evento_id: str, mesa_id: str):
+    """¿Mesa completa? con un solo conteo indexado"""
+    mapa = await obtener_mapa_asientos(evento_id)
+    mesa = next((m for m in mapa.mesas if str(m['mesa_id']) == mesa_id), None)
+    if not mesa:
+        raise HTTPException(status_code=404, detail="Mesa no encontrada")
+    conteos = await contar_ocupacion_mesas(evento_id, mesa_id)
+    return fila_ocupacion_mesa(mesa, conteos.get(mesa_id, {}))
+
+MAXIMO_ASIENTOS_AUTOMATICOS = MAXIMO_RETENIDOS_POR_SESION
+
+class SolicitudMejoresAsientos(BaseModel):
+    cantidad: int
+    categoria: Optional[str] = None
+    session_id: Optional[str] = None
+    permitir_separados: bool = False
+
+@api_router.post("/eventos/{evento_id}/mejores-asientos")
+async def asignar_mejores_asientos(evento_id: str, solicitud: SolicitudMejoresAsientos, request: Request):
+    """
+    Elige y retiene las mejores sillas libres del evento: contiguas en una misma mesa
+    primero, luego por precio. La retención dura lo mismo que en reservar-asientos y
+    se confirma comprando con el mismo session_id. El mapa y sus retenciones son de este
+    proceso (una sugerencia); que la silla no se venda dos veces lo garantiza la compra
+    con el índice único de asiento_clave.
+    """
+    if solicitud.cantidad < 1 or solicitud.cantidad > MAXIMO_ASIENTOS_AUTOMATICOS:
+        raise HTTPException(status_code=400, detail=f"La cantidad debe estar entre 1 y {MAXIMO_ASIENTOS_AUTOMATICOS}")
+    
+    mapa = await obtener_mapa_asientos(evento_id)
+    if mapa.tipo_asientos == 'general':
+        raise HTTPException(status_code=400, detail="El evento no tiene asientos numerados")
+    
+    session_id = solicitud.session_id or str(uuid.uuid4())
+    cliente = ip_de(request)
+    verificar_cupo_retencion(mapa, solicitud.cantidad, session_id, cliente)
+    # Elegir y retener sin await de por medio: ninguna otra petición se intercala en el event loop
+    indices = mapa.mejores_asientos(
+        solicitud.cantidad, solicitud.categoria, session_id, solicitud.permitir_separados
+    )
+    if indices is None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"No hay {solicitud.cantidad} asiento(s) disponibles con esas condiciones"
+        )
+    mapa.liberar_sesion(session_id)
+    mapa.retener(indices, session_id, RETENCION_ASIENTOS_SEGUNDOS, cliente)
+    
+    asientos = []
+    for indice in indices:
+        mesa = mapa.mesa_de(indice)
+        asientos.append({
+            "asiento": mapa.ids[indice],
+            "mesa": mesa['nombre'],
+            "silla": indice - mesa['inicio'] + 1,
+            "categoria": mesa['categoria'],
+            "precio": mesa['precio']
+        })
     
     return {
-        "evento_id": evento_id,
-        "tipo_asientos": evento.get('tipo_asientos', 'general'),
-        "configuracion": evento.get('configuracion_asientos'),
-        "capacidad_total": evento.get('asientos_disponibles', 0),
-        "asientos_ocupados": asientos_ocupados,
-        "asientos_pendientes": asientos_pendientes,
-        "disponibles": evento.get('asientos_disponibles', 0) - len(asientos_ocupados) - len(asientos_pendientes)
+        "success": True,
+        "session_id": session_id,
+        "asientos": asientos,
+        "misma_mesa": len({a['mesa'] for a in asientos}) == 1,
+        "precio_total": sum(a['precio'] for a in asientos),
+        "expira_en": RETENCION_ASIENTOS_SEGUNDOS,
+        "version": mapa.etiqueta_version()
     }
 
 @api_router.post("/admin/eventos/{evento_id}/configurar-asientos")
@@ -1237,23 +2551,48 @@ async def configurar_asientos_evento(
     tipo_asientos = body.get('tipo_asientos', 'general')
     configuracion = body.get('configuracion', {})
     
-    # Calcular capacidad total según configuración
-    capacidad_total = 0
-    
-    if tipo_asientos == 'general':
-        capacidad_total = configuracion.get('capacidad', 100)
+    # Misma fórmula que en crear/actualizar evento
+    derivados = derivar_campos_evento(
+        {**evento, "tipo_asientos": tipo_asientos, "configuracion_asientos": configuracion},
+        evento.get('capacidad_total')
+    )
+    capacidad_total = derivados['capacidad_total']
     
-    elif tipo_asientos == 'mesas':
-        mesas = configuracion.get('mesas', [])
-        for mesa in mesas:
-            capacidad_total += mesa.get('sillas', 10)
+    # Diff contra el inventario actual; se valida antes de tocar el evento
+    deseados = generar_asientos(evento_id, tipo_asientos, configuracion, evento.get('precio', 0))
+    actuales = {
+        doc['id']: doc
+        async for doc in db.asientos.find({"evento_id": evento_id}, {"_id": 0, "id": 1, **{c: 1 for c in CAMPOS_ASIENTO}})
+    }
     
-    elif tipo_asientos == 'mixto':
-        # Mesas + entradas generales
-        mesas = configuracion.get('mesas', [])
-        for mesa in mesas:
-            capacidad_total += mesa.get('sillas', 10)
-        capacidad_total += configuracion.get('entradas_generales', 0)
+    eliminados = [asiento_id for asiento_id in actuales if asiento_id not in deseados]
+    nuevos = [doc for asiento_id, doc in deseados.items() if asiento_id not in actuales]
+    modificados = []
+    for asiento_id, doc in deseados.items():
+        actual = actuales.get(asiento_id)
+        if actual is not None:
+            cambios = {c: doc[c] for c in CAMPOS_ASIENTO if actual.get(c) != doc[c]}
+            if cambios:
+                modificados.append((asiento_id, cambios))
+    
+    # Un asiento vendido (o pendiente) no puede desaparecer, ni con su id ni con el alias del selector
+    alias_quitados = {asiento_id for asiento_id in eliminados}
+    alias_quitados.update(alias_asiento(doc) for doc in actuales.values())
+    alias_quitados -= set(deseados) | {alias_asiento(doc) for doc in deseados.values()}
+    if alias_quitados:
+        vendidos = sorted({
+            entrada['asiento']
+            async for entrada in db.entradas.find(
+                {"evento_id": evento_id, "asiento": {"$ne": None}, "estado_pago": {"$ne": "rechazado"}},
+                {"_id": 0, "asiento": 1}
+            )
+            if entrada['asiento'] in alias_quitados
+        })
+        if vendidos:
+            raise HTTPException(
+                status_code=409,
+                detail=f"No se pueden quitar asientos con entradas vendidas o pendientes: {', '.join(vendidos[:20])}"
+            )
     
     # Actualizar evento
     await db.eventos.update_one(
@@ -1262,72 +2601,35 @@ async def configurar_asientos_evento(
             "$set": {
                 "tipo_asientos": tipo_asientos,
                 "configuracion_asientos": configuracion,
-                "asientos_disponibles": capacidad_total
+                "asientos_disponibles": capacidad_total,
+                **derivados
             }
         }
     )
-    
-    # Crear/actualizar documento de asientos
-    await db.asientos.delete_many({"evento_id": evento_id})
-    
-    asientos_docs = []
-    
-    if tipo_asientos == 'mesas':
-        mesas = configuracion.get('mesas', [])
-        for mesa in mesas:
-            mesa_id = mesa.get('id', str(uuid.uuid4()))
-            num_sillas = mesa.get('sillas', 10)
-            precio = mesa.get('precio', evento.get('precio', 0))
-            categoria = mesa.get('categoria', 'General')
-            
-            for silla_num in range(1, num_sillas + 1):
-                asiento_id = f"M{mesa_id}-S{silla_num}"
-                asientos_docs.append({
-                    "id": asiento_id,
-                    "evento_id": evento_id,
-                    "tipo": "mesa",
-                    "mesa_id": mesa_id,
-                    "mesa_nombre": mesa.get('nombre', f'Mesa {mesa_id}'),
-                    "silla_numero": silla_num,
-                    "categoria": categoria,
-                    "precio": precio,
-                    "estado": "disponible"
-                })
-    
-    elif tipo_asientos == 'mixto':
-        # Crear asientos de mesas
-        mesas = configuracion.get('mesas', [])
-        for mesa in mesas:
-            mesa_id = mesa.get('id', str(uuid.uuid4()))
-            num_sillas = mesa.get('sillas', 10)
-            precio = mesa.get('precio', evento.get('precio', 0))
-            categoria = mesa.get('categoria', 'VIP')
-            
-            for silla_num in range(1, num_sillas + 1):
-                asiento_id = f"M{mesa_id}-S{silla_num}"
-                asientos_docs.append({
-                    "id": asiento_id,
-                    "evento_id": evento_id,
-                    "tipo": "mesa",
-                    "mesa_id": mesa_id,
-                    "mesa_nombre": mesa.get('nombre', f'Mesa {mesa_id}'),
-                    "silla_numero": silla_num,
-                    "categoria": categoria,
-                    "precio": precio,
-                    "estado": "disponible"
-                })
-        
-        # Entradas generales no necesitan documento individual
-    
-    if asientos_docs:
-        await db.asientos.insert_many(asientos_docs)
+    await recalcular_cupos({**evento, "tipo_asientos": tipo_asientos, "configuracion_asientos": configuracion, **derivados})
+    cache_catalogo.invalidar("eventos")
+    invalidar_mapa(evento_id)
+    
+    # Un solo bulk_write con altas, cambios y bajas; las filas sin cambios no se tocan
+    operaciones = [InsertOne({**doc, "estado": "disponible"}) for doc in nuevos]
+    operaciones.extend(
+        UpdateOne({"evento_id": evento_id, "id": asiento_id}, {"$set": cambios})
+        for asiento_id, cambios in modificados
+    )
+    if eliminados:
+        operaciones.append(DeleteMany({"evento_id": evento_id, "id": {"$in": eliminados}}))
+    if operaciones:
+        await db.asientos.bulk_write(operaciones, ordered=False)
     
     return {
         "success": True,
         "message": "Configuración de asientos actualizada",
         "tipo": tipo_asientos,
         "capacidad_total": capacidad_total,
-        "asientos_creados": len(asientos_docs)
+        "asientos_creados": len(nuevos),
+        "asientos_actualizados": len(modificados),
+        "asientos_eliminados": len(eliminados),
+        "asientos_totales": len(deseados)
     }
 
 @api_router.post("/reservar-asientos")
@@ -1341,31 +2643,34 @@ async def reservar_asientos(request: Request):
     if not evento_id:
         raise HTTPException(status_code=400, detail="evento_id requerido")
     
-    evento = await db.eventos.find_one({"id": evento_id}, {"_id": 0})
-    if not evento:
-        raise HTTPException(status_code=404, detail="Evento no encontrado")
+    mapa = await obtener_mapa_asientos(evento_id)
     
-    # Verificar disponibilidad de asientos
-    if evento.get('tipo_asientos') != 'general' and asientos_ids:
+    # Verificar disponibilidad contra el mapa y retener las sillas para esta sesión
+    if mapa.tipo_asientos != 'general' and asientos_ids:
+        if not isinstance(asientos_ids, list):
+            raise HTTPException(status_code=400, detail="asientos debe ser una lista")
+        cliente = ip_de(request)
+        verificar_cupo_retencion(mapa, len(set(asientos_ids)), session_id, cliente)
+        indices = []
         for asiento_id in asientos_ids:
-            # Verificar si ya está ocupado
-            entrada_existente = await db.entradas.find_one({
-                "evento_id": evento_id,
-                "asiento": asiento_id,
-                "estado_pago": {"$ne": "rechazado"}
-            })
-            
-            if entrada_existente:
+            indice = mapa.indice(asiento_id)
+            if indice is None:
+                raise HTTPException(status_code=400, detail=f"El asiento {asiento_id} no existe")
+            if mapa.estado(indice) or mapa.retenido_por_otro(indice, session_id):
                 raise HTTPException(
                     status_code=400, 
                     detail=f"El asiento {asiento_id} ya no está disponible"
                 )
+            indices.append(indice)
+        # Una nueva reserva de la sesión reemplaza a la anterior
+        mapa.liberar_sesion(session_id)
+        mapa.retener(indices, session_id, RETENCION_ASIENTOS_SEGUNDOS, cliente)
     
     return {
         "success": True,
         "session_id": session_id,
         "asientos_reservados": asientos_ids,
-        "expira_en": 600  # 10 minutos
+        "expira_en": RETENCION_ASIENTOS_SEGUNDOS
     }
 
 # ==================== UPLOAD DE IMÁGENES ====================
@@ -1393,19 +2698,204 @@ async def upload_imagen(file: UploadFile = File(...)):
     }
 
 @api_router.get("/uploads/{filename}")
-async def get_upload(filename: str):
-    """Servir archivos subidos"""
-    from fastapi.responses import FileResponse
+async def get_upload(filename: str, request: Request):
+    """Servir archivos subidos (inmutables si el nombre es uuid o hash de contenido)"""
     file_path = UPLOADS_DIR / filename
-    if not file_path.exists():
+    if not file_path.is_file():
         raise HTTPException(status_code=404, detail="Archivo no encontrado")
-    return FileResponse(file_path)
+    
+    stat = file_path.stat()
+    # Mismo ETag que calcula FileResponse, para que la revalidación coincida con lo enviado
+    etag = '"' + hashlib.md5(f"{stat.st_mtime}-{stat.st_size}".encode()).hexdigest() + '"'
+    if not PATRON_UPLOAD_INMUTABLE.match(filename):
+        cache_control = "public, max-age=3600"
+    elif filename.startswith("cp_"):
+        cache_control = CACHE_CONTROL_INMUTABLE_PRIVADO
+    else:
+        cache_control = CACHE_CONTROL_INMUTABLE
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Last-Modified": formatdate(stat.st_mtime, usegmt=True)}
+    
+    if no_modificado(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(file_path, headers=headers, stat_result=stat)
+
+# ==================== COMPROBANTES DE PAGO ====================
+
+# Los comprobantes se guardan una sola vez por contenido (sha256) en UPLOADS_DIR;
+# las entradas solo guardan la URL del archivo y de su miniatura
+MAX_COMPROBANTE_BYTES = 5 * 1024 * 1024
+TAMANO_MINIATURA_COMPROBANTE = (320, 320)
+# Un PNG de pocos KB puede declarar dimensiones enormes: se rechaza antes de decodificarlo
+MAX_PIXELES_COMPROBANTE = 40_000_000
+FORMATOS_COMPROBANTE = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+PREFIJO_UPLOADS = "/api/uploads/"
+PREFIJO_COMPROBANTE = f"{PREFIJO_UPLOADS}cp_"
+PATRON_NOMBRE_COMPROBANTE = re.compile(r'^cp_[0-9a-f]{64}\.(?:jpg|png|webp|gif)$')
+
+def guardar_comprobante(contenido: bytes) -> dict:
+    """Guarda el comprobante direccionado por contenido y genera su miniatura"""
+    if len(contenido) > MAX_COMPROBANTE_BYTES:
+        raise HTTPException(status_code=413, detail="El comprobante supera el tamaño máximo (5MB)")
+    try:
+        img = Image.open(BytesIO(contenido))
+        extension = FORMATOS_COMPROBANTE.get(img.format)
+        if extension:
+            if img.width * img.height > MAX_PIXELES_COMPROBANTE:
+                raise HTTPException(status_code=400, detail="La resolución del comprobante es demasiado grande")
+            # open solo lee la cabecera: una imagen truncada falla recién al decodificarla
+            img.load()
+            miniatura = img.convert("RGB")
+            miniatura.thumbnail(TAMANO_MINIATURA_COMPROBANTE)
+    except HTTPException:
+        raise
+    except Exception:
+        extension = None
+    if not extension:
+        raise HTTPException(status_code=400, detail="El comprobante debe ser una imagen JPG, PNG, WEBP o GIF")
+    
+    digest = hashlib.sha256(contenido).hexdigest()
+    nombre = f"cp_{digest}.{extension}"
+    nombre_miniatura = f"cp_{digest}_min.jpg"
+    
+    # Primero la miniatura: el original solo queda en disco si la imagen se pudo procesar
+    ruta_miniatura = UPLOADS_DIR / nombre_miniatura
+    if not ruta_miniatura.exists():
+        temporal = UPLOADS_DIR / f".{nombre_miniatura}.{uuid.uuid4().hex}"
+        miniatura.save(temporal, format="JPEG", quality=70)
+        temporal.replace(ruta_miniatura)
+    
+    ruta = UPLOADS_DIR / nombre
+    if not ruta.exists():
+        temporal = UPLOADS_DIR / f".{nombre}.{uuid.uuid4().hex}"
+        temporal.write_bytes(contenido)
+        temporal.replace(ruta)
+    
+    return {
+        "comprobante_pago": f"/api/uploads/{nombre}",
+        "comprobante_miniatura": f"/api/uploads/{nombre_miniatura}",
+        "comprobante_hash": digest,
+        "comprobante_bytes": len(contenido)
+    }
+
+def referencia_comprobante(url: str) -> dict:
+    """
+    Reconstruye la referencia completa a partir de la URL de un comprobante ya guardado.
+    Solo acepta nombres que genera guardar_comprobante y cuyo archivo existe.
+    """
+    nombre = url[len(PREFIJO_UPLOADS):]
+    if not PATRON_NOMBRE_COMPROBANTE.match(nombre) or not (UPLOADS_DIR / nombre).is_file():
+        raise HTTPException(status_code=400, detail="Comprobante inválido: vuelva a subirlo")
+    digest = nombre[len("cp_"):].split('.')[0]
+    return {
+        "comprobante_pago": url,
+        "comprobante_miniatura": f"{PREFIJO_COMPROBANTE}{digest}_min.jpg",
+        "comprobante_hash": digest
+    }
+
+async def resolver_comprobante(valor: Optional[str]) -> dict:
+    """
+    Normaliza el comprobante recibido en una compra:
+    - data URL en base64: se guarda como archivo (una vez por contenido)
+    - URL de un comprobante ya subido: se reutiliza si el archivo existe (otra URL de uploads: 400)
+    - cualquier otro texto (referencia de transferencia): se conserva tal cual
+    """
+    if not valor:
+        return {}
+    if valor.startswith('data:'):
+        datos_base64 = valor.split(',', 1)[-1]
+        # Rechazar antes de decodificar si el tamaño ya excede el máximo
+        if len(datos_base64) * 3 // 4 > MAX_COMPROBANTE_BYTES:
+            raise HTTPException(status_code=413, detail="El comprobante supera el tamaño máximo (5MB)")
+        try:
+            contenido = base64.b64decode(datos_base64)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Comprobante inválido")
+        return await asyncio.to_thread(guardar_comprobante, contenido)
+    if PREFIJO_UPLOADS in valor:
+        # Acepta la URL relativa o absoluta (con BACKEND_URL) y guarda siempre la relativa;
+        # cualquier otra ruta de uploads se rechaza (no es un comprobante subido)
+        return referencia_comprobante(valor[valor.index(PREFIJO_UPLOADS):].split('?')[0])
+    return {"comprobante_pago": valor}
+
+# La subida no requiere sesión: tope de comprobantes por cliente para no llenar el disco
+SUBIDAS_COMPROBANTE_MAX = int(os.environ.get('SUBIDAS_COMPROBANTE_MAX', '20'))
+SUBIDAS_COMPROBANTE_VENTANA = float(os.environ.get('SUBIDAS_COMPROBANTE_VENTANA', '600'))
+limitador_subidas = LimitadorEscaneos(SUBIDAS_COMPROBANTE_MAX, SUBIDAS_COMPROBANTE_VENTANA)
+
+@api_router.post("/upload-comprobante")
+async def upload_comprobante(request: Request, file: UploadFile = File(...)):
+    """Subir el comprobante de pago una sola vez antes de confirmar la compra"""
+    cliente = ip_de(request)
+    espera = limitador_subidas.reintentar_en(cliente)
+    if espera:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiados comprobantes subidos. Intente de nuevo en unos minutos",
+            headers={"Retry-After": str(espera)}
+        )
+    limitador_subidas.registrar(cliente)
+    contenido = await file.read(MAX_COMPROBANTE_BYTES + 1)
+    referencia = await asyncio.to_thread(guardar_comprobante, contenido)
+    return {"success": True, "url": referencia["comprobante_pago"], **referencia}
+
+@api_router.post("/admin/migrar-comprobantes")
+async def migrar_comprobantes(current_user: str = Depends(get_current_user)):
+    """Mueve a archivos los comprobantes que aún están guardados en base64 dentro de las entradas"""
+    migradas = 0
+    errores = 0
+    cursor = db.entradas.find(
+        {"comprobante_pago": {"$regex": "^data:"}},
+        {"_id": 0, "id": 1, "comprobante_pago": 1}
+    ).batch_size(100)
+    async for entrada in cursor:
+        try:
+            referencia = await resolver_comprobante(entrada["comprobante_pago"])
+        except HTTPException as e:
+            logging.error(f"Comprobante de la entrada {entrada['id']} no migrado: {e.detail}")
+            errores += 1
+            continue
+        await db.entradas.update_one({"id": entrada["id"]}, {"$set": referencia})
+        migradas += 1
+    
+    return {"success": True, "migradas": migradas, "errores": errores}
+
+@api_router.post("/admin/migrar-asientos-entradas")
+async def migrar_asientos_entradas(current_user: str = Depends(get_current_user)):
+    """Completa asiento_tipo, mesa_id, mesa_nombre y silla_numero en las entradas anteriores a esos campos"""
+    generales = await db.entradas.update_many(
+        {"asiento_tipo": {"$exists": False}, "asiento": None},
+        {"$set": ubicar_asiento(None, None)}
+    )
+    
+    mapas = {}
+    operaciones = []
+    migradas = 0
+    cursor = db.entradas.find(
+        {"asiento_tipo": {"$exists": False}, "asiento": {"$ne": None}},
+        {"_id": 0, "id": 1, "evento_id": 1, "asiento": 1}
+    ).batch_size(500)
+    async for entrada in cursor:
+        evento_id = entrada.get('evento_id')
+        if evento_id not in mapas:
+            evento = await db.eventos.find_one(
+                {"id": evento_id}, {"_id": 0, "tipo_asientos": 1, "configuracion_asientos": 1}
+            )
+            mapas[evento_id] = MapaAsientos(evento.get('tipo_asientos', 'general'), evento.get('configuracion_asientos')) if evento else None
+        ubicacion = ubicar_asiento(mapas[evento_id], entrada['asiento'])
+        operaciones.append(UpdateOne({"id": entrada['id']}, {"$set": {**ubicacion, "mesa": ubicacion['mesa_id']}}))
+        if len(operaciones) >= 500:
+            await db.entradas.bulk_write(operaciones, ordered=False)
+            migradas += len(operaciones)
+            operaciones = []
+    if operaciones:
+        await db.entradas.bulk_write(operaciones, ordered=False)
+        migradas += len(operaciones)
+    
+    return {"success": True, "generales": generales.modified_count, "con_asiento": migradas}
 
 # ==================== CATEGORÍAS DE MESAS ====================
 
-@api_router.get("/categorias-mesas")
-async def obtener_categorias_mesas():
-    """Obtener todas las categorías de mesas"""
+async def cargar_categorias_mesas() -> List[dict]:
     categorias = await db.categorias_mesas.find({}, {"_id": 0}).to_list(100)
     if not categorias:
         # Categorías por defecto
@@ -1415,9 +2905,16 @@ async def obtener_categorias_mesas():
             {"id": str(uuid.uuid4()), "nombre": "Premium", "color": "#8B5CF6"}
         ]
         await db.categorias_mesas.insert_many(categorias_default)
+        for categoria in categorias_default:
+            categoria.pop('_id', None)
         return categorias_default
     return categorias
 
+@api_router.get("/categorias-mesas")
+async def obtener_categorias_mesas():
+    """Obtener todas las categorías de mesas"""
+    return await cache_catalogo.obtener("categorias_mesas", "lista", cargar_categorias_mesas)
+
 @api_router.post("/admin/categorias-mesas")
 async def crear_categoria_mesa(request: Request, current_user: str = Depends(get_current_user)):
     """Crear una nueva categoría de mesa"""
@@ -1435,6 +2932,7 @@ async def crear_categoria_mesa(request: Request, current_user: str = Depends(get
     }
     
     await db.categorias_mesas.insert_one(categoria)
+    cache_catalogo.invalidar("categorias_mesas")
     if '_id' in categoria:
         del categoria['_id']
     
@@ -1461,6 +2959,7 @@ async def actualizar_categoria_mesa(categoria_id: str, request: Request, current
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
+    cache_catalogo.invalidar("categorias_mesas")
     
     return {"success": True, "message": "Categoría actualizada"}
 
@@ -1470,73 +2969,14 @@ async def eliminar_categoria_mesa(categoria_id: str, current_user: str = Depends
     result = await db.categorias_mesas.delete_one({"id": categoria_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
+    cache_catalogo.invalidar("categorias_mesas")
     return {"success": True, "message": "Categoría eliminada"}
 
 # ==================== GENERACIÓN DE ENTRADA COMO IMAGEN ====================
 
-def generar_firma_hmac(datos: str) -> str:
-    """Genera una firma HMAC-SHA256 para verificar autenticidad del QR"""
-    signature = hmac.new(HMAC_SECRET_KEY, datos.encode(), hashlib.sha256).hexdigest()
-    return signature[:16]  # Primeros 16 caracteres
-
-def verificar_firma_hmac(datos: str, firma: str) -> bool:
-    """Verifica que la firma HMAC sea válida"""
-    firma_esperada = generar_firma_hmac(datos)
-    return hmac.compare_digest(firma_esperada, firma)
-
 def generar_qr_seguro_v2(entrada_id: str, evento_id: str, codigo_alfanumerico: str) -> tuple:
-    """
-    Genera un QR ultra-seguro con:
-    - Código único encriptado
-    - Firma HMAC para verificación
-    - Timestamp de creación
-    """
-    timestamp = datetime.now(timezone.utc).isoformat()
-    
-    # Datos del QR
-    datos_qr = {
-        "e": entrada_id,  # entrada_id (abreviado)
-        "v": evento_id,   # evento_id (abreviado)
-        "c": codigo_alfanumerico,
-        "t": timestamp[:19],  # timestamp sin microsegundos
-        "n": str(uuid.uuid4())[:8]  # nonce único
-    }
-    
-    # Crear string para firmar
-    datos_string = f"{entrada_id}|{evento_id}|{codigo_alfanumerico}|{datos_qr['n']}"
-    firma = generar_firma_hmac(datos_string)
-    datos_qr["s"] = firma  # signature
-    
-    # Encriptar datos
-    datos_json = json.dumps(datos_qr, separators=(',', ':'))
-    iv = os.urandom(16)
-    cipher = Cipher(
-        algorithms.AES(ENCRYPTION_KEY[:32]),
-        modes.CFB(iv),
-        backend=default_backend()
-    )
-    encryptor = cipher.encryptor()
-    datos_encriptados = encryptor.update(datos_json.encode()) + encryptor.finalize()
-    payload = base64.b64encode(iv + datos_encriptados).decode()
-    
-    # Generar imagen QR con alta corrección de errores
-    qr = qrcode.QRCode(
-        version=2,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,  # Máxima corrección
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(payload)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    buffer.seek(0)
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode()
-    
-    return f"data:image/png;base64,{qr_base64}", payload
+    """QR v2: datos abreviados con firma HMAC y corrección de errores H (ver qr_codecs.CodecV2)"""
+    return CODECS_QR[2].generar(entrada_id=entrada_id, evento_id=evento_id, codigo_alfanumerico=codigo_alfanumerico)
 
 async def generar_imagen_entrada(entrada: dict, evento: dict) -> bytes:
     """
@@ -1799,34 +3239,19 @@ async def aprobar_y_enviar_entrada(
         {"id": {"$in": datos.entrada_ids}},
         {"$set": {"estado_pago": "aprobado"}}
     )
+    await db.ordenes.update_many(
+        {"entrada_ids": {"$in": datos.entrada_ids}},
+        {"$set": {"estado_pago": "aprobado"}}
+    )
     
     # Obtener entradas aprobadas para enviar emails
     entradas = await db.entradas.find(
         {"id": {"$in": datos.entrada_ids}},
         {"_id": 0}
-    ).to_list(100)
+    ).to_list(len(datos.entrada_ids))
+    actualizar_mapas(entradas, OCUPADO)
     
-    emails_enviados = 0
-    emails_fallidos = 0
-    
-    for entrada in entradas:
-        evento = await db.eventos.find_one({"id": entrada['evento_id']}, {"_id": 0})
-        if evento and entrada.get('email_comprador'):
-            # Enviar en background para no bloquear
-            email_enviado = await enviar_email_entrada(
-                entrada['email_comprador'],
-                entrada,
-                evento
-            )
-            if email_enviado:
-                emails_enviados += 1
-                # Marcar como enviado
-                await db.entradas.update_one(
-                    {"id": entrada['id']},
-                    {"$set": {"email_enviado": True, "fecha_email": datetime.now(timezone.utc).isoformat()}}
-                )
-            else:
-                emails_fallidos += 1
+    emails_enviados, emails_fallidos = await enviar_entradas_por_email(entradas)
     
     return {
         "message": f"{result.modified_count} entrada(s) aprobada(s)",
@@ -1875,6 +3300,185 @@ async def obtener_config_email(current_user: str = Depends(get_current_user)):
         "email": GMAIL_USER[:3] + "***" if GMAIL_USER else None
     }
 
+# ==================== ÓRDENES DE COMPRA ====================
+
+async def adjuntar_ordenes(entradas: List[dict]) -> List[dict]:
+    """Completa las entradas con los datos de pago de su orden (una consulta por lote)"""
+    orden_ids = list({e['orden_id'] for e in entradas if e.get('orden_id')})
+    if not orden_ids:
+        return entradas
+    
+    proyeccion = {"_id": 0, "id": 1, **{c: 1 for c in CAMPOS_ORDEN_EN_ENTRADA}}
+    ordenes = {o['id']: o async for o in db.ordenes.find({"id": {"$in": orden_ids}}, proyeccion)}
+    
+    for entrada in entradas:
+        orden = ordenes.get(entrada.get('orden_id'))
+        if orden:
+            for campo in CAMPOS_ORDEN_EN_ENTRADA:
+                if entrada.get(campo) is None:
+                    entrada[campo] = orden.get(campo)
+    return entradas
+
+async def liberar_cupos(entradas: List[dict]):
+    """Devuelve al evento los cupos (por categoría y el contador general) de entradas rechazadas o eliminadas"""
+    por_evento = {}
+    por_cupo = {}
+    for entrada in entradas:
+        por_evento[entrada['evento_id']] = por_evento.get(entrada['evento_id'], 0) + 1
+        if entrada.get('cupo'):
+            demanda = por_cupo.setdefault(entrada['evento_id'], {})
+            demanda[entrada['cupo']] = demanda.get(entrada['cupo'], 0) + 1
+    
+    for evento_id, cantidad in por_evento.items():
+        await db.eventos.update_one(
+            {"id": evento_id, "tipo_asientos": {"$in": ["general", None]}},
+            {"$inc": {"asientos_disponibles": cantidad}}
+        )
+    for evento_id, demanda in por_cupo.items():
+        await devolver_cupos(evento_id, demanda)
+
+async def quitar_entradas_de_ordenes(entradas: List[dict]):
+    """Saca entradas eliminadas de su orden; la orden que queda vacía pasa a rechazada"""
+    orden_ids = list({e['orden_id'] for e in entradas if e and e.get('orden_id')})
+    if not orden_ids:
+        return
+    await db.ordenes.update_many(
+        {"id": {"$in": orden_ids}},
+        {"$pull": {"entrada_ids": {"$in": [e['id'] for e in entradas if e]}}}
+    )
+    await db.ordenes.update_many(
+        {"id": {"$in": orden_ids}, "entrada_ids": {"$size": 0}},
+        {"$set": {"estado_pago": "rechazado"}}
+    )
+
+async def enviar_entradas_por_email(entradas: List[dict]) -> tuple:
+    """Envía cada entrada a su comprador y marca las enviadas en un solo update"""
+    eventos = {}
+    enviadas = []
+    fallidos = 0
+    
+    for entrada in entradas:
+        if not entrada.get('email_comprador'):
+            continue
+        evento_id = entrada['evento_id']
+        if evento_id not in eventos:
+            eventos[evento_id] = await db.eventos.find_one({"id": evento_id}, {"_id": 0})
+        evento = eventos[evento_id]
+        if not evento:
+            continue
+        if await enviar_email_entrada(entrada['email_comprador'], entrada, evento):
+            enviadas.append(entrada['id'])
+        else:
+            fallidos += 1
+    
+    if enviadas:
+        await db.entradas.update_many(
+            {"id": {"$in": enviadas}},
+            {"$set": {"email_enviado": True, "fecha_email": datetime.now(timezone.utc).isoformat()}}
+        )
+    return len(enviadas), fallidos
+
+async def obtener_orden(orden_id: str) -> dict:
+    orden = await db.ordenes.find_one({"id": orden_id}, {"_id": 0})
+    if not orden:
+        raise HTTPException(status_code=404, detail="Orden no encontrada")
+    return orden
+
+@api_router.get("/admin/ordenes")
+async def listar_ordenes_admin(
+    response: Response,
+    evento_id: Optional[str] = None,
+    estado: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = LIMITE_COMPRAS_DEFECTO,
+    current_user: str = Depends(get_current_user)
+):
+    """Lista órdenes paginadas por cursor; mismo contrato que /admin/compras"""
+    condiciones = []
+    if evento_id:
+        condiciones.append({"evento_id": evento_id})
+    if estado:
+        condiciones.append({"estado_pago": estado})
+    if after:
+        condiciones.append(filtro_cursor(after))
+    filtro = {"$and": condiciones} if condiciones else {}
+    
+    limit = max(1, min(limit, LIMITE_COMPRAS_MAXIMO))
+    ordenes = await db.ordenes.find(filtro, {"_id": 0}).sort(
+        [("fecha_compra", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    return recortar_pagina(ordenes, limit, response)
+
+@api_router.get("/admin/ordenes/{orden_id}")
+async def obtener_orden_admin(orden_id: str, current_user: str = Depends(get_current_user)):
+    """Devuelve la orden con sus entradas (sin los campos pesados)"""
+    orden = await obtener_orden(orden_id)
+    proyeccion = {"_id": 0, **{campo: 0 for campo in CAMPOS_PESADOS_COMPRA}}
+    orden["entradas"] = await db.entradas.find({"orden_id": orden_id}, proyeccion).to_list(len(orden["entrada_ids"]) or 1)
+    return orden
+
+@api_router.post("/admin/ordenes/{orden_id}/aprobar")
+async def aprobar_orden_admin(orden_id: str, enviar_email: bool = False, current_user: str = Depends(get_current_user)):
+    """Aprueba todas las entradas de la orden; opcionalmente las envía por email"""
+    await obtener_orden(orden_id)
+    await db.ordenes.update_one({"id": orden_id}, {"$set": {"estado_pago": "aprobado"}})
+    result = await db.entradas.update_many({"orden_id": orden_id}, {"$set": {"estado_pago": "aprobado"}})
+    actualizar_mapas(await db.entradas.find(
+        {"orden_id": orden_id, "asiento": {"$ne": None}},
+        {"_id": 0, "evento_id": 1, "asiento": 1}
+    ).to_list(None), OCUPADO)
+    
+    respuesta = {
+        "message": f"Orden aprobada ({result.modified_count} entrada(s))",
+        "aprobadas": result.modified_count
+    }
+    if enviar_email:
+        entradas = await db.entradas.find({"orden_id": orden_id}, {"_id": 0}).to_list(None)
+        respuesta["emails_enviados"], respuesta["emails_fallidos"] = await enviar_entradas_por_email(entradas)
+        respuesta["email_configurado"] = bool(GMAIL_USER and GMAIL_APP_PASSWORD)
+    return respuesta
+
+@api_router.post("/admin/ordenes/{orden_id}/rechazar")
+async def rechazar_orden_admin(orden_id: str, current_user: str = Depends(get_current_user)):
+    """Rechaza la orden: devuelve los cupos y elimina sus entradas"""
+    await obtener_orden(orden_id)
+    entradas = await db.entradas.find(
+        {"orden_id": orden_id},
+        {"_id": 0, "id": 1, "evento_id": 1, "asiento": 1, "cupo": 1}
+    ).to_list(None)
+    
+    await liberar_cupos(entradas)
+    result = await db.entradas.delete_many({"orden_id": orden_id})
+    actualizar_mapas(entradas, None)
+    await db.ordenes.update_one({"id": orden_id}, {"$set": {"estado_pago": "rechazado", "entrada_ids": []}})
+    
+    return {
+        "message": f"Orden rechazada ({result.deleted_count} entrada(s))",
+        "eliminadas": result.deleted_count
+    }
+
+@api_router.post("/admin/ordenes/{orden_id}/reenviar")
+async def reenviar_orden_email(orden_id: str, current_user: str = Depends(get_current_user)):
+    """Reenvía por email todas las entradas aprobadas de la orden"""
+    orden = await obtener_orden(orden_id)
+    if orden.get('estado_pago') != 'aprobado':
+        raise HTTPException(status_code=400, detail="La orden debe estar aprobada primero")
+    
+    entradas = await db.entradas.find(
+        {"orden_id": orden_id, "estado_pago": "aprobado"},
+        {"_id": 0}
+    ).to_list(None)
+    enviados, fallidos = await enviar_entradas_por_email(entradas)
+    if entradas and not enviados:
+        raise HTTPException(status_code=500, detail="Error al enviar email. Verifica la configuración de Gmail.")
+    
+    return {
+        "success": True,
+        "message": f"{enviados} entrada(s) reenviada(s) a {orden['email_comprador']}",
+        "emails_enviados": enviados,
+        "emails_fallidos": fallidos
+    }
+
 # ==================== SISTEMA DE ACREDITACIONES ====================
 
 @api_router.get("/admin/categorias-acreditacion")
@@ -1977,6 +3581,10 @@ async def validar_acreditacion(request: Request):
     codigo = body.get('codigo', '').strip().upper()
     accion = body.get('accion', 'verificar')
     
+    token_puerta = await token_puerta_de(request)
+    puerta = puerta_de(request, body, token_puerta)
+    verificar_limite_puerta(puerta, token_puerta)
+    
     acreditacion = None
     
     # Buscar por código o QR
@@ -1986,8 +3594,8 @@ async def validar_acreditacion(request: Request):
             "estado": "activa"
         }, {"_id": 0})
     elif qr_payload:
-        # Decodificar QR
-        datos = validar_qr(qr_payload)
+        # Decodificar QR (las acreditaciones se emiten en v1, pero se despacha igual por prefijo)
+        datos = CODECS_QR.para_payload(qr_payload).decodificar(qr_payload)
         if datos and datos.get('tipo') == 'acreditacion':
             acreditacion = await db.acreditaciones.find_one({
                 "id": datos.get('acreditacion_id'),
@@ -1995,12 +3603,17 @@ async def validar_acreditacion(request: Request):
             }, {"_id": 0})
     
     if not acreditacion:
+        limitador_escaneos.registrar_fallo(puerta)
+        metricas_puertas.registrar(puerta, "invalidos")
         return {
             "valido": False,
             "tipo": "acreditacion",
             "mensaje": "❌ Acreditación no encontrada o inactiva"
         }
     
+    if fuera_de_evento(token_puerta, acreditacion.get('evento_id')):
+        raise escaneo_invalido(puerta, "La acreditación es de otro evento", status_code=403)
+    
     if accion == 'verificar':
         return {
             "valido": True,
@@ -2029,10 +3642,8 @@ async def validar_acreditacion(request: Request):
             }
         
         historial = acreditacion.get('historial_acceso', [])
-        historial.append({
-            "tipo": "entrada",
-            "fecha": datetime.now(timezone.utc).isoformat()
-        })
+        historial.append(registro_acceso("entrada", token_puerta, body))
+        metricas_puertas.registrar(puerta, "entradas")
         
         await db.acreditaciones.update_one(
             {"id": acreditacion['id']},
@@ -2059,10 +3670,8 @@ async def validar_acreditacion(request: Request):
             }
         
         historial = acreditacion.get('historial_acceso', [])
-        historial.append({
-            "tipo": "salida",
-            "fecha": datetime.now(timezone.utc).isoformat()
-        })
+        historial.append(registro_acceso("salida", token_puerta, body))
+        metricas_puertas.registrar(puerta, "salidas")
         
         await db.acreditaciones.update_one(
             {"id": acreditacion['id']},
@@ -2142,6 +3751,159 @@ async def obtener_aforo_evento(evento_id: str, current_user: str = Depends(get_c
     
     return aforo
 
+# ==================== EXPORTACIÓN DE COMPRAS Y ACCESOS ====================
+
+COLUMNAS_EXPORT_COMPRAS = [
+    "id", "codigo_alfanumerico", "evento_id", "nombre_evento", "nombre_comprador",
+    "email_comprador", "telefono_comprador", "asiento", "categoria_asiento",
+    "metodo_pago", "estado_pago", "estado_entrada", "usado", "fecha_compra", "fecha_uso"
+]
+COLUMNAS_EXPORT_ACCESOS = [
+    "entrada_id", "codigo_alfanumerico", "evento_id", "nombre_evento",
+    "nombre_comprador", "categoria_asiento", "tipo", "fecha", "puerta"
+]
+TAMANO_LOTE_EXPORT = 1000
+
+def filtro_exportacion(evento_id: Optional[str], estado: Optional[str]) -> dict:
+    filtro = {}
+    if evento_id:
+        filtro["evento_id"] = evento_id
+    if estado:
+        filtro["estado_pago"] = estado
+    return filtro
+
+def filtro_rango_fechas(desde: Optional[str], hasta: Optional[str]) -> Optional[dict]:
+    """Rango sobre fechas ISO guardadas como string (comparación lexicográfica)"""
+    rango = {}
+    if desde:
+        rango["$gte"] = desde
+    if hasta:
+        rango["$lte"] = hasta
+    return rango or None
+
+async def con_datos_de_orden(cursor):
+    """Recorre el cursor por lotes completando cada lote con los datos de su orden"""
+    lote = []
+    async for entrada in cursor:
+        lote.append(entrada)
+        if len(lote) >= TAMANO_LOTE_EXPORT:
+            for fila in await adjuntar_ordenes(lote):
+                yield fila
+            lote = []
+    for fila in await adjuntar_ordenes(lote):
+        yield fila
+
+async def serializar_filas(filas, columnas: List[str], formato: str):
+    """Convierte filas del cursor en bloques CSV/NDJSON de tamaño acotado"""
+    buffer = StringIO()
+    if formato == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=columnas, extrasaction="ignore")
+        writer.writeheader()
+    pendientes = 0
+    async for fila in filas:
+        if formato == "csv":
+            writer.writerow(fila)
+        else:
+            buffer.write(json.dumps({c: fila.get(c) for c in columnas}, ensure_ascii=False, default=str))
+            buffer.write("\n")
+        pendientes += 1
+        if pendientes >= TAMANO_LOTE_EXPORT:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            pendientes = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+async def comprimir_gzip(bloques):
+    compresor = zlib.compressobj(wbits=31)  # 31 = formato gzip
+    async for bloque in bloques:
+        datos = compresor.compress(bloque)
+        if datos:
+            yield datos
+    yield compresor.flush()
+
+def respuesta_exportacion(filas, columnas: List[str], formato: str, gzip: bool, nombre: str) -> StreamingResponse:
+    if formato not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Formato inválido (csv o ndjson)")
+    
+    contenido = serializar_filas(filas, columnas, formato)
+    media_type = "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson"
+    archivo = f"{nombre}-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M')}.{formato}"
+    if gzip:
+        contenido = comprimir_gzip(contenido)
+        media_type = "application/gzip"
+        archivo += ".gz"
+    
+    return StreamingResponse(
+        contenido,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={archivo}"}
+    )
+
+@api_router.get("/admin/export/compras")
+async def exportar_compras(
+    formato: str = "csv",
+    evento_id: Optional[str] = None,
+    estado: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    gzip: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """Exporta compras en streaming desde el cursor de Mongo (memoria constante)"""
+    filtro = filtro_exportacion(evento_id, estado)
+    rango = filtro_rango_fechas(desde, hasta)
+    if rango:
+        filtro["fecha_compra"] = rango
+    
+    proyeccion = {"_id": 0, "orden_id": 1, **{c: 1 for c in COLUMNAS_EXPORT_COMPRAS}}
+    cursor = db.entradas.find(filtro, proyeccion).sort(
+        [("fecha_compra", -1), ("id", -1)]
+    ).batch_size(TAMANO_LOTE_EXPORT)
+    
+    return respuesta_exportacion(con_datos_de_orden(cursor), COLUMNAS_EXPORT_COMPRAS, formato, gzip, "compras")
+
+@api_router.get("/admin/export/accesos")
+async def exportar_accesos(
+    formato: str = "csv",
+    evento_id: Optional[str] = None,
+    estado: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    gzip: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """Exporta cada registro de entrada/salida de historial_acceso como una fila"""
+    filtro = filtro_exportacion(evento_id, estado)
+    filtro["historial_acceso.0"] = {"$exists": True}
+    
+    pipeline = [
+        {"$match": filtro},
+        {"$project": {
+            "_id": 0, "id": 1, "codigo_alfanumerico": 1, "evento_id": 1, "nombre_evento": 1,
+            "nombre_comprador": 1, "categoria_asiento": 1, "historial_acceso": 1
+        }},
+        {"$unwind": "$historial_acceso"},
+    ]
+    rango = filtro_rango_fechas(desde, hasta)
+    if rango:
+        pipeline.append({"$match": {"historial_acceso.fecha": rango}})
+    pipeline.append({"$project": {
+        "entrada_id": "$id",
+        "codigo_alfanumerico": 1,
+        "evento_id": 1,
+        "nombre_evento": 1,
+        "nombre_comprador": 1,
+        "categoria_asiento": 1,
+        "tipo": "$historial_acceso.tipo",
+        "fecha": "$historial_acceso.fecha",
+        "puerta": "$historial_acceso.puerta"
+    }})
+    
+    cursor = db.entradas.aggregate(pipeline, batchSize=TAMANO_LOTE_EXPORT)
+    return respuesta_exportacion(cursor, COLUMNAS_EXPORT_ACCESOS, formato, gzip, "accesos")
+
 # ==================== GENERADOR DE ENTRADAS PARA IMPRESORA TÉRMICA ====================
 
 @api_router.post("/admin/generar-entradas-termicas")
@@ -2156,13 +3918,27 @@ async def generar_entradas_termicas(request: Request, current_user: str = Depend
     evento = await db.eventos.find_one({"id": evento_id}, {"_id": 0})
     if not evento:
         raise HTTPException(status_code=404, detail="Evento no encontrado")
+    if not isinstance(cantidad, int) or cantidad < 1:
+        raise HTTPException(status_code=400, detail="La cantidad debe ser al menos 1")
+    
+    # Las entradas de taquilla salen aprobadas: descuentan su cupo igual que una compra,
+    # con el mismo update condicionado, antes de insertarse
+    cupos = evento.get('cupos')
+    if cupos is None:
+        cupos = await recalcular_cupos(evento)
+    cupo = clave_cupo_entrada(None, cupos, None, categoria) or cupo_de_respaldo(cupos, categoria)
+    demanda = {cupo: cantidad} if cupo is not None else {}
+    descuento_general = cantidad if evento.get('tipo_asientos', 'general') == 'general' else 0
+    if not await reservar_cupos(evento_id, demanda, descuento_general):
+        raise HTTPException(status_code=409, detail="No hay suficientes entradas disponibles")
     
     entradas_generadas = []
+    datos_por_id = {}
+    prefijo_codigo = f"CF-{re.sub(r'[^A-Z0-9]', '', categoria.upper())[:3] or 'GEN'}"
     
     for i in range(cantidad):
-        # Generar código único
-        codigo_unico = str(uuid.uuid4())[:8].upper()
-        codigo_alfanumerico = f"CF-{categoria[:3].upper()}-{codigo_unico}"
+        # Generar código único (aleatorio + dígito de control; el índice único descarta choques)
+        codigo_alfanumerico = generar_codigo_alfanumerico(prefijo_codigo)
         
         entrada_data = {
             "id": str(uuid.uuid4()),
@@ -2181,7 +3957,8 @@ async def generar_entradas_termicas(request: Request, current_user: str = Depend
             "fecha_compra": datetime.now(timezone.utc).isoformat(),
             "estado_entrada": "fuera",
             "historial_acceso": [],
-            "tipo_venta": "taquilla"
+            "tipo_venta": "taquilla",
+            "cupo": cupo
         }
         
         # Generar QR
@@ -2193,16 +3970,28 @@ async def generar_entradas_termicas(request: Request, current_user: str = Depend
             "categoria": categoria
         }
         
-        qr_image, qr_payload = generar_qr_seguro(datos_qr)
+        qr_image, qr_payload = generar_qr_v3(entrada_data["id"], evento_id)
         hash_validacion = generar_hash(datos_qr)
         
         entrada_data["codigo_qr"] = qr_image
         entrada_data["qr_payload"] = qr_payload
         entrada_data["hash_validacion"] = hash_validacion
         
-        await db.entradas.insert_one(entrada_data)
+        datos_por_id[entrada_data["id"]] = datos_qr
         entradas_generadas.append(entrada_data)
     
+    def regenerar_codigo(doc: dict):
+        datos = datos_por_id[doc["id"]]
+        datos["codigo"] = doc["codigo_alfanumerico"] = generar_codigo_alfanumerico(prefijo_codigo)
+        doc["hash_validacion"] = generar_hash(datos)
+    
+    try:
+        await insertar_entradas(entradas_generadas, regenerar_codigo)
+    except Exception:
+        await db.entradas.delete_many({"id": {"$in": [doc["id"] for doc in entradas_generadas]}})
+        await devolver_cupos(evento_id, demanda, descuento_general)
+        raise
+    
     return {
         "success": True,
         "cantidad": len(entradas_generadas),
@@ -2507,11 +4296,86 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+async def crear_indice_codigos():
+    """Índice único de codigo_alfanumerico (reemplaza al índice simple anterior)"""
+    indices = await db.entradas.index_information()
+    if "codigo_alfanumerico_1" in indices and not indices["codigo_alfanumerico_1"].get("unique"):
+        await db.entradas.drop_index("codigo_alfanumerico_1")
+    try:
+        await db.entradas.create_index(
+            "codigo_alfanumerico",
+            unique=True,
+            partialFilterExpression={"codigo_alfanumerico": {"$type": "string"}}
+        )
+    except OperationFailure as e:
+        # Códigos repetidos de antes del índice: se deja uno simple para que las búsquedas no escaneen
+        logger.warning(f"No se pudo crear el índice único de códigos ({e}); revise los duplicados")
+        await db.entradas.create_index("codigo_alfanumerico", name="codigo_alfanumerico_busqueda")
+
+async def crear_indice_asientos_vendidos():
+    """Una silla, una entrada activa: índice único parcial (evento_id, asiento_clave)"""
+    # Entradas anteriores a asiento_clave: toman el id guardado (las rechazadas se eliminan)
+    await db.entradas.update_many(
+        {"asiento_clave": {"$exists": False}, "asiento": {"$type": "string"}, "estado_pago": {"$in": ["aprobado", "pendiente"]}},
+        [{"$set": {"asiento_clave": "$asiento"}}]
+    )
+    try:
+        await db.entradas.create_index(
+            [("evento_id", ASCENDING), ("asiento_clave", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"asiento_clave": {"$type": "string"}}
+        )
+    except OperationFailure as e:
+        logger.warning(f"No se pudo crear el índice único de asientos ({e}); revise las sillas vendidas dos veces")
+
+@app.on_event("startup")
+async def crear_indices():
+    """Índices usados por los listados paginados y las búsquedas de compras y entradas"""
+    await db.entradas.create_index("id")
+    await db.entradas.create_index([("fecha_compra", DESCENDING), ("id", DESCENDING)])
+    await db.entradas.create_index([("estado_pago", ASCENDING), ("fecha_compra", DESCENDING), ("id", DESCENDING)])
+    await db.entradas.create_index([("evento_id", ASCENDING), ("estado_pago", ASCENDING), ("fecha_compra", DESCENDING), ("id", DESCENDING)])
+    await crear_indice_codigos()
+    await crear_indice_asientos_vendidos()
+    await db.entradas.create_index([("email_normalizado", ASCENDING), ("fecha_compra", DESCENDING), ("id", DESCENDING)])
+    await db.entradas.create_index([("nombre_comprador", TEXT)], default_language="none")
+    await db.entradas.create_index("orden_id")
+    await db.ordenes.create_index("id", unique=True)
+    await db.ordenes.create_index("entrada_ids")
+    await db.ordenes.create_index([("fecha_compra", DESCENDING), ("id", DESCENDING)])
+    await db.ordenes.create_index([("estado_pago", ASCENDING), ("fecha_compra", DESCENDING), ("id", DESCENDING)])
+    await db.ordenes.create_index([("evento_id", ASCENDING), ("estado_pago", ASCENDING), ("fecha_compra", DESCENDING), ("id", DESCENDING)])
+    await db.ordenes.create_index("email_normalizado")
+    await db.asientos.create_index([("evento_id", ASCENDING), ("id", ASCENDING)])
+    await db.tokens_revocados.create_index("jti", unique=True)
+    await db.tokens_revocados.create_index("expira", expireAfterSeconds=0)
+    await db.tokens_puerta.create_index("jti", unique=True)
+    await db.tokens_puerta.create_index("expira", expireAfterSeconds=0)
+    await db.entradas.create_index([("evento_id", ASCENDING), ("mesa_id", ASCENDING), ("estado_pago", ASCENDING)])
+    
+    # Entradas anteriores a email_normalizado: se completan una sola vez
+    await db.entradas.update_many(
+        {"email_normalizado": {"$exists": False}, "email_comprador": {"$type": "string"}},
+        [{"$set": {"email_normalizado": {"$toLower": {"$trim": {"input": "$email_comprador"}}}}}]
+    )
+    
+    # Eventos creados antes de guardar los campos derivados
+    # (asientos_disponibles ya tiene descontadas las vendidas: capacidad_legado las suma)
+    async for evento in db.eventos.find({"capacidad_total": {"$exists": False}}, {"_id": 0}):
+        vendidas = await contar_entradas_activas(evento['id'])
+        await db.eventos.update_one(
+            {"id": evento['id']},
+            {"$set": derivar_campos_evento(evento, capacidad_legado(evento, vendidas))}
+        )
+    async for evento in db.eventos.find({"cupos": {"$exists": False}}, {"_id": 0}):
+        await recalcular_cupos(evento)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
\ No newline at end of file
@@ -184,7 +184,7 @@ class CiudadFeriaAPITester:
     
     def test_get_seats(self, evento_id):
         """Test getting seats configuration for an event"""
-        success, data = self.run_test(f"Get Seats ({evento_id[:8]}...)", "GET", f"eventos/{evento_id}/asientos", 200)
+        success, data = self.run_test(f"Get Seats ({evento_id[:8]}...)", "GET", f"eventos/{evento_id}/asientos?formato=lista", 200)
         
         if success:
             # Check required fields
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import axios from 'axios';
 import { Check, X, Users, Table2, ChevronDown, ChevronUp, Info, MousePointerClick, ArrowRight, Ticket } from 'lucide-react';
@@ -6,6 +6,53 @@ import { Check, X, Users, Table2, ChevronDown, ChevronUp, Info, MousePointerClic
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Ocupación del mapa en bitmaps base64: la silla i está en el byte (i >> 3), máscara 1 << (i & 7)
+const decodificarBitmap = (base64) => {
+  if (!base64) return new Uint8Array(0);
+  const binario = atob(base64);
+  const bytes = new Uint8Array(binario.length);
+  for (let i = 0; i < binario.length; i++) bytes[i] = binario.charCodeAt(i);
+  return bytes;
+};
+
+const bitActivo = (bytes, i) => ((bytes[i >> 3] || 0) & (1 << (i & 7))) !== 0;
+
+const INTERVALO_ACTUALIZACION_MS = 5000;
+
+// Aplica deltas [indice, codigo] (0 libre, 1 ocupado, 2 pendiente, 3 retenido) sobre copias de los bitmaps
+const aplicarCambios = (datos, cambios) => {
+  const ocupados = datos.ocupados.slice();
+  const pendientes = datos.pendientes.slice();
+  const retenidos = datos.retenidos.slice();
+  cambios.forEach(([indice, codigo]) => {
+    const byte = indice >> 3;
+    const mascara = 1 << (indice & 7);
+    [ocupados, pendientes, retenidos].forEach((bits, k) => {
+      bits[byte] = codigo === k + 1 ? bits[byte] | mascara : bits[byte] & ~mascara;
+    });
+  });
+  return { ocupados, pendientes, retenidos };
+};
+
+const decodificarMapa = (data) => ({
+  ...data,
+  indices: indexarSillas(data.mesas),
+  ocupados: decodificarBitmap(data.bitmaps?.ocupados),
+  pendientes: decodificarBitmap(data.bitmaps?.pendientes),
+  retenidos: decodificarBitmap(data.bitmaps?.retenidos)
+});
+
+// Índice denso de cada silla ("Mesa 1-Silla3") según los rangos por mesa que envía el backend
+const indexarSillas = (mesas = []) => {
+  const indices = {};
+  mesas.forEach(mesa => {
+    for (let n = 1; n <= mesa.sillas; n++) {
+      indices[`${mesa.nombre}-Silla${n}`] = mesa.inicio + n - 1;
+    }
+  });
+  return indices;
+};
+
 const SelectorAsientos = ({ eventoId, precioBase = 0, onSeleccionChange, maxSeleccion = 10 }) => {
   const [loading, setLoading] = useState(true);
   const [datosAsientos, setDatosAsientos] = useState(null);
@@ -21,6 +68,20 @@ const SelectorAsientos = ({ eventoId, precioBase = 0, onSeleccionChange, maxSele
     cargarCategoriasMesas();
   }, [eventoId]);
 
+  const versionRef = useRef(undefined);
+  useEffect(() => {
+    versionRef.current = datosAsientos?.version;
+  }, [datosAsientos?.version]);
+
+  useEffect(() => {
+    // Mientras el selector está abierto se piden solo los cambios desde la última versión
+    if (!datosAsientos || datosAsientos.tipo_asientos === 'general') return;
+    const timer = setInterval(() => {
+      if (versionRef.current !== undefined) actualizarAsientos(versionRef.current);
+    }, INTERVALO_ACTUALIZACION_MS);
+    return () => clearInterval(timer);
+  }, [eventoId, datosAsientos?.tipo_asientos]);
+
   useEffect(() => {
     // Notificar cambios de selección con precios
     if (datosAsientos?.tipo_asientos === 'general') {
@@ -112,7 +173,7 @@ const SelectorAsientos = ({ eventoId, precioBase = 0, onSeleccionChange, maxSele
   const cargarAsientos = async () => {
     try {
       const response = await axios.get(`${API}/eventos/${eventoId}/asientos`);
-      setDatosAsientos(response.data);
+      setDatosAsientos(decodificarMapa(response.data));
     } catch (error) {
       console.error('Error cargando asientos:', error);
     } finally {
@@ -120,6 +181,25 @@ const SelectorAsientos = ({ eventoId, precioBase = 0, onSeleccionChange, maxSele
     }
   };
 
+  const actualizarAsientos = async (version) => {
+    try {
+      const response = await axios.get(`${API}/eventos/${eventoId}/asientos`, { params: { since: version } });
+      const data = response.data;
+      if (data.resync) {
+        setDatosAsientos(decodificarMapa(data));
+      } else {
+        setDatosAsientos(prev => (prev?.version === version ? {
+          ...prev,
+          ...aplicarCambios(prev, data.cambios),
+          version: data.version,
+          disponibles: data.disponibles
+        } : prev));
+      }
+    } catch (error) {
+      console.error('Error actualizando asientos:', error);
+    }
+  };
+
   const calcularDetallesSeleccion = () => {
     if (!datosAsientos?.configuracion?.mesas) return [];
     
@@ -189,8 +269,11 @@ const SelectorAsientos = ({ eventoId, precioBase = 0, onSeleccionChange, maxSele
   };
 
   const getEstadoAsiento = (asientoId) => {
-    if (datosAsientos?.asientos_ocupados?.includes(asientoId)) return 'ocupado';
-    if (datosAsientos?.asientos_pendientes?.includes(asientoId)) return 'pendiente';
+    const indice = datosAsientos?.indices?.[asientoId];
+    if (indice !== undefined) {
+      if (bitActivo(datosAsientos.ocupados, indice)) return 'ocupado';
+      if (bitActivo(datosAsientos.pendientes, indice) || bitActivo(datosAsientos.retenidos, indice)) return 'pendiente';
+    }
     if (asientosSeleccionados.includes(asientoId)) return 'seleccionado';
     return 'disponible';
   };
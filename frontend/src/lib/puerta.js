@@ -0,0 +1,48 @@
+import axios from 'axios';
+
+const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+
+// Token de puerta del dispositivo (emitido por un admin para un evento y una puerta).
+// Se guarda aparte del token de sesión: sobrevive al logout para que el validador
+// que use el equipo después siga escaneando como esa puerta.
+const CLAVE_PUERTA = 'puerta_dispositivo';
+
+export function obtenerPuerta() {
+  try {
+    const puerta = JSON.parse(localStorage.getItem(CLAVE_PUERTA));
+    if (puerta && new Date(puerta.expira) > new Date()) return puerta;
+  } catch (e) {
+    // valor corrupto: se descarta
+  }
+  localStorage.removeItem(CLAVE_PUERTA);
+  return null;
+}
+
+export function headersPuerta() {
+  const puerta = obtenerPuerta();
+  return puerta ? { 'X-Token-Puerta': puerta.token } : {};
+}
+
+export async function vincularPuerta(eventoId, nombrePuerta, dispositivo) {
+  const token = localStorage.getItem('admin_token');
+  const response = await axios.post(
+    `${API}/admin/puertas/token`,
+    { evento_id: eventoId, puerta: nombrePuerta, dispositivo },
+    { headers: { Authorization: `Bearer ${token}` } }
+  );
+  const puerta = { ...response.data, evento_id: eventoId };
+  localStorage.setItem(CLAVE_PUERTA, JSON.stringify(puerta));
+  return puerta;
+}
+
+// Olvida la puerta en este equipo; con sesión de admin también revoca el token
+export function desvincularPuerta() {
+  const puerta = obtenerPuerta();
+  localStorage.removeItem(CLAVE_PUERTA);
+  const token = localStorage.getItem('admin_token');
+  if (puerta && token) {
+    axios
+      .delete(`${API}/admin/puertas/token/${puerta.jti}`, { headers: { Authorization: `Bearer ${token}` } })
+      .catch(() => {});
+  }
+}
@@ -0,0 +1,15 @@
+import axios from 'axios';
+
+const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+
+// Revoca el token en el servidor (que deje de valer aunque alguien lo haya copiado)
+// y lo borra del navegador; el logout local no espera la respuesta
+export function cerrarSesionAdmin() {
+  const token = localStorage.getItem('admin_token');
+  localStorage.removeItem('admin_token');
+  if (token) {
+    axios
+      .post(`${API}/admin/logout`, null, { headers: { Authorization: `Bearer ${token}` } })
+      .catch(() => {});
+  }
+}
@@ -76,20 +76,22 @@ const DetalleEvento = () => {
     }
 
     setUploadingComprobante(true);
-    
-    // Convertir a base64
-    const reader = new FileReader();
-    reader.onloadend = () => {
-      setComprobante(reader.result);
+
+    // Subir el comprobante una sola vez; la compra solo envía la URL
+    try {
+      const formDataUpload = new FormData();
+      formDataUpload.append('file', file);
+      const response = await axios.post(`${API}/upload-comprobante`, formDataUpload, {
+        headers: { 'Content-Type': 'multipart/form-data' }
+      });
+      setComprobante(response.data.url);
       setComprobanteFile(file);
-      setUploadingComprobante(false);
       toast.success('Comprobante cargado');
-    };
-    reader.onerror = () => {
-      toast.error('Error al cargar el archivo');
+    } catch (error) {
+      toast.error(error.response?.data?.detail || 'Error al cargar el archivo');
+    } finally {
       setUploadingComprobante(false);
-    };
-    reader.readAsDataURL(file);
+    }
   };
 
   const handleCompra = async (e) => {
@@ -530,7 +532,7 @@ const DetalleEvento = () => {
                     {comprobante && (
                       <div className="mt-3 p-4 rounded-xl bg-primary/5 border border-primary/20">
                         <img 
-                          src={comprobante} 
+                          src={`${BACKEND_URL}${comprobante}`} 
                           alt="Comprobante" 
                           className="max-h-40 rounded-lg mx-auto"
                         />
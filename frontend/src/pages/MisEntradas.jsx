@@ -13,6 +13,8 @@ const MisEntradas = () => {
   const [entradas, setEntradas] = useState([]);
   const [loading, setLoading] = useState(false);
   const [buscado, setBuscado] = useState(false);
+  const [siguienteCursor, setSiguienteCursor] = useState(null);
+  const [cargandoMas, setCargandoMas] = useState(false);
 
   const buscarEntradas = async (e) => {
     e.preventDefault();
@@ -28,6 +30,7 @@ const MisEntradas = () => {
     try {
       const response = await axios.get(`${API}/mis-entradas/${email}`);
       setEntradas(response.data);
+      setSiguienteCursor(response.headers['x-next-cursor'] || null);
       
       if (response.data.length === 0) {
         toast.info('No se encontraron entradas para este email');
@@ -42,9 +45,26 @@ const MisEntradas = () => {
     }
   };
 
+  const cargarMasEntradas = async () => {
+    if (!siguienteCursor) return;
+    setCargandoMas(true);
+    try {
+      const response = await axios.get(`${API}/mis-entradas/${email}`, {
+        params: { after: siguienteCursor }
+      });
+      setEntradas(prev => [...prev, ...response.data]);
+      setSiguienteCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error cargando más entradas:', error);
+      toast.error('Error al cargar más entradas');
+    } finally {
+      setCargandoMas(false);
+    }
+  };
+
   const descargarEntrada = (entrada) => {
     const link = document.createElement('a');
-    link.href = entrada.codigo_qr;
+    link.href = `${BACKEND_URL}${entrada.qr_url}`;
     link.download = `entrada-${entrada.nombre_evento}-${entrada.id}.png`;
     link.click();
     toast.success('QR descargado');
@@ -140,7 +160,8 @@ const MisEntradas = () => {
                     <div className="flex justify-center items-center">
                       {entrada.estado_pago === 'aprobado' ? (
                         <img
-                          src={entrada.codigo_qr}
+                          src={`${BACKEND_URL}${entrada.qr_url}`}
+                          loading="lazy"
                           alt="Código QR"
                           className="w-48 h-48 rounded-xl"
                         />
@@ -265,6 +286,17 @@ const MisEntradas = () => {
                 </motion.div>
               ))
             )}
+            {siguienteCursor && (
+              <div className="flex justify-center pt-4">
+                <button
+                  onClick={cargarMasEntradas}
+                  disabled={cargandoMas}
+                  className="px-6 py-3 rounded-full glass-card hover:border-primary/50 transition-all font-medium text-foreground disabled:opacity-50"
+                >
+                  {cargandoMas ? 'Cargando...' : 'Cargar más entradas'}
+                </button>
+              </div>
+            )}
           </motion.div>
         )}
       </div>
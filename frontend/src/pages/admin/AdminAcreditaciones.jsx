@@ -4,6 +4,7 @@ import { motion, AnimatePresence } from 'framer-motion';
 import axios from 'axios';
 import { LayoutDashboard, Calendar, Settings, LogOut, Tag, ShoppingCart, CreditCard, Shield, Table2, Users, Plus, Trash2, Eye, BadgeCheck, BarChart3, Download, QrCode, FileText, Activity, Palette } from 'lucide-react';
 import { toast } from 'sonner';
+import { cerrarSesionAdmin } from '../../lib/sesion';
 import { Toaster } from '../../components/ui/sonner';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -100,7 +101,7 @@ const AdminAcreditaciones = () => {
   };
 
   const handleLogout = () => {
-    localStorage.removeItem('admin_token');
+    cerrarSesionAdmin();
     navigate('/secure-admin-panel-2026');
   };
 
@@ -4,6 +4,7 @@ import { motion } from 'framer-motion';
 import axios from 'axios';
 import { LayoutDashboard, Calendar, Settings, LogOut, Tag, ShoppingCart, CreditCard, Shield, Table2, Users, BadgeCheck, BarChart3, RefreshCw, TrendingUp, UserCheck, UserX } from 'lucide-react';
 import { toast } from 'sonner';
+import { cerrarSesionAdmin } from '../../lib/sesion';
 import { Toaster } from '../../components/ui/sonner';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -69,7 +70,7 @@ const AdminAforo = () => {
   };
 
   const handleLogout = () => {
-    localStorage.removeItem('admin_token');
+    cerrarSesionAdmin();
     navigate('/secure-admin-panel-2026');
   };
 
@@ -5,6 +5,7 @@ import axios from 'axios';
 import { LayoutDashboard, Calendar, Settings, LogOut, Tag, ShoppingCart, CreditCard, Shield, Table2, Users, BarChart3, RefreshCw, UserCheck, Clock, TrendingUp } from 'lucide-react';
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer, PieChart, Pie, Cell } from 'recharts';
 import { toast } from 'sonner';
+import { cerrarSesionAdmin } from '../../lib/sesion';
 import { Toaster } from '../../components/ui/sonner';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -70,7 +71,7 @@ const AdminAsistencia = () => {
   };
 
   const handleLogout = () => {
-    localStorage.removeItem('admin_token');
+    cerrarSesionAdmin();
     navigate('/secure-admin-panel-2026');
   };
 
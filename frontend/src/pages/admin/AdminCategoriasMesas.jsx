@@ -4,6 +4,7 @@ import { motion } from 'framer-motion';
 import axios from 'axios';
 import { LayoutDashboard, Calendar, Settings, LogOut, Plus, Edit, Trash2, Tag, ShoppingCart, CreditCard, Shield, Table2, Upload, Users, BarChart3, } from 'lucide-react';
 import { toast } from 'sonner';
+import { cerrarSesionAdmin } from '../../lib/sesion';
 import { Toaster } from '../../components/ui/sonner';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -37,7 +38,7 @@ const AdminCategoriasMesas = () => {
   };
 
   const handleLogout = () => {
-    localStorage.removeItem('admin_token');
+    cerrarSesionAdmin();
     toast.success('Sesión cerrada');
     navigate('/secure-admin-panel-2026');
   };
@@ -4,6 +4,7 @@ import { motion } from 'framer-motion';
 import axios from 'axios';
 import { LayoutDashboard, Calendar, Settings, LogOut, Tag, ShoppingCart, CheckCircle, XCircle, Filter, Users, CreditCard, Shield, Table2, Mail, Download, Send, Trash2, BarChart3, BadgeCheck, Activity, FileSpreadsheet } from 'lucide-react';
 import { toast } from 'sonner';
+import { cerrarSesionAdmin } from '../../lib/sesion';
 import { Toaster } from '../../components/ui/sonner';
 import * as XLSX from 'xlsx';
 import { saveAs } from 'file-saver';
@@ -21,6 +22,8 @@ const AdminCompras = () => {
   const [comprobanteModal, setComprobanteModal] = useState(null);
   const [emailConfigured, setEmailConfigured] = useState(false);
   const [enviandoEmail, setEnviandoEmail] = useState(null);
+  const [siguienteCursor, setSiguienteCursor] = useState(null);
+  const [cargandoMas, setCargandoMas] = useState(false);
 
   useEffect(() => {
     cargarDatos();
@@ -39,20 +42,27 @@ const AdminCompras = () => {
     }
   };
 
+  const obtenerPaginaCompras = (after) => {
+    const token = localStorage.getItem('admin_token');
+    return axios.get(`${API}/admin/compras`, {
+      params: {
+        evento_id: eventoFiltro && eventoFiltro !== 'todos' ? eventoFiltro : undefined,
+        estado: estadoFiltro || undefined,
+        incluir: 'comprobante_pago',
+        after: after || undefined
+      },
+      headers: { Authorization: `Bearer ${token}` }
+    });
+  };
+
   const cargarDatos = async () => {
     try {
-      const token = localStorage.getItem('admin_token');
       const [comprasRes, eventosRes] = await Promise.all([
-        axios.get(`${API}/admin/compras`, {
-          params: {
-            evento_id: eventoFiltro && eventoFiltro !== 'todos' ? eventoFiltro : undefined,
-            estado: estadoFiltro || undefined
-          },
-          headers: { Authorization: `Bearer ${token}` }
-        }),
+        obtenerPaginaCompras(),
         axios.get(`${API}/eventos`)
       ]);
       setCompras(comprasRes.data);
+      setSiguienteCursor(comprasRes.headers['x-next-cursor'] || null);
       setEventos(eventosRes.data);
     } catch (error) {
       console.error('Error cargando datos:', error);
@@ -62,6 +72,21 @@ const AdminCompras = () => {
     }
   };
 
+  const cargarMasCompras = async () => {
+    if (!siguienteCursor) return;
+    setCargandoMas(true);
+    try {
+      const response = await obtenerPaginaCompras(siguienteCursor);
+      setCompras(prev => [...prev, ...response.data]);
+      setSiguienteCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error cargando más compras:', error);
+      toast.error('Error al cargar más compras');
+    } finally {
+      setCargandoMas(false);
+    }
+  };
+
   // Función para exportar a Excel
   const exportarExcel = () => {
     const datosExportar = comprasFiltradas.map(compra => ({
@@ -106,6 +131,27 @@ const AdminCompras = () => {
     toast.success(`Excel exportado: ${datosExportar.length} registros`);
   };
 
+  // Exportación completa desde el servidor (no depende de las páginas cargadas)
+  const exportarCSV = async () => {
+    try {
+      const token = localStorage.getItem('admin_token');
+      const response = await axios.get(`${API}/admin/export/compras`, {
+        params: {
+          formato: 'csv',
+          evento_id: eventoFiltro && eventoFiltro !== 'todos' ? eventoFiltro : undefined,
+          estado: estadoFiltro || undefined
+        },
+        headers: { Authorization: `Bearer ${token}` },
+        responseType: 'blob'
+      });
+      saveAs(response.data, 'compras.csv');
+      toast.success('CSV exportado');
+    } catch (error) {
+      console.error('Error exportando CSV:', error);
+      toast.error('Error al exportar CSV');
+    }
+  };
+
   // Filtrar compras localmente también
   const comprasFiltradas = compras.filter(compra => {
     if (eventoFiltro && eventoFiltro !== 'todos' && compra.evento_id !== eventoFiltro) {
@@ -217,7 +263,7 @@ const AdminCompras = () => {
   };
 
   const handleLogout = () => {
-    localStorage.removeItem('admin_token');
+    cerrarSesionAdmin();
     toast.success('Sesión cerrada');
     navigate('/secure-admin-panel-2026');
   };
@@ -337,6 +383,14 @@ const AdminCompras = () => {
                 <FileSpreadsheet className="w-5 h-5" />
                 Exportar Excel ({comprasFiltradas.length})
               </button>
+
+              <button
+                onClick={exportarCSV}
+                className="glass-card px-5 py-3 rounded-xl font-medium flex items-center gap-2 hover:border-primary/50 transition-colors text-foreground"
+              >
+                <Download className="w-5 h-5" />
+                Exportar CSV (todas)
+              </button>
             </div>
 
             {/* Resumen de filtro */}
@@ -478,6 +532,18 @@ const AdminCompras = () => {
                 </motion.div>
               ))}
 
+              {siguienteCursor && (
+                <div className="flex justify-center pt-4">
+                  <button
+                    onClick={cargarMasCompras}
+                    disabled={cargandoMas}
+                    className="px-6 py-3 rounded-full glass-card hover:border-primary/50 transition-all font-medium text-foreground disabled:opacity-50"
+                  >
+                    {cargandoMas ? 'Cargando...' : 'Cargar más compras'}
+                  </button>
+                </div>
+              )}
+
               {compras.length === 0 && (
                 <div className="glass-card p-12 rounded-3xl text-center">
                   <ShoppingCart className="w-16 h-16 text-foreground/30 mx-auto mb-4" />
@@ -515,7 +581,7 @@ const AdminCompras = () => {
               </button>
             </div>
             <img 
-              src={comprobanteModal} 
+              src={comprobanteModal.startsWith('/api/') ? `${BACKEND_URL}${comprobanteModal}` : comprobanteModal} 
               alt="Comprobante de pago" 
               className="w-full rounded-xl"
             />
@@ -5,6 +5,8 @@ import axios from 'axios';
 import { Html5Qrcode } from 'html5-qrcode';
 import { LayoutDashboard, Calendar, Settings, LogOut, Tag, ShoppingCart, CreditCard, CheckCircle, XCircle, Scan, Shield, Table2, Camera, RefreshCw, Menu, X, User, Clock, BarChart3, BadgeCheck, Activity } from 'lucide-react';
 import { toast } from 'sonner';
+import { cerrarSesionAdmin } from '../../lib/sesion';
+import { obtenerPuerta, headersPuerta, vincularPuerta, desvincularPuerta } from '../../lib/puerta';
 import { Toaster } from '../../components/ui/sonner';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -19,7 +21,12 @@ const ValidarEntrada = () => {
   const [menuAbierto, setMenuAbierto] = useState(false);
   const [userRole, setUserRole] = useState(null);
   const [codigoManual, setCodigoManual] = useState('');
+  const [candidatosCodigo, setCandidatosCodigo] = useState([]);
   const [modoManual, setModoManual] = useState(false);
+  const [eventos, setEventos] = useState([]);
+  const [puerta, setPuerta] = useState(obtenerPuerta());
+  const [eventoId, setEventoId] = useState(puerta?.evento_id || localStorage.getItem('validar_evento_id') || '');
+  const [nombrePuerta, setNombrePuerta] = useState('');
   const html5QrCodeRef = useRef(null);
 
   useEffect(() => {
@@ -34,13 +41,53 @@ const ValidarEntrada = () => {
       }
     }
     
+    axios.get(`${API}/eventos`)
+      .then((res) => setEventos(res.data || []))
+      .catch(() => setEventos([]));
+    
     return () => {
       stopScanner();
     };
   }, []);
 
+  const seleccionarEvento = (id) => {
+    setEventoId(id);
+    localStorage.setItem('validar_evento_id', id);
+    setCandidatosCodigo([]);
+  };
+
+  const vincularDispositivo = async () => {
+    if (!eventoId || !nombrePuerta.trim()) {
+      toast.error('Elige un evento y escribe el nombre de la puerta');
+      return;
+    }
+    try {
+      const vinculada = await vincularPuerta(eventoId, nombrePuerta.trim(), navigator.userAgent.slice(0, 80));
+      setPuerta(vinculada);
+      setNombrePuerta('');
+      toast.success(`Dispositivo vinculado a ${vinculada.puerta}`);
+    } catch (error) {
+      toast.error(error.response?.data?.detail || 'No se pudo vincular el dispositivo');
+    }
+  };
+
+  const desvincularDispositivo = () => {
+    desvincularPuerta();
+    setPuerta(null);
+    toast.success('Dispositivo desvinculado');
+  };
+
+  // Un token de puerta vencido o revocado deja de enviarse; hay que volver a vincular
+  const revisarTokenPuerta = (error) => {
+    if (puerta && error.response?.status === 401) {
+      desvincularPuerta();
+      setPuerta(null);
+      toast.error('El token de la puerta venció o fue revocado: vuelve a vincular el dispositivo');
+    }
+  };
+
   const handleLogout = () => {
-    localStorage.removeItem('admin_token');
+    cerrarSesionAdmin();
     toast.success('Sesión cerrada');
     navigate('/secure-admin-panel-2026');
   };
@@ -153,14 +200,14 @@ const ValidarEntrada = () => {
       let response = await axios.post(`${API}/validar-entrada`, {
         qr_payload: qrPayload,
         accion: modoEscaneo
-      });
+      }, { headers: headersPuerta() });
 
       // Si no es válido, intentar como acreditación
       if (!response.data.valido) {
         const acredResponse = await axios.post(`${API}/validar-acreditacion`, {
           qr_payload: qrPayload,
           accion: modoEscaneo
-        });
+        }, { headers: headersPuerta() });
         if (acredResponse.data.valido) {
           response = acredResponse;
         }
@@ -177,6 +224,7 @@ const ValidarEntrada = () => {
       }
     } catch (error) {
       console.error('Error validando:', error);
+      revisarTokenPuerta(error);
       const mensajeError = error.response?.data?.detail || 'Error al validar';
       setResultado({
         valido: false,
@@ -188,13 +236,14 @@ const ValidarEntrada = () => {
     }
   };
 
-  const validarCodigoManual = async () => {
-    if (!codigoManual.trim()) {
+  const validarCodigoManual = async (codigoElegido) => {
+    // Desde un candidato llega el código; desde el botón o Enter, lo tecleado
+    const codigo = (typeof codigoElegido === 'string' ? codigoElegido : codigoManual).trim().toUpperCase();
+    if (!codigo) {
       toast.error('Ingresa un código');
       return;
     }
-    
-    const codigo = codigoManual.trim().toUpperCase();
+    setCandidatosCodigo([]);
     
     try {
       let response;
@@ -204,15 +253,19 @@ const ValidarEntrada = () => {
         response = await axios.post(`${API}/validar-acreditacion`, {
           codigo: codigo,
           accion: modoEscaneo
-        });
+        }, { headers: headersPuerta() });
       } else {
+        // Los candidatos ante un error de tipeo solo llegan con token de puerta o sesión del panel
+        const token = localStorage.getItem('admin_token');
         response = await axios.post(`${API}/validar-entrada-codigo`, {
           codigo: codigo,
-          accion: modoEscaneo
-        });
+          accion: modoEscaneo,
+          evento_id: eventoId || undefined
+        }, { headers: { ...headersPuerta(), ...(token ? { Authorization: `Bearer ${token}` } : {}) } });
       }
 
       setResultado(response.data);
+      setCandidatosCodigo(response.data.candidatos || []);
 
       if (response.data.valido) {
         toast.success(response.data.mensaje);
@@ -224,6 +277,7 @@ const ValidarEntrada = () => {
       }
     } catch (error) {
       console.error('Error validando código:', error);
+      revisarTokenPuerta(error);
       const mensajeError = error.response?.data?.detail || 'Código no encontrado';
       setResultado({
         valido: false,
@@ -382,6 +436,50 @@ const ValidarEntrada = () => {
         <main className="flex-1 p-4 lg:p-8">
           <div className="max-w-lg mx-auto">
             
+            {/* Evento en puerta (acota las sugerencias de códigos mal escritos) */}
+            <select
+              value={eventoId}
+              onChange={(e) => seleccionarEvento(e.target.value)}
+              disabled={!!puerta}
+              className="bg-background/50 border border-white/20 rounded-xl px-4 py-3 text-foreground w-full mb-4"
+            >
+              <option value="">Todos los eventos</option>
+              {eventos.map(e => (
+                <option key={e.id} value={e.id}>{e.nombre}</option>
+              ))}
+            </select>
+
+            {/* Puerta del dispositivo: el token la identifica y la limita al evento */}
+            {puerta ? (
+              <div className="glass-card rounded-xl px-4 py-3 mb-4 flex items-center justify-between gap-2">
+                <span className="text-sm text-foreground/80">
+                  Puerta <strong>{puerta.puerta}</strong> · vence {new Date(puerta.expira).toLocaleString()}
+                </span>
+                {userRole === 'admin' && (
+                  <button onClick={desvincularDispositivo} className="text-sm text-red-400 hover:text-red-300">
+                    Desvincular
+                  </button>
+                )}
+              </div>
+            ) : userRole === 'admin' && (
+              <div className="flex gap-2 mb-4">
+                <input
+                  type="text"
+                  value={nombrePuerta}
+                  onChange={(e) => setNombrePuerta(e.target.value)}
+                  placeholder="Puerta de este dispositivo (ej: Norte 1)"
+                  className="flex-1 bg-background/50 border border-white/20 rounded-xl px-4 py-2 text-sm text-foreground focus:outline-none focus:border-primary"
+                />
+                <button
+                  onClick={vincularDispositivo}
+                  disabled={!eventoId}
+                  className="px-4 py-2 rounded-xl text-sm font-medium bg-primary text-white disabled:opacity-50"
+                >
+                  Vincular
+                </button>
+              </div>
+            )}
+
             {/* Mode Toggle - Entrada/Salida */}
             <div className="flex gap-2 mb-4">
               <button
@@ -449,7 +547,7 @@ const ValidarEntrada = () => {
                     Validación Manual
                   </h2>
                   <p className="text-foreground/60 text-sm">
-                    Ingresa el código de la entrada (ej: CF-2026-ABC123)
+                    Ingresa el código de la entrada (ej: CF-2026-7KQ2M-X9H4C)
                   </p>
                 </div>
                 
@@ -457,11 +555,31 @@ const ValidarEntrada = () => {
                   type="text"
                   value={codigoManual}
                   onChange={(e) => setCodigoManual(e.target.value.toUpperCase())}
-                  placeholder="CF-2026-XXXXXX"
+                  placeholder="CF-2026-XXXXX-XXXXX"
                   className="w-full bg-background/50 border border-white/20 rounded-xl px-4 py-4 text-center text-xl font-mono text-foreground focus:outline-none focus:border-primary mb-4"
                   onKeyDown={(e) => e.key === 'Enter' && validarCodigoManual()}
                 />
                 
+                {candidatosCodigo.length > 0 && (
+                  <div className="mb-4">
+                    <p className="text-foreground/60 text-sm mb-2 text-center">¿Quisiste decir?</p>
+                    <div className="flex flex-wrap gap-2 justify-center">
+                      {candidatosCodigo.map((candidato) => (
+                        <button
+                          key={candidato}
+                          onClick={() => {
+                            setCodigoManual(candidato);
+                            validarCodigoManual(candidato);
+                          }}
+                          className="px-3 py-2 rounded-lg bg-primary/20 hover:bg-primary/30 font-mono text-sm text-foreground"
+                        >
+                          {candidato}
+                        </button>
+                      ))}
+                    </div>
+                  </div>
+                )}
+                
                 <motion.button
                   onClick={validarCodigoManual}
                   whileHover={{ scale: 1.02 }}
@@ -50,7 +50,7 @@ class SeatSystemTester:
         """Test GET /api/eventos/{evento_id}/asientos"""
         print("\n1️⃣ Testing GET /api/eventos/{evento_id}/asientos")
         
-        response = requests.get(f"{self.api_url}/eventos/{self.test_evento_id}/asientos")
+        response = requests.get(f"{self.api_url}/eventos/{self.test_evento_id}/asientos", params={"formato": "lista"})
         
         if response.status_code == 200:
             data = response.json()
@@ -144,7 +144,7 @@ class SeatSystemTester:
         print("\n4️⃣ Testing POST /api/comprar-entrada with seat selection")
         
         # First check which seats are available
-        response = requests.get(f"{self.api_url}/eventos/{self.test_evento_id}/asientos")
+        response = requests.get(f"{self.api_url}/eventos/{self.test_evento_id}/asientos", params={"formato": "lista"})
         if response.status_code == 200:
             data = response.json()
             occupied = data.get('asientos_ocupados', [])
@@ -212,7 +212,7 @@ class SeatSystemTester:
         """Test that purchased seats appear in occupied list"""
         print("\n5️⃣ Testing occupied seats tracking")
         
-        response = requests.get(f"{self.api_url}/eventos/{self.test_evento_id}/asientos")
+        response = requests.get(f"{self.api_url}/eventos/{self.test_evento_id}/asientos", params={"formato": "lista"})
         
         if response.status_code == 200:
             data = response.json()
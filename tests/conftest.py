@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Los módulos del backend se importan entre sí por nombre (from capacidad import ...)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
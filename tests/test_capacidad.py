@@ -0,0 +1,72 @@
+from capacidad import capacidad_legado, clave_cupo, cupos_evento, derivar_campos_evento
+
+
+def test_general_con_categorias():
+    evento = {
+        "tipo_asientos": "general",
+        "precio": 10,
+        "configuracion_asientos": {"categorias_generales": [
+            {"nombre": "General", "capacidad": 100, "precio": 10},
+            {"nombre": "VIP", "capacidad": 20, "precio": 50},
+        ]},
+    }
+    derivados = derivar_campos_evento(evento)
+    assert derivados["capacidad_total"] == 120
+    assert derivados["capacidad_por_categoria"] == {"General": 100, "VIP": 20}
+    assert (derivados["precio_minimo"], derivados["precio_maximo"]) == (10, 50)
+
+
+def test_mixto_mesas_y_generales():
+    evento = {
+        "tipo_asientos": "mixto",
+        "precio": 20,
+        "configuracion_asientos": {
+            "mesas": [{"nombre": "Mesa 1", "sillas": 8, "precio": 40}, {"nombre": "Mesa 2"}],
+            "entradas_generales": 50,
+        },
+    }
+    cupos = {c["clave"]: c["capacidad"] for c in cupos_evento(evento)}
+    # Mesas sin categoría son VIP en mixto; sin sillas, 10 por defecto
+    assert cupos == {clave_cupo("mesa", "VIP"): 18, clave_cupo("general", "General"): 50}
+    assert derivar_campos_evento(evento)["capacidad_total"] == 68
+
+
+def test_mesas_sin_sillas_usan_el_defecto():
+    evento = {
+        "tipo_asientos": "mesas",
+        "precio": 20,
+        "configuracion_asientos": {"mesas": [{"nombre": "Mesa 1", "sillas": 8, "precio": 40}, {"nombre": "Mesa 2"}]},
+    }
+    derivados = derivar_campos_evento(evento)
+    assert derivados["capacidad_total"] == 18
+    assert (derivados["precio_minimo"], derivados["precio_maximo"]) == (20, 40)
+
+
+def test_evento_legado_suma_las_vendidas():
+    # Evento general sin configuración: 100 de capacidad, 30 vendidas o pendientes que ya
+    # descontaron asientos_disponibles
+    evento = {"tipo_asientos": "general", "precio": 10, "asientos_disponibles": 70}
+    base = capacidad_legado(evento, 30)
+    assert base == 100
+    assert derivar_campos_evento(evento, base)["capacidad_total"] == 100
+
+
+def test_evento_legado_sin_base_toma_el_resto():
+    # Sin capacidad_base solo se ve lo que queda: por eso el backfill usa capacidad_legado
+    evento = {"tipo_asientos": "general", "precio": 10, "asientos_disponibles": 70}
+    assert derivar_campos_evento(evento)["capacidad_total"] == 70
+
+
+def test_capacidad_legado_no_suma_en_mesas():
+    # En eventos de mesas asientos_disponibles nunca se descontó
+    evento = {"tipo_asientos": "mesas", "asientos_disponibles": 40}
+    assert capacidad_legado(evento, 12) == 40
+
+
+def test_configuracion_manda_sobre_la_base():
+    evento = {
+        "tipo_asientos": "general",
+        "asientos_disponibles": 5,
+        "configuracion_asientos": {"capacidad": 300},
+    }
+    assert derivar_campos_evento(evento, 999)["capacidad_total"] == 300
@@ -0,0 +1,96 @@
+from codigos import (
+    ALFABETO_CROCKFORD,
+    IndiceCodigos,
+    control_valido,
+    digito_control,
+    generar_codigo,
+    normalizar_codigo,
+    tiene_control,
+)
+
+
+def _cambiar(codigo: str, posicion: int) -> str:
+    actual = codigo[posicion]
+    otro = next(c for c in ALFABETO_CROCKFORD if c != actual)
+    return codigo[:posicion] + otro + codigo[posicion + 1:]
+
+
+def test_codigo_generado_tiene_control_valido():
+    for _ in range(200):
+        codigo = generar_codigo()
+        assert codigo.startswith("CF-2026-")
+        assert tiene_control(codigo)
+        assert control_valido(codigo)
+
+
+def test_digito_control_conocido():
+    # Luhn mod 32: el cuerpo completo (con su control) suma 0 módulo 32
+    cuerpo = "7KQ2MX9H4"
+    control = digito_control(cuerpo)
+    assert control in ALFABETO_CROCKFORD
+    assert control_valido(f"CF-2026-{cuerpo[:5]}-{cuerpo[5:]}{control}")
+
+
+def test_un_caracter_cambiado_no_valida():
+    codigo = generar_codigo()
+    for posicion in range(len(codigo)):
+        if codigo[posicion] == "-" or posicion < len("CF-2026-"):
+            continue
+        assert not control_valido(_cambiar(codigo, posicion))
+
+
+def test_transposicion_de_vecinos_casi_siempre_se_detecta():
+    detectadas = total = 0
+    for _ in range(200):
+        codigo = generar_codigo()
+        cuerpo = codigo[-11:].replace("-", "")
+        for i in range(len(cuerpo) - 1):
+            if cuerpo[i] == cuerpo[i + 1]:
+                continue
+            transpuesto = cuerpo[:i] + cuerpo[i + 1] + cuerpo[i] + cuerpo[i + 2:]
+            total += 1
+            detectadas += not control_valido(f"CF-2026-{transpuesto[:5]}-{transpuesto[5:]}")
+    assert detectadas / total > 0.95
+
+
+def test_normalizar_codigo():
+    codigo = generar_codigo()
+    assert normalizar_codigo(f"  {codigo.lower()} ") == codigo
+    # En códigos con control, O -> 0 e I/L -> 1 como en Crockford
+    assert normalizar_codigo("cf-2026-o1lio-abcde") == "CF-2026-01110-ABCDE"
+
+
+def test_codigos_legados_no_se_rechazan_por_control():
+    for legado in ("CF-2026-A1B2C3-XY9Z", "CF-GEN-ABCDEFGH"):
+        assert not tiene_control(legado)
+        assert control_valido(legado)
+
+
+def _entrada(codigo: str, fecha: str = "2026-01-01T00:00:00") -> dict:
+    return {"id": codigo.lower(), "evento_id": "ev", "codigo_alfanumerico": codigo,
+            "nombre_comprador": "Ana", "asiento": None, "fecha_compra": fecha}
+
+
+def test_indice_con_prefijo_ordenado_y_limitado():
+    indice = IndiceCodigos()
+    indice.cargar([_entrada(c) for c in ("CF-2026-BBBBB-00000", "CF-2026-AAAAB-00000", "CF-2026-AAAAA-00000", "CF-X-1")])
+    assert indice.con_prefijo("CF-2026-AAAA", 10) == ["CF-2026-AAAAA-00000", "CF-2026-AAAAB-00000"]
+    assert indice.con_prefijo("CF-2026-", 1) == ["CF-2026-AAAAA-00000"]
+    assert indice.con_prefijo("ZZ", 10) == []
+
+
+def test_indice_candidatos_a_un_error():
+    codigo = generar_codigo()
+    indice = IndiceCodigos()
+    indice.cargar([_entrada(codigo)])
+    assert indice.candidatos(codigo, 5) == [codigo]
+    assert indice.candidatos(_cambiar(codigo, len(codigo) - 2), 5) == [codigo]
+    assert indice.candidatos(_cambiar(_cambiar(codigo, len(codigo) - 2), len(codigo) - 3), 5) == []
+
+
+def test_indice_actualizar_mueve_la_marca():
+    indice = IndiceCodigos()
+    indice.cargar([_entrada("CF-2026-AAAAA-00000", "2026-01-01T00:00:00")])
+    indice.actualizar([_entrada("CF-2026-CCCCC-00000", "2026-01-02T00:00:00")])
+    assert indice.marca == "2026-01-02T00:00:00"
+    assert indice.codigos == ["CF-2026-AAAAA-00000", "CF-2026-CCCCC-00000"]
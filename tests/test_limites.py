@@ -0,0 +1,33 @@
+from limites import PROXIES_CONFIABLES_DEFECTO, LimitadorEscaneos, ip_cliente, redes_confiables
+
+CONFIABLES = redes_confiables(PROXIES_CONFIABLES_DEFECTO)
+INGRESS = "10.0.0.2"
+
+
+def test_clientes_detras_del_ingress_no_comparten_clave():
+    uno = ip_cliente(INGRESS, "203.0.113.7", CONFIABLES)
+    otro = ip_cliente(INGRESS, "198.51.100.4", CONFIABLES)
+    assert (uno, otro) == ("203.0.113.7", "198.51.100.4")
+
+    limitador = LimitadorEscaneos(2, 60)
+    limitador.registrar_fallo(f"ip:{uno}")
+    limitador.registrar_fallo(f"ip:{uno}")
+    assert limitador.reintentar_en(f"ip:{uno}") > 0
+    assert limitador.reintentar_en(f"ip:{otro}") == 0
+
+
+def test_lo_que_agrega_el_cliente_no_cambia_su_ip():
+    # El ingress agrega la IP real a la derecha; lo de la izquierda lo inventa el cliente
+    assert ip_cliente(INGRESS, "1.2.3.4, 203.0.113.7", CONFIABLES) == "203.0.113.7"
+    assert ip_cliente(INGRESS, "1.2.3.4, 203.0.113.7, 10.0.0.9", CONFIABLES) == "203.0.113.7"
+
+
+def test_sin_proxy_confiable_se_ignora_el_header():
+    assert ip_cliente("203.0.113.7", "1.2.3.4", CONFIABLES) == "203.0.113.7"
+    assert ip_cliente(INGRESS, None, CONFIABLES) == INGRESS
+    assert ip_cliente(None, "1.2.3.4", CONFIABLES) == "desconocida"
+
+
+def test_redes_confiables_ignora_entradas_invalidas():
+    redes = redes_confiables("10.1.0.0/16, basura,,::1")
+    assert [str(red) for red in redes] == ["10.1.0.0/16", "::1/128"]
@@ -0,0 +1,113 @@
+import pytest
+
+import mapa_asientos
+from mapa_asientos import OCUPADO, PENDIENTE, MapaAsientos, ubicar_asiento
+
+CONFIGURACION = {"mesas": [
+    {"id": 1, "nombre": "Mesa 1", "sillas": 4, "precio": 100, "categoria": "VIP"},
+    {"id": 2, "nombre": "Mesa 2", "sillas": 6, "precio": 50, "categoria": "General"},
+]}
+
+
+@pytest.fixture
+def mapa():
+    return MapaAsientos("mesas", CONFIGURACION)
+
+
+def test_numeracion_densa_y_alias(mapa):
+    assert mapa.total == 10
+    assert mapa.indice("Mesa 1-Silla1") == 0
+    assert mapa.indice("M1-S1") == 0
+    assert mapa.indice("Mesa 2-Silla1") == 4
+    assert mapa.indice("M2-S6") == 9
+    assert mapa.indice("Mesa 3-Silla1") is None
+    assert mapa.ubicar("M2-S3") == {"mesa_id": "2", "mesa_nombre": "Mesa 2", "silla_numero": 3}
+
+
+def test_retenciones_por_sesion_y_cliente(mapa):
+    mapa.retener([0, 1], "s1", 60, "203.0.113.7")
+    mapa.retener([2], "s2", 60, "203.0.113.7")
+    mapa.retener([3], "s3", 60, "198.51.100.4")
+    assert mapa.retenido_por_otro(0, "s2")
+    assert not mapa.retenido_por_otro(0, "s1")
+    assert mapa.retenidos_de_cliente("203.0.113.7") == 3
+    assert mapa.retenidos_de_cliente("203.0.113.7", excepto_sesion="s1") == 1
+    assert mapa.retenidos_de_cliente("198.51.100.4") == 1
+    mapa.liberar_sesion("s1")
+    assert mapa.retenidos_de_cliente("203.0.113.7") == 1
+    assert "s1" not in mapa.clientes
+
+
+def test_retencion_vencida_se_suelta(mapa):
+    mapa.retener([3], "s1", -1, "203.0.113.7")
+    mapa.expirar_retenciones()
+    assert mapa.contar()["retenidos"] == 0
+    assert mapa.clientes == {}
+
+
+def test_vendida_deja_de_estar_retenida(mapa):
+    mapa.retener([0], "s1", 60)
+    mapa.marcar("Mesa 1-Silla1", PENDIENTE)
+    assert mapa.contar() == {"ocupados": 0, "pendientes": 1, "retenidos": 0}
+
+
+def test_serializar_reutiliza_hasta_el_proximo_cambio(mapa):
+    primero = mapa.serializar()
+    assert mapa.serializar() is primero
+    mapa.marcar("Mesa 1-Silla1", OCUPADO)
+    segundo = mapa.serializar()
+    assert segundo is not primero
+    assert segundo["version"] == mapa.etiqueta_version()
+    assert segundo["ocupados"] == 1
+
+
+def test_marcar_y_deltas(mapa):
+    version = mapa.etiqueta_version()
+    assert mapa.marcar("Mesa 1-Silla2", OCUPADO)
+    assert mapa.marcar("M2-S1", PENDIENTE)
+    assert not mapa.marcar("Mesa 1-Silla2", OCUPADO)  # sin cambio
+    assert mapa.cambios_desde(version) == [[1, 1], [4, 2]]
+    assert mapa.cambios_desde(mapa.etiqueta_version()) == []
+    assert mapa.contar() == {"ocupados": 1, "pendientes": 1, "retenidos": 0}
+    assert mapa.lista("ocupados") == ["Mesa 1-Silla2"]
+
+
+def test_version_de_otro_proceso_fuerza_resync(mapa):
+    mapa.marcar("Mesa 1-Silla1", OCUPADO)
+    ajena = f"otrainst-{mapa.version - 1}"
+    assert mapa_asientos.INSTANCIA != "otrainst"
+    assert mapa.cambios_desde(ajena) is None
+    assert mapa.cambios_desde(str(mapa.version)) is None
+    assert mapa.cambios_desde("basura") is None
+
+
+def test_mapa_reconfigurado_no_da_deltas_a_versiones_del_anterior(mapa):
+    version_vieja = mapa.etiqueta_version()
+    mapa.marcar("Mesa 1-Silla1", OCUPADO)
+    # La carga del mapa nuevo marca sillas (y llena su registro) antes de suceder
+    nuevo = MapaAsientos("mesas", {"mesas": CONFIGURACION["mesas"][:1]})
+    nuevo.version = mapa.version - 5
+    nuevo.marcar("Mesa 1-Silla1", OCUPADO)
+    nuevo.suceder(mapa)
+    assert nuevo.version == mapa.version + 1
+    assert nuevo.cambios_desde(version_vieja) is None
+    assert nuevo.cambios_desde(mapa.etiqueta_version()) is None
+    assert nuevo.cambios_desde(nuevo.etiqueta_version()) == []
+
+
+def test_mejores_asientos_contiguos_mas_baratos_primero(mapa):
+    # Mesa 2 es más barata: el bloque de 3 sale de ahí
+    assert mapa.mejores_asientos(3) == [4, 5, 6]
+    mapa.marcar("M2-S2", OCUPADO)
+    assert mapa.mejores_asientos(3) == [6, 7, 8]
+    assert mapa.mejores_asientos(2, categoria="VIP") == [0, 1]
+    assert mapa.mejores_asientos(11) is None
+
+
+def test_ubicar_asiento_desconocido_se_parsea():
+    assert ubicar_asiento(None, "Mesa 9-Silla2")["silla_numero"] == 2
+    assert ubicar_asiento(None, "Mc0ffee-1234-S3") == {
+        "asiento_tipo": "mesa", "mesa_id": "c0ffee-1234", "mesa_nombre": None, "silla_numero": 3
+    }
+    assert ubicar_asiento(None, None)["asiento_tipo"] == "general"
+    assert ubicar_asiento(None, "palco")["asiento_tipo"] == "otro"